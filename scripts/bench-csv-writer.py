@@ -0,0 +1,102 @@
+import argparse
+import csv
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from bulkcsv import BulkCsvWriter
+from ibdataloader import Instrument, ProductType
+from sinks import write_csv
+
+
+def make_instruments(count: int):
+    instruments = list()
+    for number in range(count):
+        instrument = Instrument(str(100000000 + number), 'INSTRUMENT NUMBER {} OF THE BENCHMARK'.format(number),
+                                'NYSE')
+        instrument.symbol = 'SYM{}'.format(number)
+        instrument.ib_symbol = 'SYM.{}'.format(number)
+        instrument.currency = 'USD'
+        instrument.product_type = ProductType.STOCK
+        instruments.append(instrument)
+
+    return instruments
+
+
+def dict_writer(path, instruments):
+    # as load-ib.py used to write its files, first instrument of the bucket included
+    with open(path, 'w') as csv_file:
+        writer = None
+        for instrument in instruments:
+            if writer is None:
+                writer = csv.DictWriter(csv_file, fieldnames=list(instrument.as_dict().keys()))
+                writer.writeheader()
+
+            writer.writerow(instrument.as_dict())
+
+
+def row_writer(path, instruments):
+    with open(path, 'w', newline='') as csv_file:
+        write_csv(csv_file, instruments)
+
+
+def bulk_writer(path, instruments):
+    with BulkCsvWriter(path, Instrument.fields) as writer:
+        writer.write_records(instruments)
+
+
+def bulk_gzip_writer(path, instruments):
+    with BulkCsvWriter(path + '.gz', Instrument.fields, compress=True) as writer:
+        writer.write_records(instruments)
+
+
+_WRITERS = (('DictWriter', dict_writer), ('csv.writer rows', row_writer), ('bulk', bulk_writer),
+            ('bulk gzip', bulk_gzip_writer))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measuring the throughput of the CSV writers',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+
+    parser.add_argument('--rows', type=int, help='number of instruments per file', default=500000)
+    parser.add_argument('--repeat', type=int, help='number of runs per writer, the best one being kept', default=3)
+    parser.add_argument('--output-dir', type=str, default=None,
+                        help='location of the written files, a temporary directory if not specified')
+    args = parser.parse_args()
+
+    instruments = make_instruments(args.rows)
+    with tempfile.TemporaryDirectory(dir=args.output_dir) as temp_dir:
+        path = os.path.join(temp_dir, 'ib-instr_usd_stk.csv')
+        baseline = None
+        for name, writer in _WRITERS:
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                writer(path, instruments)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            rows_per_second = args.rows / best
+            baseline = rows_per_second if baseline is None else baseline
+            logging.info('%s: %d rows in %.2fs, %.0f rows/s (x%.2f)', name, args.rows, best, rows_per_second,
+                         rows_per_second / baseline)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    logname = os.path.abspath(sys.argv[0]).split(os.sep)[-1].split(".")[0]
+    file_handler = logging.FileHandler(logname + '.log', mode='w')
+    formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    try:
+        main()
+
+    except SystemExit:
+        pass
+    except:
+        logging.exception('error occurred', sys.exc_info()[0])
+        raise
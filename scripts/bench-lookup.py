@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import List
+
+from instrumentindex import InstrumentIndex
+
+
+async def run_client(host: str, port: int, targets: List[str], latencies: List[float]) -> None:
+    """
+    Sends the requests one after the other over a single keep-alive connection.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for target in targets:
+            start = time.perf_counter()
+            writer.write('GET {} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(target, host).encode('latin-1'))
+            await writer.drain()
+            status_line = await reader.readline()
+            content_length = 0
+            while True:
+                header_line = await reader.readline()
+                if header_line in (b'\r\n', b''):
+                    break
+
+                name, _, value = header_line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    content_length = int(value)
+
+            json.loads(await reader.readexactly(content_length))
+            latencies.append(time.perf_counter() - start)
+            if not status_line.startswith(b'HTTP/1.1 200'):
+                logging.warning('%s: %s', target, status_line.decode('latin-1').strip())
+
+    finally:
+        writer.close()
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measuring latency and throughput of serve-ib.py',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+
+    parser.add_argument('--output-dir', type=str, help='location of the index, for picking con ids', default='.')
+    parser.add_argument('--output-prefix', type=str, help='prefix of the output files', default='ib-instr')
+    parser.add_argument('--host', type=str, help='server host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help='server port', default=8642)
+    parser.add_argument('--connections', type=int, help='number of concurrent connections', default=16)
+    parser.add_argument('--requests', type=int, help='total number of requests', default=100000)
+    parser.add_argument('--hot-keys', type=int, default=1000,
+                        help='number of distinct con ids requested, 0 for any con id of the index')
+    args = parser.parse_args()
+
+    index_path = os.path.abspath(os.sep.join((args.output_dir, args.output_prefix + '.idx')))
+    with InstrumentIndex(index_path) as index:
+        if len(index) == 0:
+            logging.error('empty index: %s', index_path)
+            sys.exit(0)
+
+        positions = range(len(index))
+        if args.hot_keys > 0:
+            positions = random.sample(positions, min(args.hot_keys, len(index)))
+
+        targets = ['/conid/{}'.format(index.con_id_at(random.choice(positions))) for _ in range(args.requests)]
+
+    latencies = list()
+
+    async def run_clients():
+        await asyncio.gather(*(run_client(args.host, args.port, targets[client::args.connections], latencies)
+                               for client in range(args.connections)))
+
+    start = time.perf_counter()
+    asyncio.run(run_clients())
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    logging.info('%d requests over %d connections in %.2fs: %.0f requests/s', len(latencies), args.connections,
+                 elapsed, len(latencies) / elapsed)
+    logging.info('latency p50 %.3fms, p95 %.3fms, p99 %.3fms, max %.3fms', percentile(latencies, .5) * 1000,
+                 percentile(latencies, .95) * 1000, percentile(latencies, .99) * 1000, latencies[-1] * 1000)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    logname = os.path.abspath(sys.argv[0]).split(os.sep)[-1].split(".")[0]
+    file_handler = logging.FileHandler(logname + '.log', mode='w')
+    formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    try:
+        main()
+
+    except SystemExit:
+        pass
+    except:
+        logging.exception('error occurred', sys.exc_info()[0])
+        raise
@@ -0,0 +1,98 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+import boto3
+
+from ibdataloader import Instrument, ProductType
+from s3sink import S3Sink
+
+
+def make_instruments(count: int):
+    instruments = list()
+    for number in range(count):
+        instrument = Instrument(str(100000000 + number), 'INSTRUMENT NUMBER {} OF THE BENCHMARK'.format(number),
+                                'NYSE')
+        instrument.symbol = 'SYM{}'.format(number)
+        instrument.ib_symbol = 'SYM.{}'.format(number)
+        instrument.currency = 'USD'
+        instrument.product_type = ProductType.STOCK
+        instruments.append(instrument)
+
+    return instruments
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measuring the throughput of the S3 sink',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+
+    parser.add_argument('--rows', type=int, help='number of instruments per bucket', default=500000)
+    parser.add_argument('--buckets', type=int, help='number of buckets uploaded (at most 10)', default=4)
+    parser.add_argument('--part-size', type=int, help='megabytes per part', default=5)
+    parser.add_argument('--workers', type=int, nargs='+', help='numbers of workers compared', default=[1, 4, 8])
+    parser.add_argument('--latency', type=float, default=.1,
+                        help='simulated latency of each part upload in seconds, against the in-process S3 stand-in')
+    parser.add_argument('--endpoint-url', type=str, default=None,
+                        help='local S3 server (MinIO, moto_server...) used instead of the in-process stand-in')
+    parser.add_argument('--bucket', type=str, help='S3 bucket, created if missing', default='ib-bench')
+    args = parser.parse_args()
+
+    mock = None
+    if args.endpoint_url is None:
+        from moto import mock_aws
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+        mock = mock_aws()
+        mock.start()
+
+    try:
+        client = boto3.client('s3', endpoint_url=args.endpoint_url, region_name='us-east-1')
+        if args.endpoint_url is None and args.latency > 0.:
+            client.meta.events.register('before-send.s3.UploadPart', lambda **kwargs: time.sleep(args.latency))
+
+        if args.bucket not in [bucket['Name'] for bucket in client.list_buckets()['Buckets']]:
+            client.create_bucket(Bucket=args.bucket)
+
+        instruments = make_instruments(args.rows)
+        currencies = ('USD', 'EUR', 'GBP', 'JPY', 'CHF', 'CAD', 'AUD', 'HKD', 'SGD', 'SEK')[:args.buckets]
+        count_rows = args.rows * args.buckets
+        for workers in args.workers:
+            for compress in (False, True):
+                sink = S3Sink(args.bucket, prefix='bench', client=client, part_size=args.part_size * 1024 * 1024,
+                              workers=workers, compress=compress)
+                start = time.monotonic()
+                for currency in currencies:
+                    sink.write(ProductType.STOCK, currency, instruments)
+
+                sink.close()
+                elapsed = time.monotonic() - start
+                size = sum(client.head_object(Bucket=args.bucket, Key=sink.object_key(ProductType.STOCK, currency))
+                           ['ContentLength'] for currency in currencies)
+                logging.info('%d workers%s: %d rows in %.2fs (%.0f rows/s, %.1f MB/s uploaded)', workers,
+                             ' (gzip)' if compress else '', count_rows, elapsed, count_rows / elapsed,
+                             size / elapsed / 1024 / 1024)
+
+    finally:
+        if mock is not None:
+            mock.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    logging.getLogger('botocore').setLevel(logging.WARNING)
+    logname = os.path.abspath(sys.argv[0]).split(os.sep)[-1].split(".")[0]
+    file_handler = logging.FileHandler(logname + '.log', mode='w')
+    formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    try:
+        main()
+
+    except SystemExit:
+        pass
+    except:
+        logging.exception('error occurred', sys.exc_info()[0])
+        raise
@@ -0,0 +1,90 @@
+import argparse
+import csv
+import logging
+import os
+import sys
+import tempfile
+import time
+
+# the in-memory stand-in for the Sheets API is kept with the tests: run with PYTHONPATH=src:tests
+from fakesheets import FakeSheetsSession, fake_client
+from sheetsquota import QuotaScheduler
+from sheetsuploader import UploadTask, upload_spreadsheets
+from sinks import SHEET_COLUMNS
+
+
+def write_input_files(directory: str, spreadsheets: int, worksheets: int, rows: int):
+    tasks = list()
+    for spreadsheet in range(spreadsheets):
+        spreadsheet_id = 'spreadsheet{}'.format(spreadsheet)
+        for worksheet in range(worksheets):
+            worksheet_name = 'cur{}'.format(worksheet)
+            path = os.path.join(directory, 'ib-instr_{}_{}.csv'.format(worksheet_name, spreadsheet_id))
+            with open(path, 'wt', newline='') as csv_file:
+                writer = csv.writer(csv_file)
+                writer.writerow(field for _, field in SHEET_COLUMNS)
+                for number in range(rows):
+                    con_id = 100000000 + (spreadsheet * worksheets + worksheet) * rows + number
+                    writer.writerow((con_id, 'SYM{}'.format(number), 'SYM {}'.format(number),
+                                     'INSTRUMENT {} OF {}'.format(number, worksheet_name)))
+
+            tasks.append(UploadTask(spreadsheet_id, worksheet_name, path))
+
+    return tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measuring the throughput of the Google Sheets uploads offline, '
+                                                 'against the stand-in of the tests (PYTHONPATH=src:tests)',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+
+    parser.add_argument('--spreadsheets', type=int, help='number of spreadsheets', default=6)
+    parser.add_argument('--worksheets', type=int, help='number of worksheets per spreadsheet', default=10)
+    parser.add_argument('--rows', type=int, help='number of rows per worksheet', default=2000)
+    parser.add_argument('--latency', type=float, help='simulated latency of an API call in seconds', default=.2)
+    parser.add_argument('--quota', type=int, help='Sheets API calls allowed per quota period', default=100)
+    parser.add_argument('--quota-period', type=float, help='duration of the quota period in seconds', default=100.)
+    parser.add_argument('--workers', type=int, nargs='+', help='numbers of workers compared', default=[1, 6])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tasks = write_input_files(temp_dir, args.spreadsheets, args.worksheets, args.rows)
+        count_rows = len(tasks) * args.rows
+        for workers in args.workers:
+            for delta in (False, True):
+                session = FakeSheetsSession(latency=args.latency)
+                for spreadsheet in range(args.spreadsheets):
+                    session.create('spreadsheet{}'.format(spreadsheet), ['Sheet1'])
+
+                client = fake_client(session)
+                if delta:
+                    # unchanged files, uploaded once already
+                    upload_spreadsheets(client, tasks, SHEET_COLUMNS, workers=args.spreadsheets)
+                    session.requests.clear()
+
+                scheduler = QuotaScheduler(quota=args.quota, period=args.quota_period)
+                scheduler.install(client)
+                start = time.monotonic()
+                upload_spreadsheets(client, tasks, SHEET_COLUMNS, workers=workers, delta=delta)
+                elapsed = time.monotonic() - start
+                logging.info('%d workers%s: %d rows in %.2fs (%.0f rows/s), %d API calls, %.1fs waiting for quota',
+                             workers, ' (delta)' if delta else '', count_rows, elapsed, count_rows / elapsed,
+                             scheduler.count_calls, scheduler.time_waited)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    logname = os.path.abspath(sys.argv[0]).split(os.sep)[-1].split(".")[0]
+    file_handler = logging.FileHandler(logname + '.log', mode='w')
+    formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    try:
+        main()
+
+    except SystemExit:
+        pass
+    except:
+        logging.exception('error occurred', sys.exc_info()[0])
+        raise
@@ -0,0 +1,209 @@
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import List
+
+import cachecodec
+import ibdataloader
+import pagecache
+from cachebackend import BACKEND_FILES, BACKEND_SQLITE
+from ibdataloader import ProductType
+from parsecache import ParseCache
+
+_EXCHANGE_PAGE_MARKER = 'f=2222'
+
+
+def compress(args):
+    """
+    Rewrites the cache entries with the requested compression, optionally training a new dictionary first.
+    """
+    compression = args.compression if args.compression != 'none' else None
+    previous_dictionary = pagecache.load_dictionary(args.use_cache)
+    if args.train_dictionary:
+        samples = pagecache.sample_entries(args.samples, lambda url: _EXCHANGE_PAGE_MARKER in url)
+        if not samples:
+            logging.error('no exchange listing page found in cache for training a dictionary')
+            sys.exit(1)
+
+        logging.info('training dictionary on %d sample pages', len(samples))
+        dictionary = cachecodec.train_dictionary(samples, size=args.dictionary_size * 1024)
+        # both dictionaries are kept by their id before any entry is rewritten: whenever the rewrite is interrupted,
+        # every entry remains readable and the previous dictionary remains the current one
+        if previous_dictionary is not None:
+            pagecache.save_dictionary(args.use_cache, previous_dictionary, current=False)
+
+        pagecache.save_dictionary(args.use_cache, dictionary, current=False)
+        pagecache.set_compression(compression, dictionary, read_dictionaries=pagecache.load_dictionaries(args.use_cache))
+        count_entries, size_before, size_after = pagecache.rewrite_entries()
+        pagecache.save_dictionary(args.use_cache, dictionary)
+        pagecache.remove_dictionaries(args.use_cache, keep=[dictionary])
+        logging.info('saved dictionary %s (%d bytes)', pagecache.dictionary_path(args.use_cache), len(dictionary))
+
+    else:
+        count_entries, size_before, size_after = pagecache.rewrite_entries()
+
+    logging.info('rewrote %d entries: %d bytes before, %d bytes after', count_entries, size_before, size_after)
+
+
+def parse_product_types(product_type_codes: List[str]) -> List[ProductType]:
+    allowed_types = set(prod_type.value for prod_type in ProductType)
+    if not set(product_type_codes).issubset(allowed_types):
+        logging.error('some instrument types are not defined: %s', set(product_type_codes).difference(allowed_types))
+        sys.exit(0)
+
+    return list(prod_type for prod_type in ProductType if prod_type.value in product_type_codes)
+
+
+def prefetch(args):
+    """
+    Loads all the pages of the product types into the cache, without writing any output.
+    """
+    product_types = parse_product_types(args.product_types)
+    if not product_types:
+        product_types = list(ProductType)
+
+    parse_cache_path = os.path.abspath(os.path.sep.join([args.use_cache, 'ib-instr-parsecache']))
+    ibdataloader.set_parse_cache(ParseCache(parse_cache_path))
+    ibdataloader.set_rate_limit(args.requests_per_second)
+    logging.info('prefetching product types %s', product_types)
+    try:
+        count_instruments = ibdataloader.prefetch(product_types, workers=args.workers, page_workers=args.page_workers)
+        logging.info('prefetched pages for %d instruments', count_instruments)
+
+    finally:
+        logging.info('page cache: %s', pagecache.stats())
+        pagecache.save_stats(args.use_cache)
+        ibdataloader.set_parse_cache(None)
+
+
+def stats(args):
+    """
+    Prints the content of the cache and the counts of the last run.
+    """
+    cache_summary = pagecache.summary()
+    print('entries: {}'.format(cache_summary.entries))
+    print('size: {:.1f} MB'.format(cache_summary.size / (1024 * 1024)))
+    print('age:')
+    for label, count in cache_summary.ages:
+        print(' - {}: {}'.format(label, count))
+
+    last_stats = pagecache.load_stats(args.use_cache)
+    if last_stats is None:
+        print('no statistics recorded for the last run')
+        return
+
+    saved, last_counts = last_stats
+    print('last run ({:%Y-%m-%d %H:%M}):'.format(saved))
+    for outcome in ('hit', 'miss', 'not_modified', 'unchanged', 'changed', 'rejected'):
+        print(' - {}: {}'.format(outcome, last_counts.get(outcome, 0)))
+
+
+def prune(args):
+    """
+    Removes the entries of the specified product types and/or older than the specified number of days.
+    """
+    product_types = parse_product_types(args.product_types)
+    if not product_types and args.older_than is None:
+        logging.error('specify product types and/or --older-than')
+        sys.exit(0)
+
+    older_than = datetime.now() - timedelta(days=args.older_than) if args.older_than is not None else None
+    url_filter = None
+    if product_types:
+        def url_filter(url):
+            return ibdataloader.url_product_type(url) in product_types
+
+    count_removed = pagecache.prune(older_than, url_filter)
+    logging.info('removed %d entries', count_removed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Managing the cache of IBrokers pages',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+
+    parser.add_argument('--use-cache', type=str, help='directory for caching web requests', required=True)
+    parser.add_argument('--cache-backend', choices=(BACKEND_FILES, BACKEND_SQLITE), default=BACKEND_FILES,
+                        help='cache storage: one file per page, or a single database file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_compress = subparsers.add_parser('compress', help='compresses (or decompresses) existing entries in place',
+                                            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser_compress.add_argument('--compression', choices=('none',) + tuple(cachecodec.available_methods()),
+                                 default=cachecodec.default_method(), help='compression of the entries')
+    parser_compress.add_argument('--train-dictionary', action='store_true',
+                                 help='trains a new dictionary on exchange listing pages from the cache')
+    parser_compress.add_argument('--samples', type=int, default=1000,
+                                 help='maximum number of pages used for training the dictionary')
+    parser_compress.add_argument('--dictionary-size', type=int, default=112, help='dictionary size in KB')
+    parser_compress.set_defaults(command_func=compress)
+
+    parser_prefetch = subparsers.add_parser('prefetch', help='loads all the pages of the product types',
+                                            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser_prefetch.add_argument('--cache-expiry', type=int, default=20,
+                                 help='number of days before cached pages are revalidated with the server')
+    parser_prefetch.add_argument('--cache-max-size', type=int, default=None,
+                                 help='megabytes of cached pages beyond which least recently used pages are evicted '
+                                      '(sqlite)')
+    parser_prefetch.add_argument('--cache-compression', choices=('none',) + tuple(cachecodec.available_methods()),
+                                 default='none', help='compression of the pages written to the cache')
+    parser_prefetch.add_argument('--workers', type=int, help='number of exchanges loaded concurrently', default=1)
+    parser_prefetch.add_argument('--page-workers', type=int, default=1,
+                                 help='number of pages loaded concurrently for each exchange')
+    parser_prefetch.add_argument('--requests-per-second', type=float, default=1. / 3.,
+                                 help='maximum rate of requests sent to each host')
+    parser_prefetch.add_argument('product_types', type=str, nargs='*',
+                                 help='prefetch specified product types, or all if not specified')
+    parser_prefetch.set_defaults(command_func=prefetch)
+
+    parser_stats = subparsers.add_parser('stats', help='shows the size and age of the entries and the counts of the '
+                                                       'last run')
+    parser_stats.set_defaults(command_func=stats)
+
+    parser_prune = subparsers.add_parser('prune', help='removes entries by product type and/or age',
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser_prune.add_argument('--older-than', type=int, default=None,
+                              help='removes the entries stored more than this number of days ago')
+    parser_prune.add_argument('product_types', type=str, nargs='*',
+                              help='removes the product type and exchange pages of the specified product types '
+                                   '(region pages are shared)')
+    parser_prune.set_defaults(command_func=prune)
+    args = parser.parse_args()
+
+    if args.command == 'compress':
+        compression = args.compression
+
+    else:
+        compression = getattr(args, 'cache_compression', 'none')
+
+    max_size = getattr(args, 'cache_max_size', None)
+    pagecache.open_cache(args.use_cache, args.cache_backend, expiry_days=getattr(args, 'cache_expiry', None),
+                         max_bytes=max_size * 1024 * 1024 if max_size is not None else None,
+                         compression=compression if compression != 'none' else None)
+    try:
+        args.command_func(args)
+
+    finally:
+        pagecache.set_backend(None)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    logging.getLogger('requests').setLevel(logging.WARNING)
+    logname = os.path.abspath(sys.argv[0]).split(os.sep)[-1].split(".")[0]
+    file_handler = logging.FileHandler(logname + '.log', mode='w')
+    formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    try:
+        main()
+
+    except SystemExit as exit_error:
+        if exit_error.code:
+            raise
+
+    except:
+        logging.exception('error occurred', sys.exc_info()[0])
+        raise
@@ -0,0 +1,41 @@
+import argparse
+import logging
+import os
+import sys
+
+import snapshotdiff
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Comparing two snapshots of instruments data from IBrokers',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+
+    parser.add_argument('previous_dir', type=str, help='location of the previous instrument files')
+    parser.add_argument('current_dir', type=str, help='location of the current instrument files')
+    parser.add_argument('--output-dir', type=str, help='location of the delta files', default='.')
+    parser.add_argument('--prefix', type=str, help='prefix of the instrument files', default='ib-instr')
+    parser.add_argument('--memory-budget', type=int, default=64,
+                        help='megabytes of rows kept in memory by each sort before spilling to disk')
+    args = parser.parse_args()
+
+    logging.info('comparing %s with %s', os.path.abspath(args.current_dir), os.path.abspath(args.previous_dir))
+    snapshotdiff.diff_snapshots(args.previous_dir, args.current_dir, args.output_dir, prefix=args.prefix,
+                                memory_budget=args.memory_budget * 1024 * 1024)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    logname = os.path.abspath(sys.argv[0]).split(os.sep)[-1].split(".")[0]
+    file_handler = logging.FileHandler(logname + '.log', mode='w')
+    formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    try:
+        main()
+
+    except SystemExit:
+        pass
+    except:
+        logging.exception('error occurred', sys.exc_info()[0])
+        raise
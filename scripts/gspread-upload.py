@@ -1,15 +1,16 @@
 import argparse
-import csv
 import json
 import logging
 import os
 import sys
 
 from collections import defaultdict
-from time import sleep
 
 import gservices
 import ibdataloader
+from sheetsquota import QuotaScheduler
+from sheetsuploader import UploadTask, upload_spreadsheets
+from sinks import SHEET_COLUMNS
 
 _DEFAULT_CONFIG_FILE = os.sep.join(('.', 'config-gspread-upload.json'))
 _DEFAULT_GOOGLE_SVC_ACCT_CREDS_FILE = os.sep.join(('.', 'google-service-account-creds.json'))
@@ -36,6 +37,11 @@ def main():
                         help=help_msg_creds.format(_DEFAULT_GOOGLE_SVC_ACCT_CREDS_FILE),
                         default=_DEFAULT_GOOGLE_SVC_ACCT_CREDS_FILE
                         )
+    parser.add_argument('--quota', type=int, help='Sheets API calls allowed per quota period for the user', default=100)
+    parser.add_argument('--quota-period', type=float, help='duration of the quota period in seconds', default=100.)
+    parser.add_argument('--workers', type=int, help='number of spreadsheets uploaded concurrently', default=4)
+    parser.add_argument('--delta', action='store_true',
+                        help='only send the rows that changed since the previous upload, matched on conid')
     parser.add_argument('product_types', type=str, nargs='*',
                         help='download specified product types, or all if not specified')
     args = parser.parse_args()
@@ -57,13 +63,13 @@ def main():
             raise RuntimeError('Key {} is missing from config file'.format(config_key))
 
     product_type_codes = set(args.product_types)
-    if not product_type_codes.issubset(ibdataloader.get_product_type_codes()):
-        allowed_types = ibdataloader.get_product_type_codes()
+    allowed_types = set(prod_type.value for prod_type in ibdataloader.ProductType)
+    if not product_type_codes.issubset(allowed_types):
         logging.error('some instrument types are not defined: %s', product_type_codes.difference(allowed_types))
         sys.exit(0)
 
     if not product_type_codes:
-        product_type_codes = ibdataloader.get_product_type_codes()
+        product_type_codes = allowed_types
 
     logging.info('loading product types {}'.format(product_type_codes))
 
@@ -88,40 +94,36 @@ def main():
 
     # saving to Google drive
     logging.info('sending credentials: "%s"', args.google_creds)
-    svc_sheet = gservices.authorize_gspread(args.google_creds)
+    quota_scheduler = QuotaScheduler(quota=args.quota, period=args.quota_period)
+    svc_sheet = gservices.authorize_gspread(args.google_creds, quota_scheduler)
 
+    tasks = list()
     for input_file in sorted(available_files):
         input_category = check_input(input_file, args.input_prefix)
         if len(input_category) != 3:
             continue
 
         _, currency, product_type_code = input_category
-        if product_type_code not in args.product_types:
-            logging.info('skipping product type %s, not in %s', product_type_code, args.product_types)
+        if product_type_code not in product_type_codes:
+            logging.info('skipping product type %s, not in %s', product_type_code, product_type_codes)
             continue
 
-        sleep(100)  # gives Google some time to breathe (limit is 100 requests within a 100s period for any given user)
-        logging.info("processing product type '%s', currency '%s'", product_type_code, currency)
-
         if product_type_code.lower() in config_json['spreadsheets']:
-            rows = list()
-            with open(os.path.join(args.input_dir, input_file)) as csvfile:
-                reader = csv.DictReader(csvfile, delimiter=',')
-                for row in reader:
-                    rows.append(row)
-
             spreadsheet_id = config_json['spreadsheets'][product_type_code.lower()]
-            header = ('conid', 'symbol', 'ib_symbol', 'label')
-            logging.info('updating spreadsheet %s', spreadsheet_id)
-            new_worksheet = gservices.update_spreadsheet(svc_sheet, spreadsheet_id, currency, rows, header)
-            gservices.auto_resize_column(new_worksheet, 4)
+            tasks.append(UploadTask(spreadsheet_id, currency, os.path.join(args.input_dir, input_file)))
 
         else:
             logging.info("missing key '%s' in config 'spreadsheets': not saving to Google sheet", product_type_code.lower())
 
-    for product_type_code in config_json['spreadsheets']:
-        spreadsheet_id = config_json['spreadsheets'][product_type_code.lower()]
-        gservices.clean_spreadsheet(svc_sheet, spreadsheet_id, currencies[product_type_code.lower()])
+    kept_worksheets = {config_json['spreadsheets'][product_type_code.lower()]: currencies[product_type_code.lower()]
+                       for product_type_code in config_json['spreadsheets']}
+    for result in upload_spreadsheets(svc_sheet, tasks, SHEET_COLUMNS, workers=args.workers, delta=args.delta,
+                                      kept_worksheets=kept_worksheets):
+        if result.removed:
+            logging.info('spreadsheet %s: removed worksheets %s', result.spreadsheet_id, result.removed)
+
+    logging.info('%d Sheets API calls, %d retried after exceeding the quota, %.0fs spent waiting',
+                 quota_scheduler.count_calls, quota_scheduler.count_retries, quota_scheduler.time_waited)
 
 
 if __name__ == '__main__':
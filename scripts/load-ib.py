@@ -1,15 +1,22 @@
 import argparse
-import csv
 import logging
 import os
 import sys
 from typing import Iterable
 
+import cachecodec
 import ibdataloader
+import ibextract
+import pagecache
+import snapshotdiff
+from cachebackend import BACKEND_FILES, BACKEND_SQLITE
+from crawljournal import CrawlJournal
 from ibdataloader import Instrument, ProductType
-from webscrapetools.urlcaching import set_cache_path
-
-_FILENAME_SEPARATOR = '_'
+from instrumentindex import IndexBuilder
+from parsecache import ParseCache
+from pipeline import Pipeline
+from sinks import CsvSink, GzipCsvSink
+from trigramindex import TrigramIndexBuilder
 
 
 def main():
@@ -21,7 +28,47 @@ def main():
     parser.add_argument('--output-prefix', type=str, help='prefix for the output files', default='ib-instr')
     parser.add_argument('--list-product-types', action='store_true', help='only displays available product types')
     parser.add_argument('--use-cache', type=str, help='directory for caching web requests', default=None)
-    parser.add_argument('--cache-expiry', type=int, help='number of days for cache expiry', default=20)
+    parser.add_argument('--cache-expiry', type=int, default=20,
+                        help='number of days before cached pages are revalidated with the server')
+    parser.add_argument('--cache-backend', choices=(BACKEND_FILES, BACKEND_SQLITE), default=BACKEND_FILES,
+                        help='cache storage: one file per page, or a single database file')
+    parser.add_argument('--cache-max-size', type=int, default=None,
+                        help='megabytes of cached pages beyond which least recently used pages are evicted (sqlite)')
+    parser.add_argument('--cache-compression', choices=('none',) + tuple(cachecodec.available_methods()),
+                        default='none', help='compression of the pages written to the cache')
+    parser.add_argument('--workers', type=int, help='number of exchanges loaded concurrently', default=1)
+    parser.add_argument('--page-workers', type=int, help='number of pages loaded concurrently for each exchange',
+                        default=1)
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), help='engine used for loading pages',
+                        default='threads')
+    parser.add_argument('--concurrency', type=int, help='maximum number of requests in flight (asyncio engine)',
+                        default=20)
+    parser.add_argument('--extractor', choices=ibextract.extractor_names(),
+                        help='html extraction implementation, "parity" checks lxml against bs4', default='lxml')
+    parser.add_argument('--parser-processes', type=int, default=0,
+                        help='number of processes extracting instruments from pages, 0 for the loading threads')
+    parser.add_argument('--memory-budget', type=int, default=None,
+                        help='megabytes of pending instruments kept in memory before spilling to disk, '
+                             'saving each product type as soon as it is loaded')
+    parser.add_argument('--requests-per-second', type=float, help='maximum rate of requests sent to each host',
+                        default=1. / 3.)
+    parser.add_argument('--previous-dir', type=str, default=None,
+                        help='location of the previous output files, writes delta files to the output directory')
+    parser.add_argument('--parquet', action='store_true',
+                        help='also writes the run as a Parquet dataset partitioned by product type and currency')
+    parser.add_argument('--index', action='store_true',
+                        help='also writes a con id / symbol lookup index of the run (see instrumentindex)')
+    parser.add_argument('--search-index', action='store_true',
+                        help='also writes a trigram index for fuzzy search of labels and symbols (see trigramindex)')
+    parser.add_argument('--gzip', action='store_true', help='compresses the CSV files (.csv.gz)')
+    parser.add_argument('--s3-bucket', type=str, default=None,
+                        help='also uploads the CSV files to this S3 bucket, using the default AWS credentials')
+    parser.add_argument('--s3-prefix', type=str, default=None,
+                        help='prefix of the S3 object keys, the output prefix if not specified')
+    parser.add_argument('--s3-workers', type=int, help='number of parts uploaded concurrently to S3', default=4)
+    parser.add_argument('--s3-part-size', type=int, help='megabytes per part of the S3 multipart uploads', default=8)
+    parser.add_argument('--resume', action='store_true',
+                        help='resumes an interrupted run, reusing the exchange pages recorded in its journal')
     parser.add_argument('product_types', type=str, nargs='*',
                         help='download specified product types, or all if not specified')
     args = parser.parse_args()
@@ -33,10 +80,36 @@ def main():
 
         return
 
+    if args.previous_dir is not None and os.path.abspath(args.previous_dir) == os.path.abspath(args.output_dir):
+        logging.error('previous files would be overwritten before being compared: %s', args.previous_dir)
+        sys.exit(0)
+
+    if args.previous_dir is not None and args.gzip:
+        logging.error('delta files are only available for uncompressed CSV files')
+        sys.exit(0)
+
     if args.use_cache:
-        cache_path = os.path.abspath(os.path.sep.join([args.use_cache, 'ib-instr-urlcaching']))
-        logging.info('using cache %s for web requests (expiring after %d days)', cache_path, args.cache_expiry)
-        set_cache_path(cache_path, expiry_days=args.cache_expiry)
+        logging.info('using cache %s for web requests (revalidated after %d days)', args.use_cache, args.cache_expiry)
+        max_bytes = args.cache_max_size * 1024 * 1024 if args.cache_max_size is not None else None
+        compression = args.cache_compression if args.cache_compression != 'none' else None
+        pagecache.open_cache(args.use_cache, args.cache_backend, expiry_days=args.cache_expiry, max_bytes=max_bytes,
+                             compression=compression)
+        parse_cache_path = os.path.abspath(os.path.sep.join([args.use_cache, 'ib-instr-parsecache']))
+        logging.info('using cache %s for extracted pages', parse_cache_path)
+        ibdataloader.set_parse_cache(ParseCache(parse_cache_path))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    journal_path = os.path.abspath(os.sep.join((args.output_dir, args.output_prefix + '-journal.db')))
+    if args.resume and not os.path.isfile(journal_path):
+        logging.warning('no journal found in %s, starting from scratch', journal_path)
+
+    journal = CrawlJournal(journal_path, resume=args.resume)
+    logging.info('recording crawl in journal %s (%d product types, %d pages already done)',
+                 journal_path, *journal.count_units())
+    ibdataloader.set_journal(journal)
+    ibdataloader.set_rate_limit(args.requests_per_second)
+    ibdataloader.set_extractor(args.extractor)
+    ibdataloader.set_parser_processes(args.parser_processes)
 
     product_type_codes = set(args.product_types)
     if not product_type_codes.issubset(set(prod_type.value for prod_type in ibdataloader.ProductType)):
@@ -52,28 +125,88 @@ def main():
 
     logging.info('loading product types {}'.format(product_types))
 
+    parquet_sink = None
+    if args.parquet:
+        from parquetsink import ParquetSink
+        parquet_sink = ParquetSink(os.sep.join((args.output_dir, args.output_prefix + '.parquet')))
+        logging.info('writing Parquet dataset %s', parquet_sink.dataset_path)
+
+    index_builder = IndexBuilder() if args.index else None
+    search_index_builder = TrigramIndexBuilder() if args.search_index else None
+
+    logging.info('saving results to %s', os.path.abspath(args.output_dir))
+    sinks = [GzipCsvSink(args.output_dir, args.output_prefix) if args.gzip
+             else CsvSink(args.output_dir, args.output_prefix)]
+    if args.s3_bucket is not None:
+        from s3sink import S3Sink
+        s3_prefix = args.s3_prefix if args.s3_prefix is not None else args.output_prefix
+        logging.info('uploading results to s3://%s/%s', args.s3_bucket, s3_prefix)
+        sinks.append(S3Sink(args.s3_bucket, s3_prefix, part_size=args.s3_part_size * 1024 * 1024,
+                            workers=args.s3_workers, compress=args.gzip))
+
+    pipeline = Pipeline(sinks)
+
     # noinspection PyTypeChecker
     def results_writer(product_type: ProductType, currency: str, instruments: Iterable[Instrument]) -> None:
-        # saving to local drive
-        logging.info('saving results to %s', os.path.abspath(args.output_dir))
-        os.makedirs(args.output_dir, exist_ok=True)
-        output_filename = args.output_prefix + _FILENAME_SEPARATOR + currency.lower() + _FILENAME_SEPARATOR + product_type.value + '.csv'
-        output_path = os.path.abspath(os.sep.join((args.output_dir, output_filename)))
-        with open(output_path, 'w') as csv_file:
-            is_first = True
-            for instrument in instruments:
-                if is_first:
-                    writer = csv.DictWriter(csv_file, fieldnames=list(instrument.as_dict().keys()))
-                    writer.writeheader()
-                    is_first = False
-
-                else:
-                    as_dict = instrument.as_dict()
-                    writer.writerow(as_dict)
-
-        logging.info('saved file: %s', output_path)
-
-    ibdataloader.process_instruments(product_types, results_writer)
+        if parquet_sink is not None:
+            instruments = parquet_sink.passing_through(product_type, currency, instruments)
+
+        if index_builder is not None:
+            instruments = index_builder.passing_through(product_type, currency, instruments)
+
+        if search_index_builder is not None:
+            instruments = search_index_builder.passing_through(product_type, currency, instruments)
+
+        pipeline(product_type, currency, instruments)
+
+    memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None
+    try:
+        with pipeline:
+            if args.engine == 'asyncio':
+                import ibasyncloader
+                ibasyncloader.process_instruments(product_types, results_writer, concurrency=args.concurrency,
+                                                  memory_budget=memory_budget)
+
+            else:
+                ibdataloader.process_instruments(product_types, results_writer, workers=args.workers,
+                                                 page_workers=args.page_workers, memory_budget=memory_budget)
+
+    finally:
+        ibdataloader.set_parser_processes(0)
+        # reported by cache-ib.py stats, including for failed runs
+        if pagecache.is_enabled():
+            pagecache.save_stats(args.use_cache)
+
+    if args.extractor == 'parity':
+        logging.info('extractor parity: %d mismatches', ibdataloader.extractor_mismatches())
+
+    if index_builder is not None:
+        index_path = os.path.abspath(os.sep.join((args.output_dir, args.output_prefix + '.idx')))
+        index_builder.write(index_path)
+        logging.info('saved index of %d instruments: %s', len(index_builder), index_path)
+
+    if search_index_builder is not None:
+        search_index_path = os.path.abspath(os.sep.join((args.output_dir, args.output_prefix + '.tri')))
+        search_index_builder.write(search_index_path)
+        logging.info('saved search index of %d instruments: %s', len(search_index_builder), search_index_path)
+
+    ibdataloader.set_journal(None)
+    journal.close()
+    # run complete, nothing left to resume
+    for journal_file_path in (journal_path, journal_path + '-wal', journal_path + '-shm'):
+        if os.path.isfile(journal_file_path):
+            os.remove(journal_file_path)
+
+    if args.previous_dir is not None:
+        snapshotdiff.diff_snapshots(args.previous_dir, args.output_dir, args.output_dir, prefix=args.output_prefix,
+                                    product_type_codes=[product_type.value for product_type in product_types])
+
+    if pagecache.is_enabled():
+        logging.info('page cache: %s', pagecache.stats())
+        pagecache.set_backend(None)
+
+    if ibdataloader.get_parse_cache() is not None:
+        logging.info('parse cache: %s', ibdataloader.get_parse_cache().stats())
 
 
 if __name__ == '__main__':
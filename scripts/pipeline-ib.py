@@ -0,0 +1,137 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+import ibdataloader
+import pagecache
+from cachebackend import BACKEND_FILES, BACKEND_SQLITE
+from pipeline import Pipeline
+from sinks import CsvSink, SheetsSink
+
+_DEFAULT_CONFIG_FILE = os.sep.join(('.', 'config-gspread-upload.json'))
+_DEFAULT_GOOGLE_SVC_ACCT_CREDS_FILE = os.sep.join(('.', 'google-service-account-creds.json'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Loading instruments data from IBrokers straight into the outputs',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+
+    parser.add_argument('--output-dir', type=str, help='location of output directory', default='.')
+    parser.add_argument('--output-prefix', type=str, help='prefix for the output files', default='ib-instr')
+    parser.add_argument('--csv', action='store_true', help='writes one CSV file per product type and currency')
+    parser.add_argument('--parquet', action='store_true',
+                        help='writes the run as a Parquet dataset partitioned by product type and currency')
+    parser.add_argument('--sheets', action='store_true',
+                        help='uploads each product type and currency to Google Sheets as soon as it is loaded')
+    parser.add_argument('--config', metavar='JSON_FILENAME', type=str, default=_DEFAULT_CONFIG_FILE,
+                        help='location of the config file listing the spreadsheets (see gspread-upload.py)')
+    parser.add_argument('--google-creds', metavar='GOOGLE_SERVICE_ACCOUNT_CREDS_JSON', type=str,
+                        default=_DEFAULT_GOOGLE_SVC_ACCT_CREDS_FILE,
+                        help='location of Google Service Account Credentials file')
+    parser.add_argument('--delta', action='store_true',
+                        help='only sends the rows that changed since the previous upload, matched on conid')
+    parser.add_argument('--clean-sheets', action='store_true',
+                        help='removes the worksheets of the currencies that were not loaded')
+    parser.add_argument('--quota', type=int, help='Sheets API calls allowed per quota period for the user', default=100)
+    parser.add_argument('--quota-period', type=float, help='duration of the quota period in seconds', default=100.)
+    parser.add_argument('--queue-size', type=int, default=16,
+                        help='number of chunks of 1000 instruments waiting for each output before the crawl waits')
+    parser.add_argument('--use-cache', type=str, help='directory for caching web requests', default=None)
+    parser.add_argument('--cache-expiry', type=int, default=20,
+                        help='number of days before cached pages are revalidated with the server')
+    parser.add_argument('--cache-backend', choices=(BACKEND_FILES, BACKEND_SQLITE), default=BACKEND_FILES,
+                        help='cache storage: one file per page, or a single database file')
+    parser.add_argument('--workers', type=int, help='number of exchanges loaded concurrently', default=1)
+    parser.add_argument('--page-workers', type=int, help='number of pages loaded concurrently for each exchange',
+                        default=1)
+    parser.add_argument('--memory-budget', type=int, default=None,
+                        help='megabytes of pending instruments kept in memory before spilling to disk, '
+                             'passing on each product type as soon as it is loaded')
+    parser.add_argument('--requests-per-second', type=float, help='maximum rate of requests sent to each host',
+                        default=1. / 3.)
+    parser.add_argument('product_types', type=str, nargs='*',
+                        help='download specified product types, or all if not specified')
+    args = parser.parse_args()
+
+    product_type_codes = set(args.product_types)
+    allowed_types = set(prod_type.value for prod_type in ibdataloader.ProductType)
+    if not product_type_codes.issubset(allowed_types):
+        logging.error('some instrument types are not defined: %s', product_type_codes.difference(allowed_types))
+        sys.exit(0)
+
+    product_types = list(prod_type for prod_type in ibdataloader.ProductType
+                         if not product_type_codes or prod_type.value in product_type_codes)
+    logging.info('loading product types {}'.format(product_types))
+
+    sinks = list()
+    if args.csv:
+        logging.info('writing CSV files to %s', os.path.abspath(args.output_dir))
+        sinks.append(CsvSink(args.output_dir, args.output_prefix))
+
+    if args.parquet:
+        from parquetsink import ParquetSink
+        parquet_sink = ParquetSink(os.sep.join((args.output_dir, args.output_prefix + '.parquet')))
+        logging.info('writing Parquet dataset %s', parquet_sink.dataset_path)
+        sinks.append(parquet_sink)
+
+    quota_scheduler = None
+    if args.sheets:
+        import gservices
+        from sheetsquota import QuotaScheduler
+        for path in (args.google_creds, args.config):
+            if not os.path.isfile(path):
+                raise RuntimeError('unable to load file: {}'.format(os.path.abspath(path)))
+
+        with open(args.config, 'rt') as config_file:
+            spreadsheet_ids = {product_type_code.lower(): spreadsheet_id for product_type_code, spreadsheet_id
+                               in json.load(config_file)['spreadsheets'].items()}
+
+        quota_scheduler = QuotaScheduler(quota=args.quota, period=args.quota_period)
+        svc_sheet = gservices.authorize_gspread(args.google_creds, quota_scheduler)
+        sinks.append(SheetsSink(svc_sheet, spreadsheet_ids, delta=args.delta, clean=args.clean_sheets))
+
+    if not sinks:
+        logging.error('no output selected: use --csv, --parquet and/or --sheets')
+        sys.exit(0)
+
+    if args.use_cache:
+        logging.info('using cache %s for web requests (revalidated after %d days)', args.use_cache, args.cache_expiry)
+        pagecache.open_cache(args.use_cache, args.cache_backend, expiry_days=args.cache_expiry)
+
+    ibdataloader.set_rate_limit(args.requests_per_second)
+    memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None
+    try:
+        with Pipeline(sinks, queue_size=args.queue_size) as pipeline:
+            ibdataloader.process_instruments(product_types, pipeline, workers=args.workers,
+                                             page_workers=args.page_workers, memory_budget=memory_budget)
+
+    finally:
+        if pagecache.is_enabled():
+            pagecache.save_stats(args.use_cache)
+            pagecache.set_backend(None)
+
+    if quota_scheduler is not None:
+        logging.info('%d Sheets API calls, %d retried after exceeding the quota, %.0fs spent waiting',
+                     quota_scheduler.count_calls, quota_scheduler.count_retries, quota_scheduler.time_waited)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    logging.getLogger('requests').setLevel(logging.WARNING)
+    logging.getLogger('googleapiclient.discovery').setLevel(logging.WARNING)
+    logname = os.path.abspath(sys.argv[0]).split(os.sep)[-1].split(".")[0]
+    file_handler = logging.FileHandler(logname + '.log', mode='w')
+    formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    try:
+        main()
+
+    except SystemExit:
+        pass
+    except:
+        logging.exception('error occurred', sys.exc_info()[0])
+        raise
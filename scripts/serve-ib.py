@@ -0,0 +1,55 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+from lookupservice import LookupService
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serving lookups of IBrokers instruments over HTTP',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+
+    parser.add_argument('--output-dir', type=str, help='location of the output of load-ib.py', default='.')
+    parser.add_argument('--output-prefix', type=str, help='prefix of the output files', default='ib-instr')
+    parser.add_argument('--host', type=str, help='interface to listen on', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help='port to listen on', default=8642)
+    parser.add_argument('--cache-size', type=int, default=100000, help='number of lookup results kept in memory')
+    parser.add_argument('--reload-interval', type=float, default=5.,
+                        help='seconds between checks for a new snapshot')
+    args = parser.parse_args()
+
+    index_path = os.path.abspath(os.sep.join((args.output_dir, args.output_prefix + '.idx')))
+    if not os.path.isfile(index_path):
+        logging.error('index not found: %s (written by load-ib.py --index)', index_path)
+        sys.exit(0)
+
+    search_index_path = os.path.abspath(os.sep.join((args.output_dir, args.output_prefix + '.tri')))
+    service = LookupService(index_path, search_index_path, cache_size=args.cache_size)
+    try:
+        asyncio.run(service.serve(args.host, args.port, reload_interval=args.reload_interval))
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    logname = os.path.abspath(sys.argv[0]).split(os.sep)[-1].split(".")[0]
+    file_handler = logging.FileHandler(logname + '.log', mode='w')
+    formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    file_handler.setFormatter(formatter)
+    logging.getLogger().addHandler(file_handler)
+    try:
+        main()
+
+    except SystemExit:
+        pass
+    except:
+        logging.exception('error occurred', sys.exc_info()[0])
+        raise
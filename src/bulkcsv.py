@@ -0,0 +1,181 @@
+"""
+CSV files written in bulk, then published atomically.
+
+Rows are written to a hidden temporary file next to the target, through large buffers, and the file is renamed over
+the target once complete and flushed to disk: readers see either the previous file or the new one, never a partial
+file. When writing fails, the temporary file is removed and the previous file, if any, is left as it was.
+"""
+import csv
+import gzip
+import io
+import itertools
+import os
+import uuid
+from typing import IO, Iterable, List, Optional, Sequence
+
+from ibdataloader import AsDict
+
+_DEFAULT_BUFFER_SIZE = 1024 * 1024
+_BATCH_ROWS = 4096
+
+# csv module defaults (excel dialect)
+_SEPARATOR = ','
+_LINE_TERMINATOR = '\r\n'
+
+
+class _LineCollector(object):
+    """
+    File-like target of a csv writer, keeping the formatted lines.
+    """
+
+    def __init__(self, lines: List[str]):
+        self.write = lines.append
+
+
+class BulkCsvWriter(object):
+
+    def __init__(self, path: str, fields: Sequence[str], compress: bool = False, compresslevel: int = 6,
+                 buffer_size: int = _DEFAULT_BUFFER_SIZE):
+        """
+
+        :param path: location of the published file
+        :param fields: header, in column order
+        :param compress: whether the file is gzip-compressed
+        :param compresslevel: see gzip.open()
+        :param buffer_size: number of bytes buffered before being written to disk
+        """
+        self._path = os.path.abspath(path)
+        self._fields = tuple(fields)
+        self._compress = compress
+        self._compresslevel = compresslevel
+        self._buffer_size = buffer_size
+        directory, filename = os.path.split(self._path)
+        self._temp_path = os.path.join(directory, '.{}.{}.tmp'.format(filename, uuid.uuid4().hex))
+        self._file: Optional[IO] = None
+        self._text_file: Optional[io.TextIOWrapper] = None
+        self._writer = None
+        self.count_rows = 0
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def open(self) -> None:
+        self._file = open(self._temp_path, 'xb', buffering=self._buffer_size)
+        try:
+            stream = self._file
+            if self._compress:
+                stream = gzip.GzipFile(filename='', mode='wb', fileobj=self._file, compresslevel=self._compresslevel)
+
+            self._text_file = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+            self._writer = csv.writer(self._text_file)
+            self._writer.writerow(self._fields)
+
+        except BaseException:
+            self.discard()
+            raise
+
+    def write_rows(self, rows: Iterable[Sequence]) -> None:
+        """
+        Rows made of strings only, without any separator, quote or line break, are joined directly: this is most of
+        them, the csv module formatting the others.
+
+        :param rows: values in the order of the fields
+        """
+        lines = list()
+        line_collector = _LineCollector(lines)
+        format_row = csv.writer(line_collector).writerow
+        count_separators = len(self._fields) - 1
+        # a single empty value is quoted by the csv module
+        joined = count_separators > 0
+        for row in rows:
+            self.count_rows += 1
+            if joined:
+                try:
+                    line = _SEPARATOR.join(row)
+
+                except TypeError:
+                    line = None
+
+                if line is not None and line.count(_SEPARATOR) == count_separators and '"' not in line \
+                        and '\n' not in line and '\r' not in line:
+                    lines.append(line + _LINE_TERMINATOR)
+
+                else:
+                    format_row(row)
+
+            else:
+                format_row(row)
+
+            if len(lines) >= _BATCH_ROWS:
+                self._text_file.write(''.join(lines))
+                lines.clear()
+
+        self._text_file.write(''.join(lines))
+
+    def write_records(self, records: Iterable[AsDict]) -> None:
+        """
+        Writes records exposing the fields as properties, such as ibdataloader.Instrument.
+        """
+        records = iter(records)
+        first_record = next(records, None)
+        if first_record is None:
+            return
+
+        if tuple(first_record.fields) == self._fields:
+            row_values = type(first_record).as_tuple
+
+        else:
+            fields = self._fields
+
+            def row_values(record: AsDict):
+                return tuple(getattr(record, field) for field in fields)
+
+        self.write_rows(map(row_values, itertools.chain((first_record,), records)))
+
+    def publish(self) -> None:
+        """
+        Closes the temporary file, once flushed to disk, and renames it as the target. When that fails, the temporary
+        file is removed.
+        """
+        try:
+            self._text_file.flush()
+            if self._compress:
+                # writes the gzip trailer, leaving the underlying file open
+                self._text_file.close()
+
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            os.replace(self._temp_path, self._path)
+
+        except BaseException:
+            self.discard()
+            raise
+
+    def discard(self) -> None:
+        """
+        Closes and removes the temporary file, the target being left untouched.
+        """
+        for stream in (self._text_file, self._file):
+            if stream is not None:
+                try:
+                    stream.close()
+
+                except (OSError, ValueError):
+                    pass
+
+        if os.path.isfile(self._temp_path):
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.publish()
+
+        else:
+            self.discard()
+
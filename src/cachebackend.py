@@ -0,0 +1,395 @@
+"""
+Storage of cache entries, as used by pagecache.
+
+FileTreeBackend keeps entries in the webscrapetools key-value directory tree, one file per entry.
+SQLiteBackend keeps them in a single database file, with indexes on storage and access times for expiry
+and for evicting the least recently used entries beyond a maximum size.
+"""
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from webscrapetools import keyvalue
+
+
+class EntryInfo(NamedTuple):
+    key: str
+    size: int
+    stored: datetime
+
+
+def _scan_index(entry_processor: Callable[[str], None]) -> None:
+    try:
+        keyvalue.scan_entries(entry_processor)
+
+    except FileNotFoundError:
+        # nothing stored yet
+        pass
+
+
+class FileTreeBackend(object):
+    """
+    webscrapetools key-value store: being a module level store, only one instance may be in use at a time.
+    """
+
+    def __init__(self, path: str):
+        """
+
+        :param path: root directory of the store
+        """
+        # expiry is handled by the callers, entries must not be purged when opening the store
+        keyvalue.set_store_path(path, expiry_days=None)
+        self._stored_dates: Optional[Dict[str, datetime]] = None
+        self._stored_dates_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return keyvalue.retrieve_from_store(key)
+
+    def put(self, key: str, value: bytes) -> None:
+        keyvalue.add_to_store(key, value)
+
+    def rewrite(self, key: str, value: bytes) -> None:
+        """
+        Replaces the value of an entry, keeping its storage date.
+
+        :param key:
+        :param value:
+        :return:
+        """
+        # the store index keeps the date of the first insertion
+        keyvalue.add_to_store(key, value)
+
+    def keys(self) -> List[str]:
+        return keyvalue.list_keys()
+
+    def entries(self) -> List[EntryInfo]:
+        """
+
+        :return: key, size and storage date (day of the first insertion) of each entry
+        """
+        entries = list()
+
+        def gather_entry(line):
+            date_str, key_md5, key_commas = line.strip().split(' ', 2)
+            key = key_commas[1:-1]
+            try:
+                size = os.path.getsize(keyvalue.get_store_id(key))
+
+            except FileNotFoundError:
+                return
+
+            entries.append(EntryInfo(key, size, datetime.strptime(date_str, '%Y%m%d')))
+
+        _scan_index(gather_entry)
+
+        return entries
+
+    def stored(self, key: str) -> Optional[datetime]:
+        """
+        The dates of all the entries are read from the store index on first use.
+
+        :param key:
+        :return: storage date (day of the first insertion) of the entry, None if unknown
+        """
+        with self._stored_dates_lock:
+            if self._stored_dates is None:
+                self._stored_dates = {entry.key: entry.stored for entry in self.entries()}
+
+        return self._stored_dates.get(key)
+
+    def delete(self, key: str) -> None:
+        if keyvalue.has_store_key(key):
+            keyvalue.remove_from_store(key)
+
+    def delete_many(self, keys: Iterable[str]) -> int:
+        """
+        Removes the entries with a single rewrite of the store index.
+
+        :param keys:
+        :return: number of entries removed
+        """
+        stored_keys = [key for key in dict.fromkeys(keys) if keyvalue.has_store_key(key)]
+        if stored_keys:
+            keyvalue.remove_from_store_multiple(stored_keys)
+
+        return len(stored_keys)
+
+    def expire(self, older_than: datetime) -> int:
+        """
+        Removes the entries first stored before the specified date (the store keeps the day only).
+
+        :param older_than:
+        :return: number of entries removed
+        """
+        expired_keys = list()
+
+        def gather_expired_keys(line):
+            date_str, key_md5, key_commas = line.strip().split(' ', 2)
+            if datetime.strptime(date_str, '%Y%m%d') < older_than:
+                expired_keys.append(key_commas[1:-1])
+
+        _scan_index(gather_expired_keys)
+        if expired_keys:
+            keyvalue.remove_from_store_multiple(expired_keys)
+
+        return len(expired_keys)
+
+    def close(self) -> None:
+        pass
+
+
+_SQLITE_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS entries ('
+    ' key TEXT PRIMARY KEY,'
+    ' value BLOB NOT NULL,'
+    ' size INTEGER NOT NULL,'
+    ' stored REAL NOT NULL,'
+    ' accessed REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS entries_stored ON entries (stored)',
+    'CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)',
+)
+
+BACKEND_FILES = 'files'
+BACKEND_SQLITE = 'sqlite'
+
+# access times are not updated more often than that by default, sparing a write for most reads
+_DEFAULT_ACCESS_RESOLUTION = 60.
+_EVICTION_BATCH = 64
+
+
+class SQLiteBackend(object):
+    """
+    Single file database, safe for concurrent use from many threads: each thread gets its own connection,
+    readers never wait for writers (write-ahead log).
+    """
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None,
+                 access_resolution: float = _DEFAULT_ACCESS_RESOLUTION):
+        """
+
+        :param path: database file, created if missing
+        :param max_bytes: when the entries exceed this size, the least recently used ones are evicted
+        :param access_resolution: seconds elapsed since the last recorded access before recording a new one
+        """
+        self._path = os.path.abspath(path)
+        self._max_bytes = max_bytes
+        self._access_resolution = access_resolution
+        self._local = threading.local()
+        self._connections = list()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        with connection:
+            for statement in _SQLITE_SCHEMA:
+                connection.execute(statement)
+
+        self._total_bytes, = connection.execute('SELECT TOTAL(size) FROM entries').fetchone()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def total_bytes(self) -> int:
+        return int(self._total_bytes)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=60., check_same_thread=False)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+
+        return connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        connection = self._connection()
+        result = connection.execute('SELECT value, accessed FROM entries WHERE key = ?', (key,)).fetchone()
+        if result is None:
+            return None
+
+        value, accessed = result
+        now = time.time()
+        if now - accessed >= self._access_resolution:
+            with connection:
+                connection.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+
+        return value
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _write_transaction(connection: sqlite3.Connection):
+        """
+        Takes the write lock before reading, so that the size read is still the one replaced by the write.
+        """
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            yield connection
+
+    def put(self, key: str, value: bytes) -> None:
+        connection = self._connection()
+        now = time.time()
+        with self._write_transaction(connection):
+            previous = connection.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            connection.execute('INSERT OR REPLACE INTO entries (key, value, size, stored, accessed)'
+                               ' VALUES (?, ?, ?, ?, ?)', (key, value, len(value), now, now))
+
+        with self._lock:
+            self._total_bytes += len(value) - (previous[0] if previous is not None else 0)
+            must_evict = self._max_bytes is not None and self._total_bytes > self._max_bytes
+
+        if must_evict:
+            self.evict()
+
+    def rewrite(self, key: str, value: bytes) -> None:
+        """
+        Replaces the value of an entry, keeping its storage and access times.
+
+        :param key:
+        :param value:
+        :return:
+        """
+        connection = self._connection()
+        with self._write_transaction(connection):
+            previous = connection.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            connection.execute('UPDATE entries SET value = ?, size = ? WHERE key = ?', (value, len(value), key))
+
+        if previous is not None:
+            with self._lock:
+                self._total_bytes += len(value) - previous[0]
+
+    def keys(self) -> List[str]:
+        return [key for key, in self._connection().execute('SELECT key FROM entries ORDER BY key')]
+
+    def entries(self) -> List[EntryInfo]:
+        """
+
+        :return: key, size and storage time of each entry
+        """
+        return [EntryInfo(key, size, datetime.fromtimestamp(stored)) for key, size, stored
+                in self._connection().execute('SELECT key, size, stored FROM entries ORDER BY key')]
+
+    def stored(self, key: str) -> Optional[datetime]:
+        """
+
+        :param key:
+        :return: storage time of the entry, None if missing
+        """
+        result = self._connection().execute('SELECT stored FROM entries WHERE key = ?', (key,)).fetchone()
+        return datetime.fromtimestamp(result[0]) if result is not None else None
+
+    def delete(self, key: str) -> None:
+        connection = self._connection()
+        with self._write_transaction(connection):
+            previous = connection.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+        if previous is not None:
+            with self._lock:
+                self._total_bytes -= previous[0]
+
+    def delete_many(self, keys: Iterable[str]) -> int:
+        """
+        Removes the entries in a single transaction.
+
+        :param keys:
+        :return: number of entries removed
+        """
+        connection = self._connection()
+        count_removed = 0
+        removed_bytes = 0
+        with self._write_transaction(connection):
+            for key in set(keys):
+                previous = connection.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+                if previous is not None:
+                    connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                    count_removed += 1
+                    removed_bytes += previous[0]
+
+        with self._lock:
+            self._total_bytes -= removed_bytes
+
+        return count_removed
+
+    def evict(self) -> int:
+        """
+        Removes the least recently used entries until the size limit is met.
+
+        :return: number of entries removed
+        """
+        connection = self._connection()
+        count_evicted = 0
+        with self._lock:
+            while self._max_bytes is not None and self._total_bytes > self._max_bytes:
+                with self._write_transaction(connection):
+                    candidates = connection.execute('SELECT key, size FROM entries ORDER BY accessed LIMIT ?',
+                                                    (_EVICTION_BATCH,)).fetchall()
+                    if not candidates:
+                        break
+
+                    victims = list()
+                    for key, size in candidates:
+                        if self._total_bytes <= self._max_bytes:
+                            break
+
+                        victims.append((key,))
+                        self._total_bytes -= size
+
+                    connection.executemany('DELETE FROM entries WHERE key = ?', victims)
+
+                count_evicted += len(victims)
+
+        logging.debug('evicted %d entries from %s', count_evicted, self._path)
+        return count_evicted
+
+    def expire(self, older_than: datetime) -> int:
+        """
+        Removes the entries stored before the specified date.
+
+        :param older_than:
+        :return: number of entries removed
+        """
+        connection = self._connection()
+        with self._write_transaction(connection):
+            count_expired, expired_bytes = connection.execute('SELECT COUNT(*), TOTAL(size) FROM entries'
+                                                              ' WHERE stored < ?', (older_than.timestamp(),)).fetchone()
+            connection.execute('DELETE FROM entries WHERE stored < ?', (older_than.timestamp(),))
+
+        with self._lock:
+            self._total_bytes -= expired_bytes
+
+        return count_expired
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+
+            self._connections.clear()
+            self._local = threading.local()
+
+
+def create_backend(name: str, cache_dir: str, max_bytes: Optional[int] = None):
+    """
+    Backend used by the scripts, stored under cache_dir.
+
+    :param name: BACKEND_FILES or BACKEND_SQLITE
+    :param cache_dir:
+    :param max_bytes: see SQLiteBackend
+    :return:
+    """
+    if name == BACKEND_SQLITE:
+        return SQLiteBackend(os.path.abspath(os.path.join(cache_dir, 'ib-instr-pagecache.db')), max_bytes=max_bytes)
+
+    if name == BACKEND_FILES:
+        return FileTreeBackend(os.path.abspath(os.path.join(cache_dir, 'ib-instr-urlcaching')))
+
+    raise ValueError('unknown cache backend "{}"'.format(name))
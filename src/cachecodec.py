@@ -0,0 +1,201 @@
+"""
+Compression of cache entries.
+
+Compressed entries start with a marker naming the method (zstd, or zlib when zstandard is not installed)
+followed by the id of the dictionary they were compressed with, so that they can be read back whatever the
+current settings. Entries without marker are returned as they are.
+Listing pages share most of their markup: a dictionary trained on sample pages lets even small entries
+compress well.
+"""
+import hashlib
+import threading
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+try:
+    import zstandard
+
+except ImportError:
+    zstandard = None
+
+METHOD_ZSTD = 'zstd'
+METHOD_ZLIB = 'zlib'
+
+_MARKERS = {METHOD_ZSTD: b'IBZS', METHOD_ZLIB: b'IBZL'}
+_METHODS = {marker: method for method, marker in _MARKERS.items()}
+_MARKER_SIZE = 4
+_NO_DICTIONARY_ID = bytes(8)
+_DICTIONARY_ID_SIZE = len(_NO_DICTIONARY_ID)
+_ZLIB_MAX_DICTIONARY_SIZE = 32 * 1024
+_DEFAULT_DICTIONARY_SIZE = 112 * 1024
+
+
+def available_methods() -> Iterable[str]:
+    if zstandard is not None:
+        return METHOD_ZSTD, METHOD_ZLIB
+
+    return METHOD_ZLIB,
+
+
+def default_method() -> str:
+    return METHOD_ZSTD if zstandard is not None else METHOD_ZLIB
+
+
+def dictionary_id(dictionary: bytes) -> bytes:
+    return hashlib.blake2b(dictionary, digest_size=_DICTIONARY_ID_SIZE).digest()
+
+
+def train_dictionary(samples: Iterable[bytes], size: int = _DEFAULT_DICTIONARY_SIZE) -> bytes:
+    """
+    With zstandard, a zstd dictionary. Otherwise the most frequent lines of the samples, most frequent last
+    (closest to the data being compressed), within the 32KB zlib can make use of.
+
+    :param samples: sample entries
+    :param size: maximum dictionary size in bytes
+    :return:
+    """
+    samples = list(samples)
+    if zstandard is not None:
+        return zstandard.train_dictionary(size, samples).as_bytes()
+
+    line_counts = Counter(line for sample in samples for line in set(sample.splitlines(keepends=True)))
+    dictionary_lines = list()
+    remaining = min(size, _ZLIB_MAX_DICTIONARY_SIZE)
+    for line, count in line_counts.most_common():
+        if count < 2 or len(line) > remaining:
+            continue
+
+        dictionary_lines.append(line)
+        remaining -= len(line)
+
+    return b''.join(reversed(dictionary_lines))
+
+
+class Codec(object):
+    """
+    Compresses entries with one method and dictionary, decompresses entries written with any method and
+    any of the known dictionaries.
+    """
+
+    def __init__(self, method: Optional[str] = None, dictionary: Optional[bytes] = None, level: int = None):
+        """
+
+        :param method: METHOD_ZSTD or METHOD_ZLIB, default_method() if None
+        :param dictionary: as returned by train_dictionary()
+        :param level: compression level, the method default if None
+        """
+        if method is None:
+            method = default_method()
+
+        if method not in available_methods():
+            raise ValueError('unavailable compression method "{}", expecting one of {}'.format(
+                method, list(available_methods())))
+
+        self._method = method
+        self._dictionary = dictionary
+        self._level = level
+        self._dictionaries: Dict[bytes, bytes] = dict()
+        self._zstd_dictionaries = dict()
+        self._dictionary_id = _NO_DICTIONARY_ID
+        # zstandard compressors and decompressors must not be shared between threads
+        self._local = threading.local()
+        if dictionary is not None:
+            self._dictionary_id = dictionary_id(dictionary)
+            self.add_dictionary(dictionary)
+
+    @property
+    def method(self) -> str:
+        return self._method
+
+    def add_dictionary(self, dictionary: bytes) -> None:
+        """
+        Makes entries compressed with the dictionary readable.
+
+        :param dictionary:
+        :return:
+        """
+        new_dictionary_id = dictionary_id(dictionary)
+        self._dictionaries[new_dictionary_id] = dictionary
+        if zstandard is not None:
+            self._zstd_dictionaries[new_dictionary_id] = zstandard.ZstdCompressionDict(dictionary)
+
+    def _zstd_compressor(self):
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            level = self._level if self._level is not None else 3
+            compressor = zstandard.ZstdCompressor(level=level,
+                                                  dict_data=self._zstd_dictionaries.get(self._dictionary_id))
+            self._local.compressor = compressor
+
+        return compressor
+
+    def _zstd_decompressor(self, entry_dictionary_id: bytes):
+        if not hasattr(self._local, 'decompressors'):
+            self._local.decompressors = dict()
+
+        decompressor = self._local.decompressors.get(entry_dictionary_id)
+        if decompressor is None:
+            decompressor = zstandard.ZstdDecompressor(dict_data=self._zstd_dictionaries.get(entry_dictionary_id))
+            self._local.decompressors[entry_dictionary_id] = decompressor
+
+        return decompressor
+
+    def compress(self, data: bytes) -> bytes:
+        header = _MARKERS[self._method] + self._dictionary_id
+        if self._method == METHOD_ZSTD:
+            return header + self._zstd_compressor().compress(data)
+
+        level = self._level if self._level is not None else 6
+        if self._dictionary is not None:
+            compressor = zlib.compressobj(level, zdict=self._dictionary[-_ZLIB_MAX_DICTIONARY_SIZE:])
+
+        else:
+            compressor = zlib.compressobj(level)
+
+        return header + compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        """
+
+        :param data: entry as stored
+        :return: entry as it was before compression, unchanged if not compressed
+        :raises ValueError: when the entry cannot be decompressed
+        """
+        method = _METHODS.get(data[:_MARKER_SIZE])
+        if method is None:
+            return data
+
+        entry_dictionary_id = data[_MARKER_SIZE:_MARKER_SIZE + _DICTIONARY_ID_SIZE]
+        payload = data[_MARKER_SIZE + _DICTIONARY_ID_SIZE:]
+        dictionary = None
+        if entry_dictionary_id != _NO_DICTIONARY_ID:
+            dictionary = self._dictionaries.get(entry_dictionary_id)
+            if dictionary is None:
+                raise ValueError('entry compressed with unknown dictionary {}'.format(entry_dictionary_id.hex()))
+
+        if method == METHOD_ZSTD:
+            if zstandard is None:
+                raise ValueError('entry compressed with zstd, zstandard is not installed')
+
+            try:
+                return self._zstd_decompressor(entry_dictionary_id).decompress(payload)
+
+            except zstandard.ZstdError as err:
+                raise ValueError('corrupted zstd entry') from err
+
+        if dictionary is not None:
+            decompressor = zlib.decompressobj(zdict=dictionary[-_ZLIB_MAX_DICTIONARY_SIZE:])
+
+        else:
+            decompressor = zlib.decompressobj()
+
+        try:
+            return decompressor.decompress(payload) + decompressor.flush()
+
+        except zlib.error as err:
+            raise ValueError('corrupted zlib entry') from err
+
+
+def is_compressed(data: bytes) -> bool:
+    return data[:_MARKER_SIZE] in _METHODS
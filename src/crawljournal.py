@@ -0,0 +1,113 @@
+"""
+Persistent record of the crawl units completed so far, so that an interrupted run can be resumed.
+
+Units are the exchange lists of product types and the extracted exchange pages. Exchange pages are identified
+by their url, which already tells the product type, the exchange and the page number.
+The journal is an SQLite database: each unit is committed as soon as it is complete.
+"""
+import json
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+import ibextract
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS product_type_units ('
+    ' product_type TEXT PRIMARY KEY,'
+    ' exchanges TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS exchange_page_units ('
+    ' url TEXT PRIMARY KEY,'
+    ' exchange TEXT NOT NULL,'
+    ' exchange_page TEXT NOT NULL)',
+)
+
+
+class CrawlJournal(object):
+    """
+    Thread-safe journal of completed crawl units.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        """
+
+        :param path: database file, created if missing
+        :param resume: keeps the units recorded by a previous run, otherwise the journal starts empty
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            for statement in _SCHEMA:
+                self._connection.execute(statement)
+
+            if not resume:
+                self._connection.execute('DELETE FROM product_type_units')
+                self._connection.execute('DELETE FROM exchange_page_units')
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _fetch_one(self, query: str, *parameters) -> Optional[Tuple]:
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchone()
+
+    def _write(self, statement: str, *parameters) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(statement, parameters)
+
+    def count_units(self) -> Tuple[int, int]:
+        """
+
+        :return: number of product types and of exchange pages recorded
+        """
+        product_types, = self._fetch_one('SELECT COUNT(*) FROM product_type_units')
+        exchange_pages, = self._fetch_one('SELECT COUNT(*) FROM exchange_page_units')
+        return product_types, exchange_pages
+
+    def exchanges(self, product_type_code: str) -> Optional[List[Tuple[str, str]]]:
+        """
+
+        :param product_type_code:
+        :return: list of (exchange name, exchange url), None if not recorded
+        """
+        result = self._fetch_one('SELECT exchanges FROM product_type_units WHERE product_type = ?', product_type_code)
+        if result is None:
+            return None
+
+        return [(exchange_name, exchange_url) for exchange_name, exchange_url in json.loads(result[0])]
+
+    def record_exchanges(self, product_type_code: str, exchanges: List[Tuple[str, str]]) -> None:
+        self._write('INSERT OR REPLACE INTO product_type_units (product_type, exchanges) VALUES (?, ?)',
+                    product_type_code, json.dumps(exchanges))
+
+    def exchange_page(self, url: str) -> Optional[ibextract.ExchangePage]:
+        """
+
+        :param url:
+        :return: extracted exchange page, None if not recorded
+        """
+        result = self._fetch_one('SELECT exchange_page FROM exchange_page_units WHERE url = ?', url)
+        if result is None:
+            return None
+
+        rows, next_page_href, current_page, page_hrefs = json.loads(result[0])
+        return ([tuple(row) for row in rows], next_page_href, current_page,
+                {int(page_number): page_href for page_number, page_href in page_hrefs.items()})
+
+    def record_exchange_page(self, exchange_name: str, url: str, exchange_page: ibextract.ExchangePage) -> None:
+        self._write('INSERT OR IGNORE INTO exchange_page_units (url, exchange, exchange_page) VALUES (?, ?, ?)',
+                    url, exchange_name, json.dumps(exchange_page))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,28 +1,40 @@
+import itertools
 import logging
 import gspread
 import httplib2
 
+from collections import defaultdict, deque
+from typing import List, NamedTuple, Tuple
+from urllib.parse import quote
+
 from apiclient import discovery
-from gspread.utils import rowcol_to_a1
+from gspread.urls import SPREADSHEET_BATCH_UPDATE_URL, SPREADSHEET_URL, SPREADSHEET_VALUES_URL
+from gspread.utils import absolute_range_name, rowcol_to_a1
 from oauth2client.service_account import ServiceAccountCredentials
 
 _GOOGLE_DRIVE_SCOPE = 'https://www.googleapis.com/auth/drive'
 _GOOGLE_DRIVE_FILE_SCOPE = 'https://www.googleapis.com/auth/drive.file'
 
+# cells sent per batchUpdate call, keeping the request payload within a few MB
+_DEFAULT_CHUNK_CELLS = 40000
+
 svc_sheet = None
 
 
-def authorize_gspread(google_creds):
+def authorize_gspread(google_creds, quota_scheduler=None):
     """
     Authorization is called only once and then re-used.
 
     :param google_creds:
+    :param quota_scheduler: sheetsquota.QuotaScheduler all the API calls of the client go through, if not None
     :return:
     """
     global svc_sheet
     if not svc_sheet:
         authorized_http, credentials = authorize_services(google_creds)
         svc_sheet = gspread.authorize(credentials)
+        if quota_scheduler is not None:
+            quota_scheduler.install(svc_sheet)
 
     return svc_sheet
 
@@ -117,7 +129,7 @@ def update_sheet(srv_sheets, spreadsheet_id, header, rows):
                 'index': 0,
                 'gridProperties': {
                     'rowCount': len(rows) + 1,
-                    'columnCount': 10,
+                    'columnCount': len(header),
                     'frozenRowCount': 1,
                     'hideGridlines': False,
                 },
@@ -129,12 +141,9 @@ def update_sheet(srv_sheets, spreadsheet_id, header, rows):
         'updateCells': {
             'range': {'sheetId': first_sheet_id,
                       'startRowIndex': 0, 'endRowIndex': len(rows) + 1,
-                      'startColumnIndex': 0, 'endColumnIndex': 4},
+                      'startColumnIndex': 0, 'endColumnIndex': len(header)},
             'fields': '*',
-            'rows': [{'values': [
-                {'userEnteredValue': {'stringValue': header_field}} for header_field in header]}] + [
-                        {'values': [{'userEnteredValue': {'stringValue': row[field]}} for field in header]}
-                        for row in rows]
+            'rows': [row_data(header)] + [row_data(row[field] for field in header) for row in rows]
         }
     }
     batch_update_body = {
@@ -143,6 +152,350 @@ def update_sheet(srv_sheets, spreadsheet_id, header, rows):
     srv_sheets.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=batch_update_body).execute()
 
 
+def row_data(values):
+    """
+
+    :param values: cell values of a row, None for an empty cell
+    :return: RowData of a Sheets API request
+    """
+    return {'values': [{'userEnteredValue': {'stringValue': str(value)}} if value is not None else {}
+                       for value in values]}
+
+
+def sheet_properties(svc_sheet, spreadsheet_id):
+    """
+    Fetches the properties of all the worksheets in a single call, without the cells.
+
+    :param svc_sheet: gspread client
+    :param spreadsheet_id:
+    :return: SheetProperties of the worksheets
+    """
+    response = svc_sheet.request('get', SPREADSHEET_URL % spreadsheet_id, params={'fields': 'sheets.properties'})
+    return [sheet['properties'] for sheet in response.json().get('sheets', list())]
+
+
+def apply_sheet_requests(sheets, requests):
+    """
+    Keeps cached worksheet properties in line with the batchUpdate requests adding, deleting, renaming or moving
+    worksheets.
+
+    :param sheets: SheetProperties of the worksheets, in the order of their index, updated in place
+    :param requests: batchUpdate requests, successfully applied to the spreadsheet
+    :return:
+    """
+    for request in requests:
+        if 'addSheet' in request:
+            properties = dict(request['addSheet']['properties'])
+            sheets.insert(properties.get('index', len(sheets)), properties)
+
+        elif 'deleteSheet' in request:
+            sheets[:] = [properties for properties in sheets
+                         if properties['sheetId'] != request['deleteSheet']['sheetId']]
+
+        elif 'updateSheetProperties' in request:
+            updated_properties = request['updateSheetProperties']['properties']
+            fields = request['updateSheetProperties']['fields'].split(',')
+            properties = next(properties for properties in sheets
+                              if properties['sheetId'] == updated_properties['sheetId'])
+            if 'title' in fields:
+                properties['title'] = updated_properties['title']
+
+            if 'index' in fields:
+                # as the Sheets API, the index refers to the positions before the move
+                current_index = sheets.index(properties)
+                new_index = updated_properties['index']
+                sheets.remove(properties)
+                sheets.insert(new_index if new_index <= current_index else new_index - 1, properties)
+
+        for index, properties in enumerate(sheets):
+            properties['index'] = index
+
+
+def batch_update(svc_sheet, spreadsheet_id, requests, sheets=None):
+    """
+
+    :param svc_sheet: gspread client
+    :param spreadsheet_id:
+    :param requests:
+    :param sheets: cached SheetProperties of the worksheets, kept up to date if not None
+    :return: batchUpdate response
+    """
+    response = svc_sheet.request('post', SPREADSHEET_BATCH_UPDATE_URL % spreadsheet_id, json={'requests': requests})
+    if sheets is not None:
+        apply_sheet_requests(sheets, requests)
+
+    return response.json()
+
+
+def chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            break
+
+        yield chunk
+
+
+def upload_worksheet(svc_sheet, spreadsheet_id, worksheet_name, rows, header=None, resize_columns=True,
+                     chunk_cells=_DEFAULT_CHUNK_CELLS, sheets=None):
+    """
+    Replaces the worksheet with the specified rows using raw batchUpdate calls.
+
+    The rows are streamed into a staging worksheet ("new_" + worksheet_name), one batchUpdate of at most chunk_cells
+    cells at a time. The last batch also deletes the current worksheet and renames the staging one in its place,
+    so that readers never see a partially uploaded worksheet. Small worksheets are thus uploaded in a single call,
+    besides the one fetching the worksheet properties.
+
+    :param svc_sheet: gspread client
+    :param spreadsheet_id:
+    :param worksheet_name:
+    :param rows: dicts, possibly an iterator
+    :param header: keys of the rows, in the order of the columns (keys of the first row by default)
+    :param resize_columns: whether the widths of the columns are adjusted to their content
+    :param chunk_cells: maximum number of cells sent per call
+    :param sheets: cached SheetProperties of the worksheets (see sheet_properties()), fetched if None
+    :return: number of rows uploaded, the header excepted
+    :raises KeyError: when a key of the header is missing from a row
+    """
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        logging.warning("no row to be added for worksheet %s", worksheet_name)
+        return 0
+
+    if header is None:
+        header = list(first_row.keys())
+
+    missing_keys = [field for field in header if field not in first_row]
+    if missing_keys:
+        # checked before any call, so that no staging worksheet is left behind
+        raise KeyError('keys missing from the rows of worksheet {}: {}'.format(worksheet_name, missing_keys))
+
+    if sheets is None:
+        sheets = sheet_properties(svc_sheet, spreadsheet_id)
+
+    properties_by_title = {properties['title']: properties for properties in sheets}
+    sheet_id = max((properties['sheetId'] for properties in properties_by_title.values()), default=0) + 1
+    staging_title = 'new_' + worksheet_name
+    requests = list()
+    if staging_title in properties_by_title:
+        requests.append({'deleteSheet': {'sheetId': properties_by_title[staging_title]['sheetId']}})
+
+    requests.append({'addSheet': {'properties': {
+        'sheetId': sheet_id, 'title': staging_title,
+        'gridProperties': {'rowCount': 1, 'columnCount': len(header), 'frozenRowCount': 1}}}})
+    requests.append({'updateCells': {'start': {'sheetId': sheet_id, 'rowIndex': 0, 'columnIndex': 0},
+                                     'rows': [row_data(header)], 'fields': 'userEnteredValue'}})
+    count_rows = 0
+    pending_requests = None
+    for chunk in chunks(itertools.chain([first_row], rows), max(1, chunk_cells // len(header))):
+        if pending_requests is not None:
+            batch_update(svc_sheet, spreadsheet_id, requests + pending_requests, sheets)
+            requests = list()
+
+        pending_requests = [{'appendCells': {'sheetId': sheet_id, 'fields': 'userEnteredValue',
+                                             'rows': [row_data(row[field] for field in header) for row in chunk]}}]
+        count_rows += len(chunk)
+
+    requests.extend(pending_requests)
+    renamed_properties = {'sheetId': sheet_id, 'title': worksheet_name}
+    if worksheet_name in properties_by_title:
+        requests.append({'deleteSheet': {'sheetId': properties_by_title[worksheet_name]['sheetId']}})
+        renamed_properties['index'] = properties_by_title[worksheet_name]['index']
+
+    requests.append({'updateSheetProperties': {'properties': renamed_properties,
+                                               'fields': ','.join(name for name in renamed_properties
+                                                                  if name != 'sheetId')}})
+    if resize_columns:
+        requests.append({'autoResizeDimensions': {'dimensions': {
+            'sheetId': sheet_id, 'dimension': 'COLUMNS', 'startIndex': 0, 'endIndex': len(header)}}})
+
+    batch_update(svc_sheet, spreadsheet_id, requests, sheets)
+    return count_rows
+
+
+class RowDelta(NamedTuple):
+    updated: List[Tuple[int, List[str]]]
+    inserted: List[List[str]]
+    deleted: List[int]
+
+
+def diff_rows(current_values, header, rows, key='conid'):
+    """
+    Rows are matched on their key, in order when several rows share the same key.
+
+    :param current_values: values of the worksheet, header first, trailing empty cells possibly left out
+    :param header: keys of the rows, in the order of the columns
+    :param rows: dicts
+    :param key: field identifying a row
+    :return: RowDelta of (row index in the worksheet, new values) of the updated rows, values of the inserted rows
+    and indexes of the deleted rows, in increasing order
+    :raises KeyError: when a key of the header is missing from a row
+    :raises ValueError: when a row has an empty key
+    """
+    key_index = list(header).index(key)
+    current_indexes = defaultdict(deque)
+    for row_index, row_values in enumerate(current_values[1:], start=1):
+        row_key = row_values[key_index] if key_index < len(row_values) else ''
+        current_indexes[row_key].append(row_index)
+
+    updated = list()
+    inserted = list()
+    for row in rows:
+        values = ['' if row[field] is None else str(row[field]) for field in header]
+        if not values[key_index]:
+            # would be matched with any row missing its key, or all of them inserted as duplicates
+            raise ValueError('row without {}: {}'.format(key, row))
+
+        if not current_indexes[values[key_index]]:
+            inserted.append(values)
+            continue
+
+        row_index = current_indexes[values[key_index]].popleft()
+        current_row = current_values[row_index]
+        if list(current_row) + [''] * (len(header) - len(current_row)) != values:
+            updated.append((row_index, values))
+
+    deleted = sorted(row_index for row_indexes in current_indexes.values() for row_index in row_indexes)
+    updated.sort()
+    return RowDelta(updated, inserted, deleted)
+
+
+def worksheet_values(svc_sheet, spreadsheet_id, worksheet_name):
+    url = SPREADSHEET_VALUES_URL % (spreadsheet_id, quote(absolute_range_name(worksheet_name)))
+    return svc_sheet.request('get', url).json().get('values', list())
+
+
+def delta_requests(sheet_id, delta, chunk_rows):
+    """
+    Updates are sent first, then insertions appended after the last row and finally deletions from the bottom up,
+    so that the row indexes of the delta remain valid all along.
+
+    :param sheet_id:
+    :param delta: RowDelta
+    :param chunk_rows: maximum number of rows per request
+    :return: (request, number of rows sent) of the batchUpdate requests applying the delta
+    """
+    runs = list()
+    for row_index, values in delta.updated:
+        if runs and runs[-1][0] + len(runs[-1][1]) == row_index and len(runs[-1][1]) < chunk_rows:
+            runs[-1][1].append(values)
+
+        else:
+            runs.append((row_index, [values]))
+
+    for row_index, run_values in runs:
+        yield {'updateCells': {'start': {'sheetId': sheet_id, 'rowIndex': row_index, 'columnIndex': 0},
+                               'rows': [row_data(values) for values in run_values],
+                               'fields': 'userEnteredValue'}}, len(run_values)
+
+    for chunk in chunks(delta.inserted, chunk_rows):
+        yield {'appendCells': {'sheetId': sheet_id, 'fields': 'userEnteredValue',
+                               'rows': [row_data(values) for values in chunk]}}, len(chunk)
+
+    deleted_runs = list()
+    for row_index in delta.deleted:
+        if deleted_runs and deleted_runs[-1][1] == row_index:
+            deleted_runs[-1][1] += 1
+
+        else:
+            deleted_runs.append([row_index, row_index + 1])
+
+    for start_index, end_index in reversed(deleted_runs):
+        yield {'deleteDimension': {'range': {'sheetId': sheet_id, 'dimension': 'ROWS', 'startIndex': start_index,
+                                             'endIndex': end_index}}}, 1
+
+
+def sync_worksheet(svc_sheet, spreadsheet_id, worksheet_name, rows, header=None, key='conid',
+                   chunk_cells=_DEFAULT_CHUNK_CELLS, sheets=None):
+    """
+    Only sends the rows that changed since the previous upload: the current values of the worksheet are read in a
+    single call and diffed against the rows keyed on the key field. Inserted rows are appended at the bottom,
+    the order of the other rows is left unchanged.
+
+    Falls back to upload_worksheet() when the worksheet does not exist or has a different header.
+
+    :param svc_sheet: gspread client
+    :param spreadsheet_id:
+    :param worksheet_name:
+    :param rows: dicts, possibly an iterator
+    :param header: keys of the rows, in the order of the columns (keys of the first row by default)
+    :param key: field identifying a row
+    :param chunk_cells: maximum number of cells sent per call
+    :param sheets: cached SheetProperties of the worksheets (see sheet_properties()), fetched if None
+    :return: RowDelta applied to the worksheet
+    """
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        logging.warning("no row to be added for worksheet %s", worksheet_name)
+        return RowDelta(list(), list(), list())
+
+    if header is None:
+        header = list(first_row.keys())
+
+    rows = itertools.chain([first_row], rows)
+    if sheets is None:
+        sheets = sheet_properties(svc_sheet, spreadsheet_id)
+
+    properties_by_title = {properties['title']: properties for properties in sheets}
+    current_values = list()
+    if worksheet_name in properties_by_title:
+        current_values = worksheet_values(svc_sheet, spreadsheet_id, worksheet_name)
+
+    if not current_values or current_values[0] != list(header):
+        logging.info('worksheet "%s" missing or with a different header: uploading all the rows', worksheet_name)
+        inserted = diff_rows([list(header)], header, rows, key).inserted
+        upload_worksheet(svc_sheet, spreadsheet_id, worksheet_name, [dict(zip(header, values)) for values in inserted],
+                         header, chunk_cells=chunk_cells, sheets=sheets)
+        return RowDelta(list(), inserted, list(range(1, len(current_values))))
+
+    delta = diff_rows(current_values, header, rows, key)
+    batch = list()
+    count_cells = 0
+    sheet_id = properties_by_title[worksheet_name]['sheetId']
+    for request, count_rows in delta_requests(sheet_id, delta, max(1, chunk_cells // len(header))):
+        if batch and count_cells + count_rows * len(header) > chunk_cells:
+            batch_update(svc_sheet, spreadsheet_id, batch)
+            batch = list()
+            count_cells = 0
+
+        batch.append(request)
+        count_cells += count_rows * len(header)
+
+    if batch:
+        batch_update(svc_sheet, spreadsheet_id, batch)
+
+    return delta
+
+
+def clean_worksheets(svc_sheet, spreadsheet_id, worksheet_names, sheets=None):
+    """
+    Same as clean_spreadsheet() in a single batchUpdate call.
+
+    :param svc_sheet: gspread client
+    :param spreadsheet_id:
+    :param worksheet_names: worksheets to be kept
+    :param sheets: cached SheetProperties of the worksheets (see sheet_properties()), fetched if None
+    :return: titles of the worksheets removed
+    """
+    if sheets is None:
+        sheets = sheet_properties(svc_sheet, spreadsheet_id)
+
+    removed_sheets = [properties for properties in sheets if properties['title'] not in worksheet_names]
+    if len(removed_sheets) == len(sheets):
+        # a spreadsheet keeps at least one worksheet
+        removed_sheets = removed_sheets[:-1]
+
+    if removed_sheets:
+        logging.info('removing worksheets %s', [properties['title'] for properties in removed_sheets])
+        batch_update(svc_sheet, spreadsheet_id, [{'deleteSheet': {'sheetId': properties['sheetId']}}
+                                                 for properties in removed_sheets], sheets)
+
+    return [properties['title'] for properties in removed_sheets]
+
+
 def get_spreadsheet(srv_sheet, spreadsheet_id):
     return srv_sheet.open_by_key(spreadsheet_id)
 
@@ -208,9 +561,8 @@ def update_spreadsheet(svc_sheet, spreadsheet_id, worksheet_name, rows, header=N
     """
     spreadsheet = get_spreadsheet(svc_sheet, spreadsheet_id)
     ws_by_title = worksheets_by_title(spreadsheet)
-    matching_worksheets = [ws for ws in spreadsheet.worksheets() if ws.title == worksheet_name]
-    if len(matching_worksheets) > 0:
-        old_worksheet = matching_worksheets[0]
+    if worksheet_name in ws_by_title:
+        old_worksheet = ws_by_title[worksheet_name]
         rename_title = 'old_' + worksheet_name
         if rename_title in ws_by_title:
             spreadsheet.del_worksheet(ws_by_title[rename_title])
@@ -234,13 +586,16 @@ def clean_spreadsheet(svc_sheet, spreadsheet_id, worksheet_names):
     :return:
     """
     spreadsheet = get_spreadsheet(svc_sheet, spreadsheet_id)
-    for worksheet in spreadsheet.worksheets():
-        if len(spreadsheet.worksheets()) <= 1:
+    worksheets = spreadsheet.worksheets()
+    count_worksheets = len(worksheets)
+    for worksheet in worksheets:
+        if count_worksheets <= 1:
             break
 
         if worksheet.title not in worksheet_names:
             logging.info('removing worksheet "%s"', worksheet.title)
             spreadsheet.del_worksheet(worksheet)
+            count_worksheets -= 1
 
 
 def resize_column(worksheet, column_index, column_width):
@@ -0,0 +1,186 @@
+"""
+asyncio flavour of the ibdataloader crawl: pages are downloaded through a single aiohttp session,
+keeping many requests in flight from one thread.
+Pages go through the same cache (pagecache) and the same rejection marker check as ibdataloader.load_url,
+and network requests draw on the same per-host rate limiter.
+"""
+import asyncio
+import logging
+from operator import itemgetter
+from typing import AsyncGenerator, Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+
+import ibdataloader
+import pagecache
+from ibdataloader import Instrument, ProductType
+
+_DEFAULT_CONCURRENCY = 20
+
+
+class AsyncLoader(object):
+    """
+    Loads IB pages with at most `concurrency` requests in flight.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, concurrency: int = _DEFAULT_CONCURRENCY):
+        """
+
+        :param session: aiohttp session used for all requests
+        :param concurrency: maximum number of concurrent requests
+        """
+        self._session = session
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def load_url(self, url: str, rejection_marker=None) -> str:
+        rejection_marker = ibdataloader.resolve_rejection_marker(rejection_marker)
+        page = pagecache.get_page(url)
+        if page is not None and pagecache.is_fresh(page):
+            return pagecache.handle_hit(page)
+
+        async with self._semaphore:
+            await asyncio.sleep(ibdataloader.get_rate_limiter().bucket(url).reserve())
+            async with self._session.get(url, headers=pagecache.request_headers(page)) as response:
+                status = response.status
+                response_headers = response.headers
+                html_text = await response.text()
+
+        return pagecache.handle_response(url, page, status, response_headers, html_text, rejection_marker)
+
+    async def load_exchanges_for_product_type(self, product_type: ProductType) -> List[Tuple[str, str]]:
+        journal = ibdataloader.get_journal()
+        if journal is not None:
+            exchanges = journal.exchanges(product_type.value)
+            if exchanges is not None:
+                logging.info(f'exchanges for product type {product_type.value} taken from journal')
+                return exchanges
+
+        url = ibdataloader.product_type_url(product_type)
+        logging.info(f'loading data for product type {product_type.value}: {url}')
+        html_text = await self.load_url(url)
+        region_urls = ibdataloader.parse_region_urls(product_type, html_text, url)
+        regions_html = await asyncio.gather(*(self.load_url(region_url) for region_url in region_urls.values()))
+        exchanges = list()
+        for html_exchanges_text in regions_html:
+            exchanges += ibdataloader.parse_exchange_links(html_exchanges_text)
+
+        if journal is not None:
+            journal.record_exchanges(product_type.value, exchanges)
+
+        return exchanges
+
+    async def load_exchange_page(self, exchange_name: str,
+                                 exchange_url: str) -> Tuple[List[Instrument], str, Optional[int], Dict[int, str]]:
+        exchange_page_future = ibdataloader.journaled_exchange_page(exchange_url)
+        if exchange_page_future is None:
+            html_text = await self.load_url(exchange_url)
+            # extraction runs in the parser processes when enabled, leaving the event loop free meanwhile
+            exchange_page_future = ibdataloader.submit_exchange_page(html_text)
+            await asyncio.wait([asyncio.wrap_future(exchange_page_future)])
+
+        return ibdataloader.exchange_page_result(exchange_name, exchange_url, exchange_page_future)
+
+    async def load_for_exchange(self, exchange_name: str, exchange_url: str) -> List[Instrument]:
+        """
+        Same pagination logic as ibdataloader.load_for_exchange.
+
+        :param exchange_name:
+        :param exchange_url:
+        :return:
+        """
+        logging.info(f'processing exchange data {exchange_name}, {exchange_url}')
+        logging.info('processing page %s', exchange_url)
+        instruments = list()
+        pages = [await self.load_exchange_page(exchange_name, exchange_url)]
+        while True:
+            for new_instruments, _, _, _ in pages:
+                instruments += new_instruments
+
+            _, next_page_link, current_page, page_urls = pages[-1]
+            if next_page_link is None:
+                break
+
+            following_page_urls = ibdataloader.infer_following_page_urls(current_page, page_urls, next_page_link)
+            if not following_page_urls:
+                following_page_urls = [next_page_link]
+
+            for page_url in following_page_urls:
+                logging.info('processing page %s', page_url)
+
+            pages = await asyncio.gather(*(self.load_exchange_page(exchange_name, page_url)
+                                           for page_url in following_page_urls))
+
+        return instruments
+
+    async def list_instruments(self, product_types: Iterable[ProductType]) -> AsyncGenerator[Instrument, None]:
+        """
+        Same output as ibdataloader.list_instruments, all the exchanges of a product type being loaded concurrently.
+
+        :param product_types:
+        :return:
+        """
+        for product_type in sorted(product_types):
+            exchanges = await self.load_exchanges_for_product_type(product_type)
+            logging.info(f'{len(exchanges)} available exchanges for product type "{product_type}"', )
+            tasks = [asyncio.create_task(self.load_for_exchange(exchange_name, exchange_url))
+                     for exchange_name, exchange_url in sorted(exchanges, key=itemgetter(0))]
+            try:
+                for task in tasks:
+                    for instrument in await task:
+                        instrument.product_type = product_type
+                        yield instrument
+
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+
+async def list_instruments(product_types: Iterable[ProductType],
+                           concurrency: int = _DEFAULT_CONCURRENCY) -> AsyncGenerator[Instrument, None]:
+    """
+
+    :param product_types:
+    :param concurrency: maximum number of concurrent requests
+    :return:
+    """
+    async with aiohttp.ClientSession(headers=pagecache.BROWSER_HEADERS) as session:
+        loader = AsyncLoader(session, concurrency)
+        async for instrument in loader.list_instruments(product_types):
+            yield instrument
+
+
+def process_instruments(product_types: Iterable[ProductType],
+                        results_processor: Callable[[ProductType, str, Iterable[Instrument]], None],
+                        concurrency: int = _DEFAULT_CONCURRENCY, memory_budget: Optional[int] = None) -> None:
+    """
+    Blocking entry point, same contract as ibdataloader.process_instruments.
+
+    :param product_types:
+    :param results_processor: function taking (product_type_code, currency, instruments list) as input
+    :param concurrency: maximum number of concurrent requests
+    :param memory_budget: see ibdataloader.process_instruments
+    :return:
+    """
+    async def gather_instruments():
+        return [instrument async for instrument in list_instruments(product_types, concurrency)]
+
+    async def stream_instruments():
+        streamer = ibdataloader.InstrumentsStreamer(results_processor, memory_budget)
+        try:
+            async with aiohttp.ClientSession(headers=pagecache.BROWSER_HEADERS) as session:
+                loader = AsyncLoader(session, concurrency)
+                for product_type in sorted(product_types):
+                    async for instrument in loader.list_instruments([product_type]):
+                        streamer.add(instrument)
+
+                    streamer.flush()
+
+        finally:
+            streamer.close()
+
+    if memory_budget is None:
+        instruments = asyncio.run(gather_instruments())
+        ibdataloader.group_instruments(instruments, results_processor)
+
+    else:
+        asyncio.run(stream_instruments())
@@ -1,17 +1,31 @@
 import logging
-import re
+from array import array
 from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from enum import unique, StrEnum
+from functools import partial
 from operator import itemgetter
-from typing import Iterable, Callable, Generator, Tuple, List
+from typing import Iterable, Iterator, Callable, Generator, Tuple, List, Dict, Optional
 from urllib.parse import parse_qs, urlparse
 
-from bs4 import BeautifulSoup
-from webscrapetools import urlcaching
+import ibextract
+import pagecache
+from crawljournal import CrawlJournal
+from parsecache import ParseCache
+from ratelimit import HostRateLimiter
+from spillsort import ExternalGrouper
 
 _URL_BASE = 'https://www.interactivebrokers.com'
 _EXCHANGES_REJECTION_MARKER = 'To continue please enter'
-_URL_CONTRACT_DETAILS = 'https://contract.ibkr.info/index.php'
+_DEFAULT_REQUESTS_PER_SECOND = 1. / 3.
+_DEFAULT_EXTRACTOR = 'lxml'
+
+_rate_limiter = HostRateLimiter(_DEFAULT_REQUESTS_PER_SECOND)
+_extractor = ibextract.create_extractor(_DEFAULT_EXTRACTOR)
+_parser_pool = None
+_parser_processes = 0
+_journal = None
+_parse_cache = None
 
 
 @unique
@@ -39,61 +53,231 @@ class ProductType(StrEnum):
         return NotImplemented
 
 
-def load_url(url: str, rejection_marker=None) -> str:
-    if not rejection_marker:
-        rejection_marker = _EXCHANGES_REJECTION_MARKER
+def set_rate_limit(requests_per_second: float, burst: int = 1) -> None:
+    """
+    Limits the rate of requests actually sent over the network (cache hits are not throttled).
+    The limit applies per host and is shared by all the crawling threads.
+
+    :param requests_per_second:
+    :param burst: number of requests that can be sent at once after an idle period
+    :return:
+    """
+    global _rate_limiter
+    _rate_limiter = HostRateLimiter(requests_per_second, burst)
+
+
+def get_rate_limiter() -> HostRateLimiter:
+    return _rate_limiter
+
 
-    html_text = urlcaching.open_url(url, rejection_marker=rejection_marker, throttle=3)
+def load_url(url: str, rejection_marker=None) -> str:
+    html_text = pagecache.open_url(url, rejection_marker=resolve_rejection_marker(rejection_marker),
+                                   before_request=_rate_limiter.acquire)
     return html_text
 
 
 def notify_url_error(url: str) -> None:
     logging.error('failed to load url: {}'.format(url))
-    urlcaching.invalidate_key(url)
+    pagecache.invalidate(url)
 
 
-def load_exchanges_for_product_type(product_type: ProductType) -> List[List[Tuple[str, str]]]:
-    url = _URL_BASE + f'/en/index.php?f=products&p={product_type.value}'
-    logging.info(f'loading data for product type {product_type.value}: {url}')
-    html_text = load_url(url)
-    html = BeautifulSoup(html_text, 'html.parser')
-    region_list_tag = html.find('div', {'id': product_type.value})
-    if region_list_tag is None:
+def resolve_rejection_marker(rejection_marker=None) -> str:
+    """
+
+    :param rejection_marker: marker of a rejected download, if any
+    :return: the marker, by default the one of the IB throttling page
+    """
+    if not rejection_marker:
+        rejection_marker = _EXCHANGES_REJECTION_MARKER
+
+    return rejection_marker
+
+
+def set_extractor(name: str) -> None:
+    """
+
+    :param name: one of ibextract.extractor_names()
+    :return:
+    """
+    global _extractor
+    _extractor = ibextract.create_extractor(name)
+    if _parser_pool is not None:
+        set_parser_processes(_parser_processes)
+
+
+def extractor_mismatches() -> int:
+    """
+
+    :return: number of differences found so far by the "parity" extractor, parser processes included, 0 otherwise
+    """
+    return getattr(_extractor, 'mismatches', 0)
+
+
+def set_parse_cache(parse_cache: Optional[ParseCache]) -> None:
+    """
+    Extraction results are taken from the cache when the same page content was already extracted.
+
+    :param parse_cache: None for no cache
+    :return:
+    """
+    global _parse_cache
+    _parse_cache = parse_cache
+
+
+def get_parse_cache() -> Optional[ParseCache]:
+    return _parse_cache
+
+
+def _active_parse_cache() -> Optional[ParseCache]:
+    # the parity extractor is meant to run against cached pages: its comparisons must not be skipped
+    if isinstance(_extractor, ibextract.ParityExtractor):
+        return None
+
+    return _parse_cache
+
+
+def _extract(kind: str, html_text: str, *args: str):
+    extract = getattr(_extractor, kind)
+    parse_cache = _active_parse_cache()
+    if parse_cache is None:
+        return extract(html_text, *args)
+
+    return parse_cache.cached(kind, ibextract.extractor_version(_extractor), extract, html_text, *args)
+
+
+def parse_region_urls(product_type: ProductType, html_text: str, url: str) -> Dict[str, str]:
+    """
+
+    :param product_type:
+    :param html_text: content of the product type page
+    :param url: url of the product type page, used when the product type has no regions
+    :return: dict of region name -> region url
+    """
+    region_links = _extract('region_links', html_text, product_type.value)
+    if region_links is None:
         region_urls = {'unknown': url}
 
     else:
-        region_urls = {region_link_tag.string: _URL_BASE + region_link_tag['href']
-                       for region_link_tag in region_list_tag.find_all('a')
-                       }
+        region_urls = {region_name: _URL_BASE + region_href for region_name, region_href in region_links}
+
+    return region_urls
+
+
+def parse_exchange_links(html_text: str) -> List[Tuple[str, str]]:
+    """
+
+    :param html_text: content of a region page
+    :return: list of (exchange name, exchange url)
+    """
+    exchanges_region = list()
+    for exchange_name, exchange_href in _extract('exchange_links', html_text):
+        exchange_url = _URL_BASE + f"/en/{exchange_href}"
+        logging.info(f'found url for exchange {exchange_name}: {exchange_url}')
+        exchanges_region.append((exchange_name, exchange_url))
 
+    return exchanges_region
+
+
+def product_type_url(product_type: ProductType) -> str:
+    return _URL_BASE + f'/en/index.php?f=products&p={product_type.value}'
+
+
+def url_product_type(url: str) -> Optional[ProductType]:
+    """
+    Region pages list the exchanges of all the product types: they belong to none.
+
+    :param url:
+    :return: product type of a product type page or an exchange page, None otherwise
+    """
+    query = parse_qs(urlparse(url).query)
+    if query.get('f') == ['products']:
+        codes = query.get('p', [])
+
+    else:
+        codes = query.get('showcategories', [])
+
+    product_types = {product_type.value: product_type for product_type in ProductType}
+    for code in codes:
+        if code.lower() in product_types:
+            return product_types[code.lower()]
+
+    return None
+
+
+def set_journal(journal: Optional[CrawlJournal]) -> None:
+    """
+    Records completed crawl units in the journal, units already recorded being taken from it
+    instead of being loaded again.
+
+    :param journal: None for no journal
+    :return:
+    """
+    global _journal
+    _journal = journal
+
+
+def get_journal() -> Optional[CrawlJournal]:
+    return _journal
+
+
+def load_exchanges_for_product_type(product_type: ProductType) -> List[Tuple[str, str]]:
+    if _journal is not None:
+        exchanges = _journal.exchanges(product_type.value)
+        if exchanges is not None:
+            logging.info(f'exchanges for product type {product_type.value} taken from journal')
+            return exchanges
+
+    url = product_type_url(product_type)
+    logging.info(f'loading data for product type {product_type.value}: {url}')
+    html_text = load_url(url)
+    region_urls = parse_region_urls(product_type, html_text, url)
     exchanges = list()
     for region_name in region_urls:
         region_url = region_urls[region_name]
         html_exchanges_text = load_url(region_url)
+        exchanges += parse_exchange_links(html_exchanges_text)
 
-        html_exchanges = BeautifulSoup(html_exchanges_text, 'html.parser')
-        exchanges_region = list()
-        for link_tag in html_exchanges.find_all('a'):
-            if link_tag.get('href') and link_tag.get('href').startswith('index.php?f='):
-                exchange_name = link_tag.string.encode('ascii', 'ignore').decode().strip()
-                exchange_url = _URL_BASE + f"/en/{link_tag['href']}"
-                logging.info(f'found url for exchange {exchange_name}: {exchange_url}')
-                exchanges_region.append((exchange_name, exchange_url))
-
-        exchanges += exchanges_region
+    if _journal is not None:
+        _journal.record_exchanges(product_type.value, exchanges)
 
     return exchanges
 
 
 class AsDict(object):
+    """
+    Exposes the public properties of subclasses as a dict.
+    Field names are collected once, when the subclass is created, unless the subclass lists them in `fields`.
+    """
+
+    __slots__ = ()
+
+    fields: Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'fields' not in cls.__dict__:
+            field_names = dict()
+            for klass in cls.__mro__:
+                for name, value in vars(klass).items():
+                    if not name.startswith('_') and isinstance(value, property):
+                        field_names.setdefault(name)
+
+            cls.fields = tuple(field_names)
+
+    def as_tuple(self) -> Tuple:
+        return tuple(getattr(self, field) for field in self.fields)
 
     def as_dict(self):
-        return {field: self.__getattribute__(field) for field in self.__dir__()
-                if not field.startswith('_') and field not in ('as_dict', 'fields')}
+        return dict(zip(self.fields, self.as_tuple()))
 
 
 class Instrument(AsDict):
 
+    __slots__ = ('_con_id', '_label', '_exchange', '_symbol', '_ib_symbol', '_currency', '_product_type')
+
+    # exported fields, in output column order
+    fields = ('con_id', 'label', 'symbol', 'ib_symbol', 'currency', 'product_type')
+
     def __init__(self, con_id: str, label: str, exchange: str):
         self._con_id = con_id
         self._label = label
@@ -103,6 +287,9 @@ class Instrument(AsDict):
         self._currency = None
         self._product_type = None
 
+    def as_tuple(self) -> Tuple:
+        return self._con_id, self._label, self._symbol, self._ib_symbol, self._currency, self._product_type
+
     @property
     def con_id(self) -> str:
         return self._con_id
@@ -111,6 +298,10 @@ class Instrument(AsDict):
     def label(self) -> str:
         return self._label
 
+    @property
+    def exchange(self) -> str:
+        return self._exchange
+
     @property
     def symbol(self) -> str:
         return self._symbol
@@ -144,109 +335,576 @@ class Instrument(AsDict):
         self._product_type = value
 
 
-def load_for_exchange_partial(exchange_name: str, exchange_url: str) -> Tuple[List[Instrument], str]:
+class _Categories(object):
+    """
+    Distinct values of a column, referred to by code.
+    """
+
+    __slots__ = ('values', '_codes')
+
+    def __init__(self):
+        self.values = list()
+        self._codes = dict()
+
+    def code(self, value) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+
+        return code
+
+
+class InstrumentBatch(object):
+    """
+    Column-oriented storage of instruments: con ids are kept in an integer array, exchanges, currencies and
+    product types as codes in arrays, so that a large number of instruments only costs their labels and symbols.
+    Iterating yields Instrument objects, rows() yields tuples in Instrument.fields order.
+    """
+
+    def __init__(self, instruments: Iterable[Instrument] = ()):
+        self._con_ids = array('q')
+        self._labels = list()
+        self._symbols = list()
+        self._ib_symbols = list()
+        self._exchange_codes = array('H')
+        self._currency_codes = array('H')
+        self._product_type_codes = array('H')
+        self._exchanges = _Categories()
+        self._currencies = _Categories()
+        self._product_types = _Categories()
+        self.extend(instruments)
+
+    def append(self, instrument: Instrument) -> None:
+        """
+
+        :param instrument: con_id has to be numeric
+        :return:
+        """
+        self._con_ids.append(int(instrument.con_id))
+        self._labels.append(instrument.label)
+        self._symbols.append(instrument.symbol)
+        self._ib_symbols.append(instrument.ib_symbol)
+        self._exchange_codes.append(self._exchanges.code(instrument.exchange))
+        self._currency_codes.append(self._currencies.code(instrument.currency))
+        self._product_type_codes.append(self._product_types.code(instrument.product_type))
+
+    def extend(self, instruments: Iterable[Instrument]) -> None:
+        for instrument in instruments:
+            self.append(instrument)
+
+    def __len__(self) -> int:
+        return len(self._con_ids)
+
+    def __getitem__(self, index: int) -> Instrument:
+        instrument = Instrument(con_id=str(self._con_ids[index]), label=self._labels[index],
+                                exchange=self._exchanges.values[self._exchange_codes[index]])
+        instrument.symbol = self._symbols[index]
+        instrument.ib_symbol = self._ib_symbols[index]
+        instrument.currency = self._currencies.values[self._currency_codes[index]]
+        instrument.product_type = self._product_types.values[self._product_type_codes[index]]
+        return instrument
+
+    def __iter__(self) -> Iterator[Instrument]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def rows(self) -> Iterator[Tuple]:
+        """
+
+        :return: tuples in Instrument.fields order
+        """
+        currencies = self._currencies.values
+        product_types = self._product_types.values
+        return zip(map(str, self._con_ids), self._labels, self._symbols, self._ib_symbols,
+                   (currencies[code] for code in self._currency_codes),
+                   (product_types[code] for code in self._product_type_codes))
+
+    def sort_by_label(self) -> None:
+        """
+        Stable sort on upper case labels, same order as sorting Instrument objects.
+
+        :return:
+        """
+        order = sorted(range(len(self)), key=lambda index: self._labels[index].upper())
+        self._con_ids = array('q', (self._con_ids[index] for index in order))
+        self._labels = [self._labels[index] for index in order]
+        self._symbols = [self._symbols[index] for index in order]
+        self._ib_symbols = [self._ib_symbols[index] for index in order]
+        self._exchange_codes = array('H', (self._exchange_codes[index] for index in order))
+        self._currency_codes = array('H', (self._currency_codes[index] for index in order))
+        self._product_type_codes = array('H', (self._product_type_codes[index] for index in order))
+
+
+def _exchange_page_instruments(exchange_name: str, exchange_page: ibextract.ExchangePage
+                               ) -> Tuple[List[Instrument], Optional[str], Optional[int], Dict[int, str]]:
+    rows, next_page_href, current_page, page_hrefs = exchange_page
     instruments = list()
-    html_text = load_url(exchange_url)
+    for con_id, label, ib_symbol, symbol, currency in rows:
+        instrument = Instrument(con_id=con_id, label=label, exchange=exchange_name)
+        instrument.ib_symbol = ib_symbol
+        instrument.symbol = symbol
+        instrument.currency = currency
+        instruments.append(instrument)
+
+    next_page_url = _URL_BASE + next_page_href if next_page_href is not None else None
+    page_urls = {page_number: _URL_BASE + page_href for page_number, page_href in page_hrefs.items()}
+    return instruments, next_page_url, current_page, page_urls
+
+
+def parse_exchange_page(exchange_name: str,
+                        html_text: str) -> Tuple[List[Instrument], Optional[str], Optional[int], Dict[int, str]]:
+    """
+
+    :param exchange_name:
+    :param html_text: content of an exchange listing page
+    :return: instruments listed in the page, url of the next page (None for the last page),
+    current page number and urls of the pages linked from the pagination block, by page number
+    """
+    return _exchange_page_instruments(exchange_name, _extract('exchange_page', html_text))
+
+
+def set_parser_processes(processes: int) -> None:
+    """
+    Extracts exchange pages in a pool of worker processes, so that parsing runs on several cores while
+    the loading threads carry on downloading. With 0 processes, pages are extracted by the loading threads.
+
+    :param processes:
+    :return:
+    """
+    global _parser_pool
+    global _parser_processes
+    if _parser_pool is not None:
+        _parser_pool.shutdown(wait=True, cancel_futures=True)
+        _parser_pool = None
+
+    _parser_processes = processes
+    if processes > 0:
+        _parser_pool = ProcessPoolExecutor(max_workers=processes, initializer=ibextract.init_worker_extractor,
+                                           initargs=(_extractor.name,))
+
+
+def submit_exchange_page(html_text: str) -> Future:
+    """
+    Hands over the extraction of an exchange page to the parser processes, if any.
+
+    :param html_text: content of an exchange listing page
+    :return: future ibextract.ExchangePage (compact tuples)
+    """
+    exchange_page = None
+    parse_cache = _active_parse_cache()
+    if parse_cache is not None:
+        cache_key = parse_cache.key('exchange_page', ibextract.extractor_version(_extractor), html_text)
+        exchange_page = parse_cache.lookup(cache_key)
+
+    if exchange_page is not None:
+        exchange_page_future = Future()
+        exchange_page_future.set_result(exchange_page)
+        return exchange_page_future
+
+    if _parser_pool is not None:
+        exchange_page_future = Future()
+
+        def count_mismatches(future: Future):
+            try:
+                exchange_page, mismatches = future.result()
+                if mismatches:
+                    _extractor.add_mismatches(mismatches)
+
+                exchange_page_future.set_result(exchange_page)
+
+            except BaseException as err:
+                exchange_page_future.set_exception(err)
+
+        _parser_pool.submit(ibextract.extract_exchange_page, html_text).add_done_callback(count_mismatches)
+
+    else:
+        exchange_page_future = Future()
+        try:
+            exchange_page_future.set_result(_extractor.exchange_page(html_text))
+
+        except Exception as err:
+            exchange_page_future.set_exception(err)
+
+    if parse_cache is None:
+        return exchange_page_future
+
+    # resolved once the result is cached
+    cached_exchange_page_future = Future()
+
+    def cache_exchange_page(future: Future):
+        try:
+            exchange_page = future.result()
+            parse_cache.put(cache_key, exchange_page)
+            cached_exchange_page_future.set_result(exchange_page)
+
+        except BaseException as err:
+            cached_exchange_page_future.set_exception(err)
+
+    exchange_page_future.add_done_callback(cache_exchange_page)
+    return cached_exchange_page_future
+
 
-    rule_contract_url = re.compile(r"javascript:NewWindow\(\'(.*?)\'")
+def journaled_exchange_page(exchange_url: str) -> Optional[Future]:
+    """
+
+    :param exchange_url:
+    :return: future ibextract.ExchangePage, already done, if the page is recorded in the journal, None otherwise
+    """
+    if _journal is None:
+        return None
 
-    def find_stock_details_link(tag):
-        is_link = tag.name == 'a'
-        if is_link and 'href' in tag.attrs:
-            check_contract_url = rule_contract_url.match(tag['href'])
-            return check_contract_url and check_contract_url.group(1).startswith(_URL_CONTRACT_DETAILS)
+    exchange_page = _journal.exchange_page(exchange_url)
+    if exchange_page is None:
+        return None
 
-        return False
+    exchange_page_future = Future()
+    exchange_page_future.set_result(exchange_page)
+    return exchange_page_future
+
+
+def exchange_page_result(exchange_name: str, exchange_url: str, exchange_page_future: Future
+                         ) -> Tuple[List[Instrument], Optional[str], Optional[int], Dict[int, str]]:
+    """
+    Waits for the extraction of an exchange page, recording it in the journal if any.
 
-    next_page_url = None
+    :param exchange_name:
+    :param exchange_url:
+    :param exchange_page_future: as returned by submit_exchange_page()
+    :return: same as parse_exchange_page()
+    """
     try:
-        html = BeautifulSoup(html_text, 'lxml')
-        pagination_tag = html.find('ul', {'class': 'pagination'})
-        if pagination_tag is not None:
-            current_page_tag = pagination_tag.find('li', {'class': 'active'})
-            if current_page_tag is not None:
-                next_page_tag = current_page_tag.find_next_sibling()
-                if next_page_tag:
-                    next_page_url = _URL_BASE + next_page_tag.find('a').get('href')
-
-        stock_link_tags = html.find_all(find_stock_details_link)
-        for tag in stock_link_tags:
-            url = rule_contract_url.search(tag['href']).group(1)
-            query = parse_qs(urlparse(url).query)
-            if 'conid' in query.keys():
-                instrument = Instrument(con_id=query['conid'][0], label=tag.string, exchange=exchange_name)
-                tag_row = tag.parent.parent
-                instrument_tags = [tag.string for tag in tag_row.find_all('td')]
-                if len(instrument_tags) != 4:
-                    raise RuntimeError('Unexpected instrument tags found: %s', instrument_tags)
-
-                ib_symbol, url_text, symbol, currency = instrument_tags
-                instrument.ib_symbol = ib_symbol
-                instrument.symbol = symbol
-                instrument.currency = currency
-                instruments.append(instrument)
+        exchange_page = exchange_page_future.result()
 
     except Exception:
         logging.error('failed to load exchange "%s"', exchange_name, exc_info=True)
         notify_url_error(exchange_url)
         raise
 
+    if _journal is not None:
+        _journal.record_exchange_page(exchange_name, exchange_url, exchange_page)
+
+    return _exchange_page_instruments(exchange_name, exchange_page)
+
+
+def infer_following_page_urls(current_page: Optional[int], page_urls: Dict[int, str],
+                              next_page_url: Optional[str]) -> List[str]:
+    """
+    Urls of all the pages from the one following current_page up to the last page linked from the pagination block,
+    built from the page number url pattern.
+
+    :param current_page:
+    :param page_urls: page urls by page number, as returned by parse_exchange_page()
+    :param next_page_url: url of the next page
+    :return: empty list when the url pattern cannot be inferred
+    """
+    if current_page is None or next_page_url is None or not page_urls:
+        return list()
+
+    url_patterns = set()
+    for page_url in page_urls.values():
+        check_page_number = ibextract.RULE_PAGE_NUMBER.search(page_url)
+        url_patterns.add((page_url[:check_page_number.start(1)], page_url[check_page_number.end(1):]))
+
+    if len(url_patterns) != 1:
+        return list()
+
+    url_prefix, url_suffix = url_patterns.pop()
+    following_page_urls = [url_prefix + str(page_number) + url_suffix
+                           for page_number in range(current_page + 1, max(page_urls) + 1)]
+    if not following_page_urls or following_page_urls[0] != next_page_url:
+        return list()
+
+    return following_page_urls
+
+
+def _log_page_instruments(instruments: List[Instrument]) -> None:
+    if len(instruments) > 0:
+        logging.info(f'retrieved {len(instruments)} instruments from "{instruments[0].label}" through "{instruments[-1].label}"')
+
+
+def load_exchange_page(exchange_name: str,
+                       exchange_url: str) -> Tuple[List[Instrument], str, Optional[int], Dict[int, str]]:
+    """
+
+    :param exchange_name:
+    :param exchange_url:
+    :return: instruments, next page url, current page number and page urls by page number
+    """
+    exchange_page_future = journaled_exchange_page(exchange_url)
+    if exchange_page_future is None:
+        exchange_page_future = submit_exchange_page(load_url(exchange_url))
+
+    return exchange_page_result(exchange_name, exchange_url, exchange_page_future)
+
+
+def load_for_exchange_partial(exchange_name: str, exchange_url: str) -> Tuple[List[Instrument], str]:
+    instruments, next_page_url, _, _ = load_exchange_page(exchange_name, exchange_url)
     return instruments, next_page_url
 
 
-def load_for_exchange(exchange_name: str, exchange_url: str) -> List[Instrument]:
+def load_for_exchange(exchange_name: str, exchange_url: str, page_workers: int = 1) -> List[Instrument]:
     """
+    Once a page is loaded, all the pages up to the last one linked from its pagination block are loaded at once.
+    When the page url pattern cannot be inferred, pages are loaded one after the other.
+    Downloaded pages are handed over to the parser processes (see set_parser_processes()): only the extraction
+    of the last page of a batch is waited for before downloading the next batch.
 
     :param exchange_name:
     :param exchange_url:
+    :param page_workers: number of pages loaded concurrently
     :return: list of dict
     """
-    instruments = list()
-    next_page_link = exchange_url
-    while True:
-        logging.info('processing page %s', next_page_link)
-        new_instruments, next_page_link = load_for_exchange_partial(exchange_name, next_page_link)
-        if len(new_instruments) > 0:
-            logging.info(f'retrieved {len(new_instruments)} instruments from "{new_instruments[0].label}" through "{new_instruments[-1].label}"')
+    executor = None
+    if page_workers > 1:
+        executor = ThreadPoolExecutor(max_workers=page_workers, thread_name_prefix='page')
+
+    def fetch_page(page_url):
+        logging.info('processing page %s', page_url)
+        page_future = journaled_exchange_page(page_url)
+        if page_future is None:
+            page_future = submit_exchange_page(load_url(page_url))
 
-        instruments += new_instruments
-        if next_page_link is None:
-            break
+        return page_url, page_future
+
+    instruments = list()
+    try:
+        fetched_pages = [fetch_page(exchange_url)]
+        while fetched_pages:
+            last_page_url, last_page_future = fetched_pages[-1]
+            last_page = exchange_page_result(exchange_name, last_page_url, last_page_future)
+            _, next_page_link, current_page, page_urls = last_page
+            following_page_urls = list()
+            if next_page_link is not None:
+                following_page_urls = infer_following_page_urls(current_page, page_urls, next_page_link)
+                if not following_page_urls:
+                    following_page_urls = [next_page_link]
+
+            if executor is None:
+                next_fetched_pages = map(fetch_page, following_page_urls)
+
+            else:
+                # downloads start right away and results come back in page order
+                next_fetched_pages = executor.map(fetch_page, following_page_urls)
+
+            pages = [exchange_page_result(exchange_name, page_url, page_future)
+                     for page_url, page_future in fetched_pages[:-1]] + [last_page]
+            for new_instruments, _, _, _ in pages:
+                _log_page_instruments(new_instruments)
+                instruments += new_instruments
+
+            fetched_pages = list(next_fetched_pages)
+
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
 
     return instruments
 
 
-def list_instruments(product_types: Iterable[ProductType]) -> Generator[Instrument, None, None]:
+def _load_exchange(exchange: Tuple[str, str], page_workers: int = 1) -> List[Instrument]:
+    exchange_name, exchange_url = exchange
+    logging.info(f'processing exchange data {exchange_name}, {exchange_url}')
+    return load_for_exchange(exchange_name, exchange_url, page_workers=page_workers)
+
+
+def _product_type_instruments(product_type: ProductType, load_exchange: Callable[[Tuple[str, str]], List[Instrument]],
+                              executor: Optional[ThreadPoolExecutor]) -> Generator[Instrument, None, None]:
+    exchanges = load_exchanges_for_product_type(product_type)
+    logging.info(f'{len(exchanges)} available exchanges for product type "{product_type}"', )
+    sorted_exchanges = sorted(exchanges, key=itemgetter(0))
+    if executor is None:
+        exchanges_instruments = map(load_exchange, sorted_exchanges)
+
+    else:
+        # results come back in submission order, so output is the same as a sequential crawl
+        exchanges_instruments = executor.map(load_exchange, sorted_exchanges)
+
+    for exchange_instruments in exchanges_instruments:
+        for instrument in exchange_instruments:
+            instrument.product_type = product_type
+            yield instrument
+
+
+def list_instruments_by_product_type(product_types: Iterable[ProductType], workers: int = 1, page_workers: int = 1
+                                     ) -> Generator[Tuple[ProductType, Iterator[Instrument]], None, None]:
+    """
+    Same as list_instruments(), telling apart the instruments of each product type.
+
+    :param product_types:
+    :param workers: number of exchanges loaded concurrently
+    :param page_workers: number of pages loaded concurrently for each exchange
+    :return: (product type, instruments) in product type order, instruments being loaded while iterating
+    """
+    load_exchange = partial(_load_exchange, page_workers=page_workers)
+    executor = None
+    if workers > 1:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='exchange')
+
+    try:
+        for product_type in sorted(product_types):
+            yield product_type, _product_type_instruments(product_type, load_exchange, executor)
+
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def list_instruments(product_types: Iterable[ProductType], workers: int = 1,
+                     page_workers: int = 1) -> Generator[Instrument, None, None]:
     """
 
     :param product_types:
+    :param workers: number of exchanges loaded concurrently
+    :param page_workers: number of pages loaded concurrently for each exchange
     :return: dict() representing the instrument row
     """
-    for product_type in sorted(product_types):
-        exchanges = load_exchanges_for_product_type(product_type)
-        logging.info(f'{len(exchanges)} available exchanges for product type "{product_type}"', )
-        for exchange_name, exchange_url in sorted(exchanges, key=itemgetter(0)):
-            logging.info(f'processing exchange data {exchange_name}, {exchange_url}')
-            exchange_instruments = load_for_exchange(exchange_name, exchange_url)
-            for instrument in exchange_instruments:
-                instrument.product_type = product_type
-                yield instrument
+    for product_type, instruments in list_instruments_by_product_type(product_types, workers, page_workers):
+        for instrument in instruments:
+            yield instrument
+
+
+def prefetch(product_types: Iterable[ProductType], workers: int = 1, page_workers: int = 1) -> int:
+    """
+    Loads all the pages of the product types, filling the cache ahead of an export.
+
+    :param product_types:
+    :param workers: number of exchanges loaded concurrently
+    :param page_workers: number of pages loaded concurrently for each exchange
+    :return: number of instruments found
+    """
+    count_instruments = 0
+    for product_type, instruments in list_instruments_by_product_type(product_types, workers, page_workers):
+        count_product_type = sum(1 for _ in instruments)
+        logging.info('prefetched %d instruments for product type %s', count_product_type, product_type.value)
+        count_instruments += count_product_type
+
+    return count_instruments
 
 
 def process_instruments(product_types: Iterable[ProductType],
-                        results_processor: Callable[[ProductType, str, Iterable[Instrument]], None]) -> None:
+                        results_processor: Callable[[ProductType, str, Iterable[Instrument]], None],
+                        workers: int = 1, page_workers: int = 1, memory_budget: Optional[int] = None) -> None:
     """
 
     :param product_types:
     :param results_processor: function taking (product_type_code, currency, instruments list) as input
+    :param workers: number of exchanges loaded concurrently
+    :param page_workers: number of pages loaded concurrently for each exchange
+    :param memory_budget: when specified, number of bytes pending instruments may use before being spilled to disk,
+    results being passed on as soon as each product type is complete
     :return:
     """
     logging.info('processing instruments')
-    by_product_type_and_currency = defaultdict(list)
-    for instrument in list_instruments(product_types):
+    if memory_budget is None:
+        instruments = list_instruments(product_types, workers=workers, page_workers=page_workers)
+        group_instruments(instruments, results_processor)
+        return
+
+    streamer = InstrumentsStreamer(results_processor, memory_budget)
+    try:
+        for _, instruments in list_instruments_by_product_type(product_types, workers, page_workers):
+            for instrument in instruments:
+                streamer.add(instrument)
+
+            streamer.flush()
+
+    finally:
+        streamer.close()
+
+
+def group_instruments(instruments: Iterable[Instrument],
+                      results_processor: Callable[[ProductType, str, Iterable[Instrument]], None]) -> None:
+    """
+    Passes instruments to results_processor by product type and currency, sorted by label.
+
+    :param instruments:
+    :param results_processor: function taking (product_type_code, currency, instruments list) as input
+    :return:
+    """
+    by_product_type_and_currency = defaultdict(InstrumentBatch)
+    for instrument in instruments:
         by_product_type_and_currency[(instrument.product_type, instrument.currency)].append(instrument)
 
     for product_type, currency in by_product_type_and_currency:
         instruments = by_product_type_and_currency[(product_type, currency)]
-        results_processor(product_type, currency, sorted(instruments, key=lambda k: k.label.upper()))
+        instruments.sort_by_label()
+        results_processor(product_type, currency, instruments)
+
+
+def _instrument_as_row(instrument: Instrument) -> Tuple:
+    return (instrument.con_id, instrument.label, instrument.exchange, instrument.symbol, instrument.ib_symbol,
+            instrument.currency, instrument.product_type)
+
+
+def _row_as_instrument(row: Tuple) -> Instrument:
+    con_id, label, exchange, symbol, ib_symbol, currency, product_type = row
+    instrument = Instrument(con_id=con_id, label=label, exchange=exchange)
+    instrument.symbol = symbol
+    instrument.ib_symbol = ib_symbol
+    instrument.currency = currency
+    instrument.product_type = product_type
+    return instrument
+
 
+def _row_sort_key(row: Tuple) -> str:
+    return row[1].upper()
+
+
+class InstrumentsStreamer(object):
+    """
+    Same output as group_instruments(), except that the buckets of a product type are passed on as soon as
+    the product type is flushed, or when the next product type starts.
+    Pending instruments are spilled to disk beyond the memory budget.
+    Instruments are expected to come grouped by product type, as yielded by list_instruments().
+    """
+
+    def __init__(self, results_processor: Callable[[ProductType, str, Iterable[Instrument]], None],
+                 memory_budget: int, temp_dir: str = None):
+        """
+
+        :param results_processor: function taking (product_type_code, currency, instruments iterable) as input
+        :param memory_budget: number of bytes pending instruments may use before being spilled to disk
+        :param temp_dir: parent directory of the spilled files, system default if None
+        """
+        self._results_processor = results_processor
+        self._memory_budget = memory_budget
+        self._temp_dir = temp_dir
+        self._product_type = None
+        self._grouper = None
+
+    def add(self, instrument: Instrument) -> None:
+        if self._grouper is None or instrument.product_type != self._product_type:
+            self.flush()
+            self._product_type = instrument.product_type
+            self._grouper = ExternalGrouper(_row_sort_key, self._memory_budget, temp_dir=self._temp_dir)
+
+        self._grouper.add((instrument.product_type, instrument.currency), _instrument_as_row(instrument))
+
+    def flush(self) -> None:
+        """
+        Passes on the buckets of the current product type.
+
+        :return:
+        """
+        if self._grouper is None:
+            return
+
+        try:
+            if self._grouper.count_runs > 0:
+                logging.info('merging %d runs spilled for product type "%s"',
+                             self._grouper.count_runs, self._product_type)
+
+            for product_type, currency in self._grouper.group_keys():
+                rows = self._grouper.sorted_group((product_type, currency))
+                self._results_processor(product_type, currency, map(_row_as_instrument, rows))
+
+        finally:
+            self._grouper.close()
+            self._grouper = None
+
+    def close(self) -> None:
+        if self._grouper is not None:
+            self._grouper.close()
+            self._grouper = None
@@ -0,0 +1,360 @@
+"""
+Extraction of links and instrument rows from IB pages.
+
+SoupExtractor is the reference implementation based on BeautifulSoup. LxmlExtractor gives the same results
+using compiled XPath expressions, which avoids calling back into Python for every tag of the document.
+ParityExtractor runs both and reports any difference.
+"""
+import logging
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+_URL_CONTRACT_DETAILS = 'https://contract.ibkr.info/index.php'
+_RULE_CONTRACT_URL = re.compile(r"javascript:NewWindow\(\'(.*?)\'")
+RULE_PAGE_NUMBER = re.compile(r'[?&]page=(\d+)')
+
+# con_id, label, ib_symbol, symbol, currency
+InstrumentRow = Tuple[str, str, str, str, str]
+
+# instrument rows, next page href, current page number, page hrefs by page number
+ExchangePage = Tuple[List[InstrumentRow], Optional[str], Optional[int], Dict[int, str]]
+
+
+def _contract_url(href: str) -> Optional[str]:
+    check_contract_url = _RULE_CONTRACT_URL.match(href)
+    if check_contract_url and check_contract_url.group(1).startswith(_URL_CONTRACT_DETAILS):
+        return check_contract_url.group(1)
+
+    return None
+
+
+def _contract_id(contract_url: str) -> Optional[str]:
+    query = parse_qs(urlparse(contract_url).query)
+    if 'conid' in query.keys():
+        return query['conid'][0]
+
+    return None
+
+
+def _instrument_row(con_id: str, label: str, instrument_tags: List[str]) -> InstrumentRow:
+    if len(instrument_tags) != 4:
+        raise RuntimeError('Unexpected instrument tags found: %s', instrument_tags)
+
+    ib_symbol, url_text, symbol, currency = instrument_tags
+    return con_id, label, ib_symbol, symbol, currency
+
+
+def _page_number(href: Optional[str]) -> Optional[int]:
+    if not href:
+        return None
+
+    check_page_number = RULE_PAGE_NUMBER.search(href)
+    if check_page_number is None:
+        return None
+
+    return int(check_page_number.group(1))
+
+
+def _as_str(text) -> Optional[str]:
+    return None if text is None else str(text)
+
+
+class SoupExtractor(object):
+    """
+    Reference implementation.
+    """
+
+    name = 'bs4'
+    version = 1
+
+    def region_links(self, html_text: str, product_type_code: str) -> Optional[List[Tuple[str, str]]]:
+        """
+
+        :param html_text: content of a product type page
+        :param product_type_code:
+        :return: list of (region name, href), None if the page has no region list
+        """
+        html = BeautifulSoup(html_text, 'html.parser')
+        region_list_tag = html.find('div', {'id': product_type_code})
+        if region_list_tag is None:
+            return None
+
+        return [(_as_str(region_link_tag.string), region_link_tag['href'])
+                for region_link_tag in region_list_tag.find_all('a')]
+
+    def exchange_links(self, html_text: str) -> List[Tuple[str, str]]:
+        """
+
+        :param html_text: content of a region page
+        :return: list of (exchange name, href)
+        """
+        html_exchanges = BeautifulSoup(html_text, 'html.parser')
+        exchanges_region = list()
+        for link_tag in html_exchanges.find_all('a'):
+            if link_tag.get('href') and link_tag.get('href').startswith('index.php?f='):
+                exchange_name = link_tag.string.encode('ascii', 'ignore').decode().strip()
+                exchanges_region.append((exchange_name, link_tag['href']))
+
+        return exchanges_region
+
+    def exchange_page(self, html_text: str) -> ExchangePage:
+        """
+
+        :param html_text: content of an exchange listing page
+        :return: instrument rows, next page href, current page number and page hrefs by page number
+        """
+        def find_stock_details_link(tag):
+            is_link = tag.name == 'a'
+            if is_link and 'href' in tag.attrs:
+                return _contract_url(tag['href']) is not None
+
+            return False
+
+        next_page_href = None
+        current_page = None
+        page_hrefs = dict()
+        html = BeautifulSoup(html_text, 'lxml')
+        pagination_tag = html.find('ul', {'class': 'pagination'})
+        if pagination_tag is not None:
+            current_page_tag = pagination_tag.find('li', {'class': 'active'})
+            if current_page_tag is not None:
+                next_page_tag = current_page_tag.find_next_sibling()
+                if next_page_tag:
+                    next_page_href = next_page_tag.find('a').get('href')
+
+            for item_tag in pagination_tag.find_all('li'):
+                link_tag = item_tag.find('a')
+                page_number = _page_number(link_tag.get('href') if link_tag is not None else None)
+                if page_number is None:
+                    continue
+
+                page_hrefs[page_number] = link_tag['href']
+                if 'active' in item_tag.get('class', list()):
+                    current_page = page_number
+
+        rows = list()
+        for tag in html.find_all(find_stock_details_link):
+            con_id = _contract_id(_contract_url(tag['href']))
+            if con_id is not None:
+                instrument_tags = [_as_str(tag.string) for tag in tag.parent.parent.find_all('td')]
+                rows.append(_instrument_row(con_id, _as_str(tag.string), instrument_tags))
+
+        return rows, next_page_href, current_page, page_hrefs
+
+
+def _element_string(element) -> Optional[str]:
+    """
+    Same as BeautifulSoup Tag.string: text of an element having a single child, None otherwise.
+    """
+    children = list(element)
+    if len(children) == 0:
+        return element.text
+
+    if len(children) == 1 and not element.text and not children[0].tail:
+        if not isinstance(children[0].tag, str):
+            # comment or processing instruction
+            return children[0].text
+
+        return _element_string(children[0])
+
+    return None
+
+
+def _has_class(class_name: str) -> str:
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(class_name)
+
+
+class LxmlExtractor(object):
+    """
+    Same results as SoupExtractor, based on compiled XPath expressions.
+    """
+
+    name = 'lxml'
+    version = 1
+
+    _xpath_region_list = etree.XPath('(//div[@id=$region_id])[1]')
+    _xpath_exchange_links = etree.XPath("//a[starts-with(@href, 'index.php?f=')]")
+    _xpath_stock_links = etree.XPath("//a[starts-with(@href, \"javascript:NewWindow('\")]")
+    _xpath_pagination = etree.XPath('(//ul[{}])[1]'.format(_has_class('pagination')))
+    _xpath_active_page = etree.XPath('(.//li[{}])[1]'.format(_has_class('active')))
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _parse(self, html_text: str):
+        # lxml parsers must not be shared between threads
+        if not hasattr(self._local, 'parser'):
+            self._local.parser = etree.HTMLParser()
+
+        return etree.fromstring(html_text, self._local.parser)
+
+    def region_links(self, html_text: str, product_type_code: str) -> Optional[List[Tuple[str, str]]]:
+        html = self._parse(html_text)
+        region_list_tags = self._xpath_region_list(html, region_id=product_type_code) if html is not None else []
+        if not region_list_tags:
+            return None
+
+        return [(_element_string(region_link_tag), region_link_tag.attrib['href'])
+                for region_link_tag in region_list_tags[0].iterdescendants('a')]
+
+    def exchange_links(self, html_text: str) -> List[Tuple[str, str]]:
+        html = self._parse(html_text)
+        if html is None:
+            return list()
+
+        return [(_element_string(link_tag).encode('ascii', 'ignore').decode().strip(), link_tag.get('href'))
+                for link_tag in self._xpath_exchange_links(html)]
+
+    def exchange_page(self, html_text: str) -> ExchangePage:
+        next_page_href = None
+        current_page = None
+        page_hrefs = dict()
+        rows = list()
+        html = self._parse(html_text)
+        if html is None:
+            return rows, next_page_href, current_page, page_hrefs
+
+        pagination_tags = self._xpath_pagination(html)
+        if pagination_tags:
+            current_page_tags = self._xpath_active_page(pagination_tags[0])
+            if current_page_tags:
+                next_page_tag = next((sibling for sibling in current_page_tags[0].itersiblings()
+                                      if isinstance(sibling.tag, str)), None)
+                if next_page_tag is not None:
+                    next_page_href = next(next_page_tag.iterdescendants('a')).get('href')
+
+            for item_tag in pagination_tags[0].iterdescendants('li'):
+                link_tag = next(item_tag.iterdescendants('a'), None)
+                page_number = _page_number(link_tag.get('href') if link_tag is not None else None)
+                if page_number is None:
+                    continue
+
+                page_hrefs[page_number] = link_tag.get('href')
+                if 'active' in item_tag.get('class', '').split():
+                    current_page = page_number
+
+        for link_tag in self._xpath_stock_links(html):
+            contract_url = _contract_url(link_tag.get('href'))
+            if contract_url is None:
+                continue
+
+            con_id = _contract_id(contract_url)
+            if con_id is not None:
+                tag_row = link_tag.getparent().getparent()
+                instrument_tags = [_element_string(tag) for tag in tag_row.iterdescendants('td')]
+                rows.append(_instrument_row(con_id, _element_string(link_tag), instrument_tags))
+
+        return rows, next_page_href, current_page, page_hrefs
+
+
+class ParityExtractor(object):
+    """
+    Runs the candidate extractor against the reference one, logs any difference and returns the reference results.
+    A failure of the candidate counts as a difference.
+    """
+
+    name = 'parity'
+    version = 1
+
+    def __init__(self, reference=None, candidate=None):
+        self._reference = reference if reference is not None else SoupExtractor()
+        self._candidate = candidate if candidate is not None else LxmlExtractor()
+        self._mismatches = 0
+        self._lock = threading.Lock()
+
+    @property
+    def mismatches(self) -> int:
+        return self._mismatches
+
+    def add_mismatches(self, count: int) -> None:
+        """
+        Accounts for the mismatches found by the same extractor in another process.
+        """
+        with self._lock:
+            self._mismatches += count
+
+    def _compare(self, method_name: str, *args):
+        expected = getattr(self._reference, method_name)(*args)
+        try:
+            actual = getattr(self._candidate, method_name)(*args)
+
+        except Exception:
+            with self._lock:
+                self._mismatches += 1
+
+            logging.exception('extractor "%s" failed (%s)', self._candidate.name, method_name)
+            return expected
+
+        if expected != actual:
+            with self._lock:
+                self._mismatches += 1
+
+            logging.warning('extractor "%s" differs from "%s" (%s): %s != %s',
+                            self._candidate.name, self._reference.name, method_name, actual, expected)
+
+        return expected
+
+    def region_links(self, html_text: str, product_type_code: str) -> Optional[List[Tuple[str, str]]]:
+        return self._compare('region_links', html_text, product_type_code)
+
+    def exchange_links(self, html_text: str) -> List[Tuple[str, str]]:
+        return self._compare('exchange_links', html_text)
+
+    def exchange_page(self, html_text: str) -> ExchangePage:
+        return self._compare('exchange_page', html_text)
+
+
+_worker_extractor = None
+
+
+def init_worker_extractor(name: str) -> None:
+    """
+    Initializer of the parser worker processes.
+
+    :param name: extractor used by the worker
+    :return:
+    """
+    global _worker_extractor
+    _worker_extractor = create_extractor(name)
+
+
+def extract_exchange_page(html_text: str) -> Tuple[ExchangePage, int]:
+    """
+    Task run by the parser worker processes.
+
+    :param html_text: content of an exchange listing page
+    :return: extracted page and number of parity mismatches it caused, counted in the worker process
+    """
+    mismatches = getattr(_worker_extractor, 'mismatches', 0)
+    exchange_page = _worker_extractor.exchange_page(html_text)
+    return exchange_page, getattr(_worker_extractor, 'mismatches', 0) - mismatches
+
+
+_EXTRACTORS = {extractor_class.name: extractor_class
+               for extractor_class in (SoupExtractor, LxmlExtractor, ParityExtractor)}
+
+
+def extractor_names() -> List[str]:
+    return list(_EXTRACTORS.keys())
+
+
+def extractor_version(extractor) -> str:
+    """
+    Identifies the results of an extractor: the version has to be increased whenever results may change.
+
+    :param extractor:
+    :return:
+    """
+    return '{}-{}'.format(extractor.name, extractor.version)
+
+
+def create_extractor(name: str):
+    if name not in _EXTRACTORS:
+        raise ValueError('unknown extractor "{}", expecting one of {}'.format(name, extractor_names()))
+
+    return _EXTRACTORS[name]()
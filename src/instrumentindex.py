@@ -0,0 +1,208 @@
+"""
+Immutable lookup index of the instruments of a crawl, resolving con ids to (symbol, exchange, currency) and back.
+
+The index is a single file, a sectionfile: opening it does not read it, and the pages are shared by all the processes
+using the same file. Sections:
+ - con ids of the records, sorted (int64)
+ - fields of the records: string ids of label, symbol, ib_symbol, exchange, currency and product type (uint32)
+ - string table: offsets (uint64) into the utf-8 data of the distinct strings, sorted so that string ids compare
+   like the strings
+ - secondary indexes: record numbers sorted by ib_symbol, and by symbol (uint32)
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from ibdataloader import Instrument, ProductType
+from sectionfile import SectionFile, write_sections
+
+_MAGIC = b'IBIDX002'
+_COUNT_FIELDS = 6
+_FIELD_LABEL, _FIELD_SYMBOL, _FIELD_IB_SYMBOL, _FIELD_EXCHANGE, _FIELD_CURRENCY, _FIELD_PRODUCT_TYPE = range(6)
+
+
+class InstrumentRecord(NamedTuple):
+    con_id: str
+    label: str
+    symbol: str
+    ib_symbol: str
+    exchange: str
+    currency: str
+    product_type: str
+
+
+class IndexBuilder(object):
+    """
+    Gathers instruments, possibly while they are passed on to the writers of a crawl (see passing_through()),
+    and writes the index file once the crawl is over.
+    """
+
+    def __init__(self):
+        self._con_ids = array('q')
+        self._fields = array('I')
+        self._string_ids: Dict[str, int] = dict()
+
+    def _string_id(self, value: Optional[str]) -> int:
+        value = value if value is not None else ''
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = len(self._string_ids)
+            self._string_ids[value] = string_id
+
+        return string_id
+
+    def add(self, instrument: Instrument) -> None:
+        """
+
+        :param instrument: con_id has to be numeric
+        :return:
+        """
+        product_type = instrument.product_type
+        if isinstance(product_type, ProductType):
+            product_type = product_type.value
+
+        self._con_ids.append(int(instrument.con_id))
+        self._fields.extend(self._string_id(value) for value in (
+            instrument.label, instrument.symbol, instrument.ib_symbol, instrument.exchange, instrument.currency,
+            product_type))
+
+    def passing_through(self, product_type: ProductType, currency: str,
+                        instruments: Iterable[Instrument]) -> Iterator[Instrument]:
+        for instrument in instruments:
+            self.add(instrument)
+            yield instrument
+
+    def __len__(self) -> int:
+        return len(self._con_ids)
+
+    def write(self, path: str) -> None:
+        """
+        Writes the index, replacing any previous one at once: processes using it keep their mapping of the
+        previous file.
+
+        :param path:
+        :return:
+        """
+        strings = sorted(self._string_ids, key=lambda value: value.encode('utf-8'))
+        new_string_ids = array('I', bytes(4 * len(strings)))
+        for new_string_id, value in enumerate(strings):
+            new_string_ids[self._string_ids[value]] = new_string_id
+
+        def sort_key(record_number):
+            return (self._con_ids[record_number],
+                    strings[new_string_ids[self._fields[record_number * _COUNT_FIELDS + _FIELD_EXCHANGE]]])
+
+        order = sorted(range(len(self._con_ids)), key=sort_key)
+        con_ids = array('q', (self._con_ids[record_number] for record_number in order))
+        fields = array('I', (new_string_ids[self._fields[record_number * _COUNT_FIELDS + field]]
+                             for record_number in order for field in range(_COUNT_FIELDS)))
+
+        string_data = bytearray()
+        string_offsets = array('Q', [0])
+        for value in strings:
+            string_data += value.encode('utf-8')
+            string_offsets.append(len(string_data))
+
+        def secondary_index(field):
+            return array('I', sorted(range(len(con_ids)),
+                                     key=lambda record: (fields[record * _COUNT_FIELDS + field], con_ids[record])))
+
+        sections = [con_ids.tobytes(), fields.tobytes(), string_offsets.tobytes(), bytes(string_data),
+                    secondary_index(_FIELD_IB_SYMBOL).tobytes(), secondary_index(_FIELD_SYMBOL).tobytes()]
+        write_sections(path, _MAGIC, (_COUNT_FIELDS, len(con_ids), len(strings)), sections)
+
+
+class InstrumentIndex(SectionFile):
+    """
+    Read-only access to an index written by IndexBuilder. Lookups return InstrumentRecord lists, sorted by con id.
+    """
+
+    def __init__(self, path: str):
+        """
+
+        :param path:
+        :raises ValueError: when the file is not an index readable on this platform
+        """
+        super().__init__(path, _MAGIC, 3, 6, 'an instrument index')
+        count_fields, self._count_records, self._count_strings = self._header_values
+        if count_fields != _COUNT_FIELDS:
+            self.close()
+            raise ValueError('not an instrument index: {}'.format(path))
+
+        self._con_ids = self._section(0, self._count_records, 'q')
+        self._fields = self._section(1, self._count_records * _COUNT_FIELDS, 'I')
+        self._string_offsets = self._section(2, self._count_strings + 1, 'Q')
+        self._string_data = self._section(3, self._string_offsets[self._count_strings], 'B')
+        self._secondary_indexes = {
+            _FIELD_IB_SYMBOL: self._section(4, self._count_records, 'I'),
+            _FIELD_SYMBOL: self._section(5, self._count_records, 'I'),
+        }
+
+    def __len__(self) -> int:
+        return self._count_records
+
+    def _string_bytes(self, string_id: int) -> bytes:
+        return self._string_data[self._string_offsets[string_id]:self._string_offsets[string_id + 1]].tobytes()
+
+    def _string(self, string_id: int) -> str:
+        return self._string_bytes(string_id).decode('utf-8')
+
+    def _find_string(self, value: str) -> Optional[int]:
+        encoded = value.encode('utf-8')
+        string_id = bisect_left(range(self._count_strings), encoded, key=self._string_bytes)
+        if string_id < self._count_strings and self._string_bytes(string_id) == encoded:
+            return string_id
+
+        return None
+
+    def _record(self, record_number: int) -> InstrumentRecord:
+        start = record_number * _COUNT_FIELDS
+        label, symbol, ib_symbol, exchange, currency, product_type = (
+            self._string(string_id) for string_id in self._fields[start:start + _COUNT_FIELDS])
+        return InstrumentRecord(str(self._con_ids[record_number]), label, symbol, ib_symbol, exchange, currency,
+                                product_type)
+
+    def con_id_at(self, position: int) -> str:
+        """
+
+        :param position: from 0 to len(index) - 1
+        :return: con id at that position in the sorted con ids (with repetitions)
+        """
+        return str(self._con_ids[position])
+
+    def by_con_id(self, con_id: str) -> List[InstrumentRecord]:
+        """
+
+        :param con_id:
+        :return: one record per exchange listing the contract
+        """
+        con_id = int(con_id)
+        start = bisect_left(self._con_ids, con_id)
+        end = bisect_right(self._con_ids, con_id, lo=start)
+        return [self._record(record_number) for record_number in range(start, end)]
+
+    def _by_field(self, field: int, value: str, exchange: Optional[str], currency: Optional[str]
+                  ) -> List[InstrumentRecord]:
+        string_id = self._find_string(value)
+        if string_id is None:
+            return list()
+
+        secondary_index = self._secondary_indexes[field]
+
+        def field_string_id(record_number):
+            return self._fields[record_number * _COUNT_FIELDS + field]
+
+        start = bisect_left(secondary_index, string_id, key=field_string_id)
+        end = bisect_right(secondary_index, string_id, lo=start, key=field_string_id)
+        records = [self._record(record_number) for record_number in secondary_index[start:end]]
+        return [record for record in records
+                if (exchange is None or record.exchange == exchange)
+                and (currency is None or record.currency == currency)]
+
+    def by_ib_symbol(self, ib_symbol: str, exchange: Optional[str] = None,
+                     currency: Optional[str] = None) -> List[InstrumentRecord]:
+        return self._by_field(_FIELD_IB_SYMBOL, ib_symbol, exchange, currency)
+
+    def by_symbol(self, symbol: str, exchange: Optional[str] = None,
+                  currency: Optional[str] = None) -> List[InstrumentRecord]:
+        return self._by_field(_FIELD_SYMBOL, symbol, exchange, currency)
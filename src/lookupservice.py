@@ -0,0 +1,338 @@
+"""
+HTTP/JSON lookup service over the indexes written by load-ib.py (--index, and optionally --search-index).
+
+Requests (responses are JSON, records as in instrumentindex.InstrumentRecord):
+ - GET /conid/<con id>
+ - GET /symbol/<symbol>?exchange=<exchange>&currency=<currency>, GET /ib_symbol/<ib symbol>?... likewise
+ - GET /search?q=<text>&k=<count>, when a search index is available
+ - POST /batch with {"con_ids": [...], "symbols": [...], "ib_symbols": [...]}
+ - GET /status
+
+Lookups go through an LRU cache of the most requested keys. The index files are checked periodically:
+when a new snapshot replaces them, the new files are opened and the cache is cleared.
+Plain asyncio streams, HTTP/1.1 with keep-alive: no dependency beyond the standard library.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+from instrumentindex import InstrumentIndex
+from trigramindex import TrigramIndex
+
+_DEFAULT_CACHE_SIZE = 100000
+_DEFAULT_RELOAD_INTERVAL = 5.
+_MAX_BATCH_SIZE = 10000
+# room for a full batch of quoted keys, much longer than con ids and symbols
+_MAX_BODY_SIZE = _MAX_BATCH_SIZE * 64
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+            500: 'Internal Server Error'}
+
+
+async def _read_request_head(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, str, Dict[str, str], int]]:
+    """
+
+    :param reader:
+    :return: method, target, HTTP version, headers (lower case names) and body size, None at the end of the stream
+    :raises ValueError: when the request line or a header is malformed
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    method, target, version = request_line.decode('latin-1').split()
+    if not version.startswith('HTTP/'):
+        raise ValueError('not an HTTP request: {!r}'.format(request_line))
+
+    headers = dict()
+    while True:
+        header_line = await reader.readline()
+        if header_line in (b'\r\n', b'\n'):
+            break
+
+        name, separator, value = header_line.decode('latin-1').partition(':')
+        if not separator or not name.strip():
+            raise ValueError('malformed header: {!r}'.format(header_line))
+
+        headers[name.strip().lower()] = value.strip()
+
+    content_length = headers.get('content-length', '0')
+    if not content_length.isdigit():
+        raise ValueError('malformed content length: {!r}'.format(content_length))
+
+    return method, target, version, headers, int(content_length)
+
+
+async def _write_response(writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool) -> None:
+    content = json.dumps(payload).encode('utf-8')
+    writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                 'Connection: {}\r\n\r\n'.format(status, _REASONS[status], len(content),
+                                                 'keep-alive' if keep_alive else 'close').encode('latin-1') + content)
+    await writer.drain()
+
+
+class LRUCache(object):
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[Any]:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        file_stat = os.stat(path)
+
+    except FileNotFoundError:
+        return None
+
+    return file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns
+
+
+class LookupService(object):
+    """
+    Requests are answered from the event loop thread: lookups are quick memory-mapped reads.
+    """
+
+    def __init__(self, index_path: str, search_index_path: Optional[str] = None,
+                 cache_size: int = _DEFAULT_CACHE_SIZE):
+        """
+
+        :param index_path: written by instrumentindex.IndexBuilder
+        :param search_index_path: written by trigramindex.TrigramIndexBuilder, /search is disabled if None
+        :param cache_size: maximum number of lookup results kept in the LRU cache
+        """
+        self._index_path = index_path
+        self._search_index_path = search_index_path
+        self._cache = LRUCache(cache_size)
+        self._index = None
+        self._search_index = None
+        self._signatures = (None, None)
+        self._count_reloads = 0
+        self.reload()
+
+    def _current_signatures(self):
+        search_signature = _file_signature(self._search_index_path) if self._search_index_path else None
+        return _file_signature(self._index_path), search_signature
+
+    def reload(self) -> bool:
+        """
+        Opens the index files again if they changed since they were last opened.
+
+        :return: True if reloaded
+        """
+        signatures = self._current_signatures()
+        if signatures == self._signatures or signatures[0] is None:
+            return False
+
+        index = InstrumentIndex(self._index_path)
+        search_index = None
+        if signatures[1] is not None:
+            search_index = TrigramIndex(self._search_index_path)
+
+        previous_indexes = (self._index, self._search_index)
+        self._index, self._search_index = index, search_index
+        self._signatures = signatures
+        self._cache.clear()
+        self._count_reloads += 1
+        for previous_index in previous_indexes:
+            if previous_index is not None:
+                previous_index.close()
+
+        logging.info('loaded index %s (%d instruments)', self._index_path, len(self._index))
+        return True
+
+    async def watch(self, interval: float = _DEFAULT_RELOAD_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reload()
+
+            except (OSError, ValueError):
+                # snapshot being written, or incomplete: tried again at the next check
+                logging.warning('failed to reload index %s', self._index_path, exc_info=True)
+
+    def _cached(self, key: Tuple, lookup) -> List[Dict[str, str]]:
+        records = self._cache.get(key)
+        if records is None:
+            records = [record._asdict() for record in lookup()]
+            self._cache.put(key, records)
+
+        return records
+
+    def by_con_id(self, con_id: str) -> List[Dict[str, str]]:
+        return self._cached(('con_id', con_id), lambda: self._index.by_con_id(con_id))
+
+    def by_symbol(self, symbol: str, exchange: Optional[str] = None,
+                  currency: Optional[str] = None) -> List[Dict[str, str]]:
+        return self._cached(('symbol', symbol, exchange, currency),
+                            lambda: self._index.by_symbol(symbol, exchange, currency))
+
+    def by_ib_symbol(self, ib_symbol: str, exchange: Optional[str] = None,
+                     currency: Optional[str] = None) -> List[Dict[str, str]]:
+        return self._cached(('ib_symbol', ib_symbol, exchange, currency),
+                            lambda: self._index.by_ib_symbol(ib_symbol, exchange, currency))
+
+    def status(self) -> Dict[str, Any]:
+        return {'instruments': len(self._index), 'search': self._search_index is not None,
+                'reloads': self._count_reloads, 'cache_size': len(self._cache), 'cache_hits': self._cache.hits,
+                'cache_misses': self._cache.misses}
+
+    def handle(self, method: str, target: str, body: bytes) -> Tuple[int, Any]:
+        """
+
+        :param method: HTTP method
+        :param target: request target (path and query)
+        :param body: request body
+        :return: HTTP status and JSON-serializable payload
+        """
+        url = urlparse(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if method == 'POST' and parts == ['batch']:
+            return self._handle_batch(body)
+
+        if method != 'GET':
+            return 405, {'error': 'method not allowed'}
+
+        if len(parts) == 2 and parts[0] == 'conid':
+            if not parts[1].isdigit():
+                return 400, {'error': 'con id has to be numeric'}
+
+            return 200, self.by_con_id(parts[1])
+
+        if len(parts) == 2 and parts[0] == 'symbol':
+            return 200, self.by_symbol(parts[1], query.get('exchange'), query.get('currency'))
+
+        if len(parts) == 2 and parts[0] == 'ib_symbol':
+            return 200, self.by_ib_symbol(parts[1], query.get('exchange'), query.get('currency'))
+
+        if parts == ['search'] and self._search_index is not None:
+            if 'q' not in query or not query.get('k', '10').isdigit():
+                return 400, {'error': 'expecting q=<text> and optionally k=<count>'}
+
+            results = self._search_index.search(query['q'], k=int(query.get('k', '10')))
+            return 200, [{'con_id': con_id, 'similarity': similarity} for con_id, similarity in results]
+
+        if parts == ['status']:
+            return 200, self.status()
+
+        return 404, {'error': 'not found'}
+
+    def _handle_batch(self, body: bytes) -> Tuple[int, Any]:
+        try:
+            request = json.loads(body)
+            con_ids = [str(con_id) for con_id in request.get('con_ids', [])]
+            symbols = [str(symbol) for symbol in request.get('symbols', [])]
+            ib_symbols = [str(ib_symbol) for ib_symbol in request.get('ib_symbols', [])]
+
+        except (ValueError, AttributeError, TypeError):
+            return 400, {'error': 'expecting a JSON object with con_ids, symbols and/or ib_symbols lists'}
+
+        if len(con_ids) + len(symbols) + len(ib_symbols) > _MAX_BATCH_SIZE:
+            return 413, {'error': 'at most {} keys per batch'.format(_MAX_BATCH_SIZE)}
+
+        if not all(con_id.isdigit() for con_id in con_ids):
+            return 400, {'error': 'con ids have to be numeric'}
+
+        return 200, {'con_ids': {con_id: self.by_con_id(con_id) for con_id in con_ids},
+                     'symbols': {symbol: self.by_symbol(symbol) for symbol in symbols},
+                     'ib_symbols': {ib_symbol: self.by_ib_symbol(ib_symbol) for ib_symbol in ib_symbols}}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                # the connection is closed after a bad request, where the next one starts being unknown
+                try:
+                    request_head = await _read_request_head(reader)
+
+                except ValueError:
+                    await _write_response(writer, 400, {'error': 'malformed request'}, keep_alive=False)
+                    break
+
+                if request_head is None:
+                    break
+
+                method, target, version, headers, content_length = request_head
+                if content_length > _MAX_BODY_SIZE:
+                    await _write_response(writer, 413, {'error': 'at most {} bytes per request body'.format(
+                        _MAX_BODY_SIZE)}, keep_alive=False)
+                    break
+
+                body = b''
+                if content_length > 0:
+                    body = await reader.readexactly(content_length)
+
+                try:
+                    status, payload = self.handle(method, target, body)
+
+                except Exception:
+                    logging.exception('failed to handle %s %s', method, target)
+                    status, payload = 500, {'error': 'internal error'}
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                await _write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int, reload_interval: float = _DEFAULT_RELOAD_INTERVAL,
+                    started: Optional[asyncio.Future] = None) -> None:
+        """
+        Serves until cancelled.
+
+        :param host:
+        :param port: 0 for any free port
+        :param reload_interval: seconds between checks for a new snapshot
+        :param started: set to the bound port once the server is listening
+        :return:
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        watcher = asyncio.create_task(self.watch(reload_interval))
+        bound_port = server.sockets[0].getsockname()[1]
+        logging.info('serving lookups on %s:%d', host, bound_port)
+        if started is not None:
+            started.set_result(bound_port)
+
+        try:
+            async with server:
+                await server.serve_forever()
+
+        finally:
+            watcher.cancel()
+
+    def close(self) -> None:
+        for index in (self._index, self._search_index):
+            if index is not None:
+                index.close()
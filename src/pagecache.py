@@ -0,0 +1,534 @@
+"""
+Cache of downloaded pages with conditional revalidation.
+
+Pages are kept in a storage backend (see cachebackend) together with their validators (ETag, Last-Modified),
+a hash of their content and the date they were last checked. Once an entry is older than the expiry period it is
+not dropped: the page is requested again with If-None-Match / If-Modified-Since, a 304 response keeping the cached
+content. When the server ignores validators the downloaded content is compared with the cached one by hash, so that
+callers can tell unchanged pages apart.
+Entries may be compressed (see cachecodec): compressed and uncompressed entries are read alike.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import requests
+
+import cachecodec
+from cachebackend import FileTreeBackend, create_backend
+
+_ENTRY_MAGIC = b'IBPC1\n'
+_DICTIONARY_FILENAME = 'ib-instr-pagecache.dict'
+_DICTIONARY_ID_FILENAME = 'ib-instr-pagecache-{}.dict'
+_STATS_FILENAME = 'ib-instr-pagecache-stats.json'
+_AGE_BUCKETS_DAYS = (1, 7, 30, 90)
+_NOT_MODIFIED = 304
+
+# sent with every request, by both crawl engines
+BROWSER_HEADERS = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 '
+                                 '(KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36'}
+
+_backend = None
+_expiry = None
+_codec = cachecodec.Codec()
+_compress_entries = False
+_stats = Counter()
+_stats_lock = threading.Lock()
+_session = None
+_session_lock = threading.Lock()
+
+
+class CachedPage(NamedTuple):
+    content: str
+    content_hash: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    checked: Optional[datetime]
+
+
+class CacheSummary(NamedTuple):
+    entries: int
+    size: int
+    ages: List[Tuple[str, int]]
+
+
+def set_backend(backend, expiry_days: Optional[int] = None) -> None:
+    """
+    Required for enabling caching.
+
+    :param backend: storage of the entries (see cachebackend), None disables caching
+    :param expiry_days: number of days before a cached page gets revalidated, never if None
+    :return:
+    """
+    global _backend
+    global _expiry
+    if _backend is not None and _backend is not backend:
+        _backend.close()
+
+    _backend = backend
+    _expiry = timedelta(days=expiry_days) if expiry_days is not None else None
+
+
+def set_cache_path(cache_path: Optional[str], expiry_days: Optional[int] = None) -> None:
+    """
+    Caching in a webscrapetools key-value directory tree.
+
+    :param cache_path: directory of the key-value store, None disables caching
+    :param expiry_days: see set_backend()
+    :return:
+    """
+    set_backend(FileTreeBackend(cache_path) if cache_path is not None else None, expiry_days)
+
+
+def set_compression(method: Optional[str], dictionary: Optional[bytes] = None, level: int = None,
+                    read_dictionaries: Iterable[bytes] = ()) -> None:
+    """
+    Compression of the entries being written.
+
+    :param method: one of cachecodec.available_methods(), None for no compression
+    :param dictionary: see cachecodec.train_dictionary(), also needed for reading entries compressed with it
+    :param level: compression level, the method default if None
+    :param read_dictionaries: other dictionaries entries may have been compressed with
+    :return:
+    """
+    global _codec
+    global _compress_entries
+    _codec = cachecodec.Codec(method, dictionary, level)
+    for read_dictionary in read_dictionaries:
+        _codec.add_dictionary(read_dictionary)
+
+    _compress_entries = method is not None
+
+
+def dictionary_path(cache_dir: str, dictionary_id: Optional[bytes] = None) -> str:
+    """
+
+    :param cache_dir:
+    :param dictionary_id: see cachecodec.dictionary_id(), for the copy of a dictionary kept by its id
+    :return: location of the compression dictionary of the cache
+    """
+    if dictionary_id is not None:
+        return os.path.abspath(os.path.join(cache_dir, _DICTIONARY_ID_FILENAME.format(dictionary_id.hex())))
+
+    return os.path.abspath(os.path.join(cache_dir, _DICTIONARY_FILENAME))
+
+
+def _read_dictionary(path: str) -> Optional[bytes]:
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, 'rb') as dictionary_file:
+        return dictionary_file.read()
+
+
+def _write_dictionary(path: str, dictionary: bytes) -> None:
+    # complete once renamed, an interrupted write never leaves a truncated dictionary
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as dictionary_file:
+        dictionary_file.write(dictionary)
+        dictionary_file.flush()
+        os.fsync(dictionary_file.fileno())
+
+    os.replace(temp_path, path)
+
+
+def load_dictionary(cache_dir: str) -> Optional[bytes]:
+    """
+
+    :param cache_dir:
+    :return: compression dictionary of the cache, None if there is none
+    """
+    return _read_dictionary(dictionary_path(cache_dir))
+
+
+def load_dictionaries(cache_dir: str) -> List[bytes]:
+    """
+
+    :param cache_dir:
+    :return: dictionaries kept by their id, entries may have been compressed with any of them
+    """
+    prefix, suffix = _DICTIONARY_ID_FILENAME.split('{}')
+    dictionaries = list()
+    for filename in sorted(os.listdir(cache_dir)):
+        if filename.startswith(prefix) and filename.endswith(suffix):
+            dictionaries.append(_read_dictionary(os.path.join(cache_dir, filename)))
+
+    return dictionaries
+
+
+def save_dictionary(cache_dir: str, dictionary: bytes, current: bool = True) -> None:
+    """
+    The dictionary is first kept by its id, so that entries compressed with it remain readable whichever dictionary
+    is current.
+
+    :param cache_dir:
+    :param dictionary:
+    :param current: whether the dictionary is used for compressing the entries from now on
+    :return:
+    """
+    _write_dictionary(dictionary_path(cache_dir, cachecodec.dictionary_id(dictionary)), dictionary)
+    if current:
+        _write_dictionary(dictionary_path(cache_dir), dictionary)
+
+
+def remove_dictionaries(cache_dir: str, keep: Iterable[bytes]) -> None:
+    """
+    Removes the dictionaries kept by their id, once no entry is compressed with them any more.
+
+    :param cache_dir:
+    :param keep: dictionaries still in use
+    :return:
+    """
+    kept_ids = set(cachecodec.dictionary_id(dictionary) for dictionary in keep)
+    for dictionary in load_dictionaries(cache_dir):
+        dictionary_id = cachecodec.dictionary_id(dictionary)
+        if dictionary_id not in kept_ids:
+            os.remove(dictionary_path(cache_dir, dictionary_id))
+
+
+def open_cache(cache_dir: str, backend_name: str, expiry_days: Optional[int] = None, max_bytes: Optional[int] = None,
+               compression: Optional[str] = None) -> None:
+    """
+    Enables caching as configured from the scripts, using the compression dictionary of the cache if any.
+
+    :param cache_dir: directory holding the cache
+    :param backend_name: see cachebackend.create_backend()
+    :param expiry_days: see set_backend()
+    :param max_bytes: see cachebackend.create_backend()
+    :param compression: see set_compression()
+    :return:
+    """
+    dictionary = load_dictionary(cache_dir)
+    if dictionary is not None:
+        logging.info('using compression dictionary %s', dictionary_path(cache_dir))
+
+    set_compression(compression, dictionary, read_dictionaries=load_dictionaries(cache_dir))
+    set_backend(create_backend(backend_name, cache_dir, max_bytes), expiry_days)
+
+
+def get_backend():
+    return _backend
+
+
+def is_enabled() -> bool:
+    return _backend is not None
+
+
+def content_hash(content: str) -> str:
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def stats() -> Dict[str, int]:
+    """
+    Counts of cache lookups since the last reset: 'hit' (fresh entry), 'miss' (no entry), 'not_modified'
+    (304 response), 'unchanged' (same content downloaded again), 'changed' and 'rejected' (throttling page).
+
+    :return:
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+
+def _stats_path(cache_dir: str) -> str:
+    return os.path.abspath(os.path.join(cache_dir, _STATS_FILENAME))
+
+
+def save_stats(cache_dir: str) -> None:
+    """
+    Keeps the current counts with the cache, for reporting once the run is over.
+
+    :param cache_dir:
+    :return:
+    """
+    with open(_stats_path(cache_dir), 'w') as stats_file:
+        json.dump({'saved': datetime.now().isoformat(), 'stats': stats()}, stats_file)
+
+
+def load_stats(cache_dir: str) -> Optional[Tuple[datetime, Dict[str, int]]]:
+    """
+
+    :param cache_dir:
+    :return: date and counts last saved with save_stats(), None if never saved
+    """
+    if not os.path.isfile(_stats_path(cache_dir)):
+        return None
+
+    with open(_stats_path(cache_dir)) as stats_file:
+        saved_stats = json.load(stats_file)
+
+    return datetime.fromisoformat(saved_stats['saved']), saved_stats['stats']
+
+
+def _count(outcome: str) -> None:
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def _encode_entry(page: CachedPage) -> bytes:
+    header = {'hash': page.content_hash, 'etag': page.etag, 'last_modified': page.last_modified,
+              'checked': page.checked.isoformat() if page.checked is not None else None}
+    value = _ENTRY_MAGIC + json.dumps(header).encode('utf-8') + b'\n' + page.content.encode('utf-8')
+    if _compress_entries:
+        value = _codec.compress(value)
+
+    return value
+
+
+def _decode_entry(value: bytes) -> CachedPage:
+    value = _codec.decompress(value)
+    if not value.startswith(_ENTRY_MAGIC):
+        # entry saved before validators were recorded: check date taken from the backend by get_page()
+        content = value.decode('utf-8')
+        return CachedPage(content, content_hash(content), None, None, None)
+
+    header_end = value.index(b'\n', len(_ENTRY_MAGIC))
+    header = json.loads(value[len(_ENTRY_MAGIC):header_end].decode('utf-8'))
+    checked = datetime.fromisoformat(header['checked']) if header['checked'] is not None else None
+    return CachedPage(value[header_end + 1:].decode('utf-8'), header['hash'], header['etag'], header['last_modified'],
+                      checked)
+
+
+def get_page(url: str) -> Optional[CachedPage]:
+    """
+
+    :param url:
+    :return: cached page, None if not cached or caching is disabled
+    """
+    if _backend is None:
+        return None
+
+    value = _backend.get(url)
+    if value is None:
+        return None
+
+    try:
+        page = _decode_entry(value)
+
+    except ValueError:
+        logging.warning('ignoring unreadable cache entry for %s', url, exc_info=True)
+        return None
+
+    if page.checked is None:
+        # legacy entry, last downloaded when stored
+        page = page._replace(checked=_backend.stored(url))
+
+    return page
+
+
+def is_fresh(page: CachedPage, as_of: datetime = None) -> bool:
+    if page.checked is None:
+        return False
+
+    if _expiry is None:
+        return True
+
+    if as_of is None:
+        as_of = datetime.now()
+
+    return as_of - page.checked < _expiry
+
+
+def invalidate(url: str) -> None:
+    if _backend is not None:
+        _backend.delete(url)
+
+
+def request_headers(page: Optional[CachedPage]) -> Dict[str, str]:
+    """
+
+    :param page: cached page being revalidated, if any
+    :return: browser headers, with conditional headers when the cached page has validators
+    """
+    headers = dict(BROWSER_HEADERS)
+    if page is not None:
+        if page.etag is not None:
+            headers['If-None-Match'] = page.etag
+
+        if page.last_modified is not None:
+            headers['If-Modified-Since'] = page.last_modified
+
+    return headers
+
+
+def handle_hit(page: CachedPage) -> str:
+    _count('hit')
+    return page.content
+
+
+def handle_response(url: str, page: Optional[CachedPage], status: int, response_headers, response_text: str,
+                    rejection_marker: str = None) -> str:
+    """
+    Updates the cache from a response to the request sent with request_headers(page).
+
+    :param url:
+    :param page: cached page, None if none was found
+    :param status: HTTP status code
+    :param response_headers: mapping of response headers
+    :param response_text:
+    :param rejection_marker: raises error if the downloaded content contains specified marker
+    :return: up-to-date content of the page
+    """
+    now = datetime.now()
+    if status == _NOT_MODIFIED and page is not None:
+        logging.debug('not modified: %s', url)
+        _count('not_modified')
+        _backend.put(url, _encode_entry(page._replace(checked=now)))
+        return page.content
+
+    if rejection_marker is not None and rejection_marker in response_text:
+        _count('rejected')
+        raise RuntimeError('rejected, failed to load url %s', url)
+
+    if _backend is None:
+        return response_text
+
+    new_hash = content_hash(response_text)
+    if page is None:
+        _count('miss')
+
+    elif page.content_hash == new_hash:
+        logging.debug('unchanged: %s', url)
+        _count('unchanged')
+
+    else:
+        _count('changed')
+
+    new_page = CachedPage(response_text, new_hash, response_headers.get('ETag'), response_headers.get('Last-Modified'),
+                          now)
+    _backend.put(url, _encode_entry(new_page))
+    return response_text
+
+
+def sample_entries(count: int, url_filter: Callable[[str], bool] = None) -> List[bytes]:
+    """
+
+    :param count: maximum number of entries
+    :param url_filter: selects the entries by url
+    :return: uncompressed entries, spread over the whole cache
+    """
+    keys = [key for key in _backend.keys() if url_filter is None or url_filter(key)]
+    step = max(1, len(keys) // count)
+    samples = list()
+    for key in keys[::step][:count]:
+        value = _backend.get(key)
+        if value is not None:
+            try:
+                samples.append(_codec.decompress(value))
+
+            except ValueError:
+                continue
+
+    return samples
+
+
+def rewrite_entries() -> Tuple[int, int, int]:
+    """
+    Rewrites all the entries according to the current compression settings, keeping their storage dates.
+    Entries that cannot be read are left unchanged.
+
+    :return: number of entries, their size before and after
+    """
+    count_entries = 0
+    size_before = 0
+    size_after = 0
+    for key in _backend.keys():
+        value = _backend.get(key)
+        if value is None:
+            continue
+
+        try:
+            raw_value = _codec.decompress(value)
+
+        except ValueError:
+            logging.warning('unreadable cache entry left unchanged: %s', key)
+            continue
+
+        new_value = _codec.compress(raw_value) if _compress_entries else raw_value
+        if new_value != value:
+            _backend.rewrite(key, new_value)
+
+        count_entries += 1
+        size_before += len(value)
+        size_after += len(new_value)
+
+    return count_entries, size_before, size_after
+
+
+def summary(as_of: datetime = None) -> CacheSummary:
+    """
+    Ages are counted from the date entries were stored (the day of the first insertion for the files backend).
+
+    :param as_of: defaults to now
+    :return: number of entries, their total size and their count by age
+    """
+    if as_of is None:
+        as_of = datetime.now()
+
+    entries = _backend.entries()
+    labels = ['< {}d'.format(_AGE_BUCKETS_DAYS[0])]
+    labels += ['{}-{}d'.format(low, high) for low, high in zip(_AGE_BUCKETS_DAYS[:-1], _AGE_BUCKETS_DAYS[1:])]
+    labels += ['>= {}d'.format(_AGE_BUCKETS_DAYS[-1])]
+    counts = [0] * len(labels)
+    for entry in entries:
+        age = as_of - entry.stored
+        counts[sum(1 for days in _AGE_BUCKETS_DAYS if age >= timedelta(days=days))] += 1
+
+    return CacheSummary(len(entries), sum(entry.size for entry in entries), list(zip(labels, counts)))
+
+
+def prune(older_than: Optional[datetime] = None, url_filter: Callable[[str], bool] = None) -> int:
+    """
+    Removes the entries matching all the specified criteria.
+
+    :param older_than: entries stored before that date
+    :param url_filter: selects the entries by url
+    :return: number of entries removed
+    """
+    if url_filter is None:
+        if older_than is None:
+            raise ValueError('no pruning criteria specified')
+
+        return _backend.expire(older_than)
+
+    removed_keys = [entry.key for entry in _backend.entries()
+                    if url_filter(entry.key) and (older_than is None or entry.stored < older_than)]
+    return _backend.delete_many(removed_keys)
+
+
+def _get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+
+        return _session
+
+
+def open_url(url: str, rejection_marker: str = None, before_request: Callable[[str], None] = None) -> str:
+    """
+    Opens specified url, going through the cache if enabled with set_cache_path().
+
+    :param url: target url
+    :param rejection_marker: raises error if the downloaded content contains specified marker
+    :param before_request: called with the url before any request is actually sent (throttling)
+    :return:
+    """
+    page = get_page(url)
+    if page is not None and is_fresh(page):
+        return handle_hit(page)
+
+    if before_request is not None:
+        before_request(url)
+
+    response = _get_session().get(url, headers=request_headers(page))
+    return handle_response(url, page, response.status_code, response.headers, response.text, rejection_marker)
@@ -0,0 +1,111 @@
+"""
+Output of a whole run as a single Parquet dataset, partitioned by product type and currency
+(hive layout: <dataset>/product_type=stk/currency=USD/part-0.parquet), as an alternative to one CSV file per bucket.
+
+Each bucket is written to its partition as it is passed on, one row group at a time: memory use does not depend on
+the bucket size. The partition columns are read back dictionary-encoded, exchange is dictionary-encoded in the files.
+"""
+import logging
+import os
+import shutil
+from typing import Iterable, Iterator, List
+
+import pyarrow
+import pyarrow.parquet
+
+from ibdataloader import Instrument, ProductType
+from sinks import Sink
+
+_DEFAULT_ROW_GROUP_SIZE = 64 * 1024
+
+SCHEMA = pyarrow.schema([
+    ('con_id', pyarrow.string()),
+    ('label', pyarrow.string()),
+    ('exchange', pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+    ('symbol', pyarrow.string()),
+    ('ib_symbol', pyarrow.string()),
+])
+
+
+class ParquetSink(Sink):
+    """
+    Usable as the results processor of ibdataloader.process_instruments() (see write()), or alongside another one
+    (see passing_through()).
+    """
+
+    def __init__(self, dataset_path: str, row_group_size: int = _DEFAULT_ROW_GROUP_SIZE):
+        """
+        Any previous dataset at the same location is removed.
+
+        :param dataset_path: root directory of the dataset
+        :param row_group_size: number of rows buffered before being written as a row group
+        """
+        self._dataset_path = os.path.abspath(dataset_path)
+        self._row_group_size = row_group_size
+        if os.path.isdir(self._dataset_path):
+            shutil.rmtree(self._dataset_path)
+
+        os.makedirs(self._dataset_path)
+
+    @property
+    def dataset_path(self) -> str:
+        return self._dataset_path
+
+    def _partition_dir(self, product_type: ProductType, currency: str) -> str:
+        return os.path.join(self._dataset_path, 'product_type={}'.format(product_type.value),
+                            'currency={}'.format(currency))
+
+    def _write_row_group(self, writer: pyarrow.parquet.ParquetWriter, rows: List[Instrument]) -> None:
+        columns = [
+            pyarrow.array([instrument.con_id for instrument in rows], pyarrow.string()),
+            pyarrow.array([instrument.label for instrument in rows], pyarrow.string()),
+            pyarrow.array([instrument.exchange for instrument in rows], pyarrow.string()).dictionary_encode(),
+            pyarrow.array([instrument.symbol for instrument in rows], pyarrow.string()),
+            pyarrow.array([instrument.ib_symbol for instrument in rows], pyarrow.string()),
+        ]
+        writer.write_batch(pyarrow.record_batch(columns, schema=SCHEMA), row_group_size=self._row_group_size)
+
+    def passing_through(self, product_type: ProductType, currency: str,
+                        instruments: Iterable[Instrument]) -> Iterator[Instrument]:
+        """
+        Writes the instruments of a bucket while they are being consumed by another writer.
+        The partition file appears once all the instruments have been consumed.
+
+        :param product_type:
+        :param currency:
+        :param instruments:
+        :return: the same instruments
+        """
+        partition_dir = self._partition_dir(product_type, currency)
+        os.makedirs(partition_dir, exist_ok=True)
+        part_path = os.path.join(partition_dir, 'part-{}.parquet'.format(len(os.listdir(partition_dir))))
+        temp_path = part_path + '.tmp'
+        writer = pyarrow.parquet.ParquetWriter(temp_path, SCHEMA, compression='zstd')
+        count_rows = 0
+        try:
+            rows = list()
+            for instrument in instruments:
+                rows.append(instrument)
+                if len(rows) == self._row_group_size:
+                    self._write_row_group(writer, rows)
+                    count_rows += len(rows)
+                    rows = list()
+
+                yield instrument
+
+            if rows or count_rows == 0:
+                self._write_row_group(writer, rows)
+                count_rows += len(rows)
+
+            writer.close()
+            os.replace(temp_path, part_path)
+            logging.info('saved %d rows to %s', count_rows, part_path)
+
+        finally:
+            writer.close()
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+    def write(self, product_type: ProductType, currency: str, instruments: Iterable[Instrument]) -> None:
+        for _ in self.passing_through(product_type, currency, instruments):
+            pass
@@ -0,0 +1,141 @@
+"""
+Cache of extraction results, so that pages already seen are not parsed again.
+
+Entries are keyed by a hash of the page content together with the kind of extraction, its arguments and the
+extractor version: a page downloaded again with the same content maps to the same entry, while a new extractor
+version ignores older entries. Results are stored as compressed marshal data, one file per entry.
+"""
+import hashlib
+import logging
+import marshal
+import os
+import tempfile
+import threading
+import zlib
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+_MISSING = object()
+
+
+class ParseCache(object):
+    """
+    Thread-safe, entries being written to a temporary file first and then renamed.
+    """
+
+    def __init__(self, path: str):
+        """
+
+        :param path: directory of the cache, created if missing
+        """
+        self._path = os.path.abspath(path)
+        os.makedirs(self._path, exist_ok=True)
+        self._stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def stats(self) -> Dict[str, int]:
+        """
+
+        :return: counts of 'hit' and 'miss'
+        """
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, outcome: str) -> None:
+        with self._stats_lock:
+            self._stats[outcome] += 1
+
+    @staticmethod
+    def key(kind: str, extractor_version: str, html_text: str, *args: str) -> str:
+        """
+
+        :param kind: kind of extraction
+        :param extractor_version: see ibextract.extractor_version()
+        :param html_text: page content
+        :param args: extraction arguments
+        :return:
+        """
+        digest = hashlib.blake2b(html_text.encode('utf-8'), digest_size=20)
+        # marshal format may change with the Python version
+        for part in (kind, extractor_version, str(marshal.version)) + args:
+            digest.update(b'\x00' + part.encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self._path, key[:2], key)
+
+    def get(self, key: str, default=None) -> Any:
+        try:
+            with open(self._entry_path(key), 'rb') as entry_file:
+                value = marshal.loads(zlib.decompress(entry_file.read()))
+
+        except FileNotFoundError:
+            return default
+
+        except (ValueError, EOFError, TypeError, zlib.error):
+            logging.warning('ignoring corrupted parse cache entry %s', key)
+            return default
+
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        """
+
+        :param key:
+        :param value: made of built-in types only (see marshal)
+        :return:
+        """
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), prefix='.' + key[:8])
+        try:
+            with os.fdopen(file_descriptor, 'wb') as entry_file:
+                entry_file.write(zlib.compress(marshal.dumps(value)))
+
+            os.replace(temp_path, entry_path)
+
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def lookup(self, key: str) -> Optional[Any]:
+        """
+        Same as get(), keeping track of hits and misses.
+
+        :param key:
+        :return: None if missing, so None values should not be stored for keys looked up this way
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            self._count('miss')
+            return None
+
+        self._count('hit')
+        return value
+
+    def cached(self, kind: str, extractor_version: str, extract: Callable[..., Any], html_text: str, *args: str) -> Any:
+        """
+        Result of extract(html_text, *args), computed only if not cached yet.
+
+        :param kind:
+        :param extractor_version:
+        :param extract: extraction function
+        :param html_text:
+        :param args:
+        :return:
+        """
+        key = self.key(kind, extractor_version, html_text, *args)
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self._count('hit')
+            return value
+
+        self._count('miss')
+        value = extract(html_text, *args)
+        self.put(key, value)
+        return value
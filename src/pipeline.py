@@ -0,0 +1,187 @@
+"""
+Streams the buckets of a crawl into several sinks at once, each sink being fed by its own background thread.
+
+A Pipeline is used as the results processor of ibdataloader.process_instruments(): the instruments of each bucket
+are passed on in chunks through a bounded queue per sink, so that the crawl goes on while the previous buckets are
+still being written or uploaded, and is held back when a sink falls too far behind.
+"""
+import itertools
+import logging
+import queue
+import threading
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+from ibdataloader import Instrument, ProductType
+
+_DEFAULT_QUEUE_SIZE = 16
+_DEFAULT_CHUNK_SIZE = 1000
+
+# queue items besides (product type, currency) starting a bucket and chunks of instruments
+_END_OF_BUCKET = object()
+_ABORTED_BUCKET = object()
+_END_OF_STREAM = object()
+_ABORTED_STREAM = object()
+
+
+class BucketAborted(Exception):
+    """
+    Raised while iterating over the instruments of a bucket that could not be loaded completely.
+    """
+
+
+class _SinkWorker(object):
+
+    def __init__(self, sink, queue_size: int):
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._run, name='sink-' + type(sink).__name__, daemon=True)
+        self.thread.start()
+
+    def _bucket_instruments(self) -> Iterator[Instrument]:
+        while True:
+            item = self.queue.get()
+            if item is _END_OF_BUCKET:
+                return
+
+            if item is _ABORTED_BUCKET:
+                raise BucketAborted()
+
+            for instrument in item:
+                yield instrument
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is _END_OF_STREAM:
+                break
+
+            if item is _ABORTED_STREAM:
+                # the sink only saw part of the crawl: closing it could act on that part as if it were all of it
+                logging.warning('crawl aborted: sink %s not closed', type(self.sink).__name__)
+                return
+
+            product_type, currency = item
+            instruments = self._bucket_instruments()
+            try:
+                if self.error is None:
+                    self.sink.write(product_type, currency, instruments)
+
+                # remainder of the bucket, if not consumed by the sink, so that the producer is never blocked
+                for _ in instruments:
+                    pass
+
+            except BucketAborted:
+                logging.warning('bucket %s/%s aborted: not saved by sink %s', product_type, currency,
+                                type(self.sink).__name__)
+
+            except BaseException as error:
+                logging.exception('sink %s failed on bucket %s/%s', type(self.sink).__name__, product_type, currency)
+                self.error = error
+                try:
+                    for _ in instruments:
+                        pass
+
+                except BucketAborted:
+                    pass
+
+        close = getattr(self.sink, 'close', None)
+        if close is not None and self.error is None:
+            try:
+                close()
+
+            except BaseException as error:
+                logging.exception('failed to close sink %s', type(self.sink).__name__)
+                self.error = error
+
+
+class Pipeline(object):
+
+    def __init__(self, sinks: Sequence, queue_size: int = _DEFAULT_QUEUE_SIZE, chunk_size: int = _DEFAULT_CHUNK_SIZE):
+        """
+
+        :param sinks: see sinks.Sink
+        :param queue_size: maximum number of chunks waiting for each sink
+        :param chunk_size: number of instruments per chunk
+        """
+        if not sinks:
+            raise ValueError('at least one sink is required')
+
+        self._chunk_size = chunk_size
+        self._workers: List[_SinkWorker] = [_SinkWorker(sink, queue_size) for sink in sinks]
+        self._closed = False
+
+    def _check_errors(self) -> None:
+        for worker in self._workers:
+            if worker.error is not None:
+                raise RuntimeError('sink {} failed'.format(type(worker.sink).__name__)) from worker.error
+
+    def __call__(self, product_type: ProductType, currency: str, instruments: Iterable[Instrument]) -> None:
+        """
+        Returns as soon as the bucket is queued for all the sinks.
+
+        :raises RuntimeError: when a sink failed on one of the previous buckets
+        """
+        self._check_errors()
+        for worker in self._workers:
+            worker.queue.put((product_type, currency))
+
+        instruments = iter(instruments)
+        end_of_bucket = _ABORTED_BUCKET
+        try:
+            while True:
+                chunk = list(itertools.islice(instruments, self._chunk_size))
+                if not chunk:
+                    break
+
+                for worker in self._workers:
+                    worker.queue.put(chunk)
+
+            end_of_bucket = _END_OF_BUCKET
+
+        finally:
+            for worker in self._workers:
+                worker.queue.put(end_of_bucket)
+
+    def close(self) -> None:
+        """
+        Waits for the sinks to be done with all the buckets and closes them.
+
+        :raises RuntimeError: when a sink failed
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        for worker in self._workers:
+            worker.queue.put(_END_OF_STREAM)
+
+        for worker in self._workers:
+            worker.thread.join()
+
+        self._check_errors()
+
+    def abort(self) -> None:
+        """
+        Waits for the sinks to be done with the buckets already queued, without closing them: to be used when the
+        crawl failed. Sink failures are only logged.
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        for worker in self._workers:
+            worker.queue.put(_ABORTED_STREAM)
+
+        for worker in self._workers:
+            worker.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+        else:
+            self.abort()
@@ -0,0 +1,92 @@
+import threading
+import time
+from typing import Dict
+from urllib.parse import urlparse
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket: tokens are refilled at a constant rate up to the bucket capacity
+    and each request consumes one token.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.):
+        """
+
+        :param rate: number of tokens added per second
+        :param capacity: maximum number of tokens that can be accumulated (burst size)
+        """
+        if rate <= 0:
+            raise ValueError('rate must be positive: {}'.format(rate))
+
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def capacity(self) -> float:
+        return self._capacity
+
+    def reserve(self, tokens: float = 1.) -> float:
+        """
+        Takes the tokens from the bucket, possibly ahead of their availability.
+
+        :param tokens:
+        :return: delay in seconds the caller has to wait before using the reserved tokens
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+            self._last_refill = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.
+
+            return -self._tokens / self._rate
+
+    def acquire(self, tokens: float = 1.) -> float:
+        """
+        Blocks until the tokens are available.
+
+        :param tokens:
+        :return: time spent waiting, in seconds
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+        return delay
+
+
+class HostRateLimiter(object):
+    """
+    One token bucket per host, shared by all the threads sending requests.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.):
+        """
+
+        :param rate: requests per second allowed for each host
+        :param capacity: burst size for each host
+        """
+        self._rate = rate
+        self._capacity = capacity
+        self._buckets: Dict[str, TokenBucket] = dict()
+        self._lock = threading.Lock()
+
+    def bucket(self, url: str) -> TokenBucket:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self._rate, self._capacity)
+
+            return self._buckets[host]
+
+    def acquire(self, url: str) -> float:
+        return self.bucket(url).acquire()
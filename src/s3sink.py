@@ -0,0 +1,176 @@
+"""
+Uploads each bucket (product type, currency) of a crawl to S3 as a CSV object, named as the files of load-ib.py.
+
+Nothing is staged on disk: rows are encoded into an in-memory part, and each full part is sent by a multipart upload
+while the next one is being filled, several parts being in flight at once. The object only appears once the bucket is
+complete: the upload is aborted when the bucket or the sink fails.
+"""
+import concurrent.futures
+import gzip
+import io
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import boto3
+
+from ibdataloader import Instrument, ProductType
+from sinks import Sink, bucket_filename, write_csv
+
+# smallest part accepted by S3, apart from the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+_DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+class _MultipartUpload(io.RawIOBase):
+    """
+    Binary stream sending its content to S3, by parts of part_size bytes.
+    """
+
+    def __init__(self, client, bucket: str, key: str, part_size: int, executor: Optional[ThreadPoolExecutor],
+                 max_pending: int):
+        super().__init__()
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._part_size = part_size
+        self._executor = executor
+        self._max_pending = max_pending
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: List[Future] = list()
+        self._aborted = False
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self._aborted:
+            # leftovers of the streams wrapping the upload, discarded
+            return len(data)
+
+        self._buffer += data
+        self.size += len(data)
+        if len(self._buffer) >= self._part_size:
+            self._send_part(bytes(self._buffer[:self._part_size]))
+            del self._buffer[:self._part_size]
+
+        return len(data)
+
+    def _upload_part(self, part_number: int, body: bytes) -> Dict:
+        response = self._client.upload_part(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id,
+                                            PartNumber=part_number, Body=body)
+        return {'ETag': response['ETag'], 'PartNumber': part_number}
+
+    def _send_part(self, body: bytes) -> None:
+        if self._upload_id is None:
+            response = self._client.create_multipart_upload(Bucket=self._bucket, Key=self._key)
+            self._upload_id = response['UploadId']
+
+        part_number = len(self._parts) + 1
+        if self._executor is None:
+            future = Future()
+            future.set_result(self._upload_part(part_number, body))
+
+        else:
+            # memory use bounded by max_pending parts
+            pending = [part for part in self._parts if not part.done()]
+            if len(pending) >= self._max_pending:
+                concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            future = self._executor.submit(self._upload_part, part_number, body)
+
+        self._parts.append(future)
+        for part in self._parts:
+            if part.done() and part.exception() is not None:
+                raise part.exception()
+
+    def complete(self) -> int:
+        """
+        Makes the object available, once everything is written.
+
+        :return: number of parts
+        """
+        if self._upload_id is None:
+            self._client.put_object(Bucket=self._bucket, Key=self._key, Body=bytes(self._buffer))
+            return 1
+
+        if self._buffer:
+            self._send_part(bytes(self._buffer))
+            self._buffer.clear()
+
+        parts = [part.result() for part in self._parts]
+        self._client.complete_multipart_upload(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id,
+                                               MultipartUpload={'Parts': parts})
+        return len(parts)
+
+    def abort(self) -> None:
+        self._aborted = True
+        self._buffer.clear()
+        for part in self._parts:
+            part.cancel()
+
+        concurrent.futures.wait(self._parts)
+        if self._upload_id is not None:
+            self._client.abort_multipart_upload(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id)
+
+
+class S3Sink(Sink):
+
+    def __init__(self, bucket: str, prefix: str = 'ib-instr', client=None, part_size: int = _DEFAULT_PART_SIZE,
+                 workers: int = 4, compress: bool = False):
+        """
+
+        :param bucket: S3 bucket name
+        :param prefix: prefix of the object keys, may contain slashes
+        :param client: boto3 S3 client, default one if not specified
+        :param part_size: number of bytes per part of the multipart uploads
+        :param workers: number of parts sent concurrently
+        :param compress: whether the objects are gzip-compressed
+        """
+        if part_size < MIN_PART_SIZE:
+            raise ValueError('part size must be at least {} bytes'.format(MIN_PART_SIZE))
+
+        self._bucket = bucket
+        self._prefix = prefix
+        self._client = client if client is not None else boto3.client('s3')
+        self._part_size = part_size
+        self._workers = workers
+        self._compress = compress
+        if workers == 1:
+            self._executor = None
+
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def object_key(self, product_type: ProductType, currency: str) -> str:
+        extension = '.csv.gz' if self._compress else '.csv'
+        return bucket_filename(self._prefix, product_type, currency, extension)
+
+    def write(self, product_type: ProductType, currency: str, instruments: Iterable[Instrument]) -> None:
+        key = self.object_key(product_type, currency)
+        upload = _MultipartUpload(self._client, self._bucket, key, self._part_size, self._executor,
+                                  max_pending=2 * self._workers)
+        try:
+            stream = gzip.GzipFile(fileobj=upload, mode='wb') if self._compress else upload
+            text_stream = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+            count_instruments = write_csv(text_stream, instruments)
+            text_stream.flush()
+            text_stream.detach()
+            if self._compress:
+                stream.close()
+
+            count_parts = upload.complete()
+
+        except BaseException:
+            upload.abort()
+            raise
+
+        logging.info('uploaded %d instruments to s3://%s/%s (%d bytes in %d parts)', count_instruments, self._bucket,
+                     key, upload.size, count_parts)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,115 @@
+"""
+Files made of sections of fixed-size values, written at once and used through a read-only memory map: opening such
+a file does not read it, and the pages are shared by all the processes using the same file.
+
+Layout (native byte order, sections aligned on 8 bytes):
+ - header: magic identifying the format, byte order check, values describing the content (uint64), offsets of the
+   sections (uint64)
+ - sections
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import List, Sequence
+
+_BYTE_ORDER_CHECK = 0x01020304
+
+
+def _header(count_values: int, count_sections: int) -> struct.Struct:
+    # padding the byte order check keeps the header, hence the sections, aligned on 8 bytes
+    return struct.Struct('=8sI4x{}Q'.format(count_values + count_sections))
+
+
+def write_sections(path: str, magic: bytes, values: Sequence[int], sections: Sequence[bytes]) -> None:
+    """
+    Writes the file, replacing any previous one at once: processes using it keep their mapping of the previous file.
+
+    :param path:
+    :param magic: 8 bytes identifying the format
+    :param values: describing the content, such as the number of items of the sections
+    :param sections:
+    :return:
+    """
+    header = _header(len(values), len(sections))
+    section_offsets = list()
+    offset = header.size
+    for section in sections:
+        section_offsets.append(offset)
+        offset += len(section) + (-len(section) % 8)
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as section_file:
+        section_file.write(header.pack(magic, _BYTE_ORDER_CHECK, *values, *section_offsets))
+        for section in sections:
+            section_file.write(section)
+            section_file.write(bytes(-len(section) % 8))
+
+    os.replace(temp_path, path)
+
+
+class SectionFile(object):
+    """
+    Read-only access to a file written by write_sections().
+    """
+
+    def __init__(self, path: str, magic: bytes, count_values: int, count_sections: int, description: str):
+        """
+
+        :param path:
+        :param magic: see write_sections()
+        :param count_values: number of values stored in the header
+        :param count_sections:
+        :param description: kind of file, for the error messages
+        :raises ValueError: when the file is not of the expected format or not readable on this platform
+        """
+        header = _header(count_values, count_sections)
+        with open(path, 'rb') as section_file:
+            self._mmap = mmap.mmap(section_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if len(self._mmap) < header.size:
+                raise ValueError('not {}: {}'.format(description, path))
+
+            file_magic, byte_order_check, *fields = header.unpack_from(self._mmap)
+            if file_magic != magic:
+                raise ValueError('not {}: {}'.format(description, path))
+
+            if byte_order_check != _BYTE_ORDER_CHECK:
+                raise ValueError('{} written with a different byte order than {}: {}'.format(
+                    description, sys.byteorder, path))
+
+        except ValueError:
+            self._mmap.close()
+            raise
+
+        self._header_values: List[int] = fields[:count_values]
+        self._section_offsets: List[int] = fields[count_values:]
+        self._views = [memoryview(self._mmap)]
+
+    def _section(self, number: int, count: int, type_code: str) -> memoryview:
+        """
+
+        :param number: position of the section in the file
+        :param count: number of values in the section
+        :param type_code: see array.array
+        :return: values of the section, valid until close()
+        """
+        offset = self._section_offsets[number]
+        section = self._views[0][offset:offset + count * array(type_code).itemsize].cast(type_code)
+        self._views.append(section)
+        return section
+
+    def close(self) -> None:
+        for view in reversed(self._views):
+            view.release()
+
+        self._views.clear()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
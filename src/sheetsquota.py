@@ -0,0 +1,111 @@
+"""
+Keeps the calls to the Google Sheets API within the per-user quota (requests per 100 seconds).
+
+Every call of a gspread client goes through Client.request(): the scheduler wraps it so that each actual API call
+takes a token from a bucket refilled at the rate allowed by the quota, and so that calls rejected with 429 (quota
+exceeded) are retried with an exponential backoff.
+"""
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from gspread.exceptions import APIError
+
+from ratelimit import TokenBucket
+
+_DEFAULT_QUOTA = 100
+_DEFAULT_QUOTA_PERIOD = 100.
+_DEFAULT_BURST = 10
+_DEFAULT_MAX_RETRIES = 8
+_DEFAULT_INITIAL_BACKOFF = 1.
+_MAX_BACKOFF = 64.
+_STATUS_TOO_MANY_REQUESTS = 429
+
+
+def is_quota_exceeded(error: Exception) -> bool:
+    response = getattr(error, 'response', None)
+    return isinstance(error, APIError) and getattr(response, 'status_code', None) == _STATUS_TOO_MANY_REQUESTS
+
+
+class QuotaScheduler(object):
+    """
+    Thread-safe: a single scheduler is meant to be shared by all the clients authorized as the same user.
+    """
+
+    def __init__(self, quota: int = _DEFAULT_QUOTA, period: float = _DEFAULT_QUOTA_PERIOD, burst: Optional[int] = None,
+                 max_retries: int = _DEFAULT_MAX_RETRIES, initial_backoff: float = _DEFAULT_INITIAL_BACKOFF):
+        """
+        Tokens are refilled so that no more than quota calls are made over any period, bursts included.
+
+        :param quota: number of calls allowed per period
+        :param period: in seconds
+        :param burst: number of calls that can be made without waiting, lower than the quota, by default 10 or
+        the quota minus one if lower
+        :param max_retries: number of attempts after a 429 response before giving up
+        :param initial_backoff: delay before the first retry in seconds, doubled for each following retry
+        """
+        if burst is None:
+            burst = min(_DEFAULT_BURST, quota - 1)
+
+        if not 0 < burst < quota:
+            raise ValueError('burst must be positive and lower than the quota: {} / {}'.format(burst, quota))
+
+        self._bucket = TokenBucket((quota - burst) / period, capacity=burst)
+        self._max_retries = max_retries
+        self._initial_backoff = initial_backoff
+        self._lock = threading.Lock()
+        self.count_calls = 0
+        self.count_retries = 0
+        self.time_waited = 0.
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self._initial_backoff * 2 ** attempt, _MAX_BACKOFF)
+        return delay * random.uniform(1., 1.5)
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Calls func once a token is available, retrying when the call is rejected for exceeding the quota.
+
+        :param func: making exactly one API call
+        :return: result of func
+        :raises APIError: when func fails for another reason than the quota, or still fails after max_retries
+        """
+        attempt = 0
+        while True:
+            waited = self._bucket.acquire()
+            with self._lock:
+                self.count_calls += 1
+                self.time_waited += waited
+
+            try:
+                return func(*args, **kwargs)
+
+            except APIError as error:
+                if not is_quota_exceeded(error) or attempt >= self._max_retries:
+                    raise
+
+                delay = self._backoff(attempt)
+                logging.warning('Sheets API quota exceeded, retrying in %.1fs', delay)
+                with self._lock:
+                    self.count_retries += 1
+                    self.time_waited += delay
+
+                time.sleep(delay)
+                attempt += 1
+
+    def install(self, client):
+        """
+        Routes all the API calls of a gspread client through the scheduler.
+
+        :param client: gspread.Client
+        :return: client
+        """
+        request = client.request
+
+        def scheduled_request(*args, **kwargs):
+            return self.call(request, *args, **kwargs)
+
+        client.request = scheduled_request
+        return client
@@ -0,0 +1,107 @@
+"""
+Uploads instrument files to several spreadsheets concurrently (typically one spreadsheet per product type).
+
+Each spreadsheet is handled by a single worker at a time: its worksheets are uploaded one after the other, using
+worksheet properties fetched once and then kept up to date from the requests sent, and the stale worksheets are
+removed at the end in a single call. Workers share the gspread client, and thus the quota scheduler installed on it
+(see sheetsquota): parallelism only fills in the idle time between calls, within one global rate budget.
+"""
+import csv
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import gservices
+
+
+class UploadTask(NamedTuple):
+    spreadsheet_id: str
+    worksheet_name: str
+    path: str
+
+
+class UploadResult(NamedTuple):
+    spreadsheet_id: str
+    worksheets: int
+    rows: int
+    removed: List[str]
+    elapsed: float
+
+
+def upload_spreadsheet(svc_sheet, spreadsheet_id: str, tasks: Sequence[UploadTask],
+                       columns: Sequence[Tuple[str, str]], delta: bool = False,
+                       kept_worksheets: Optional[Set[str]] = None) -> UploadResult:
+    """
+
+    :param svc_sheet: gspread client
+    :param spreadsheet_id:
+    :param tasks: worksheets of the spreadsheet, uploaded in order
+    :param columns: (worksheet column, field of the files) in the order of the columns, see sinks.SHEET_COLUMNS
+    :param delta: whether only the changed rows are sent (see gservices.sync_worksheet())
+    :param kept_worksheets: other worksheets are removed once uploaded, no worksheet removed if None
+    :return:
+    """
+    start = time.monotonic()
+    header = [column for column, _ in columns]
+    sheets = gservices.sheet_properties(svc_sheet, spreadsheet_id)
+    count_rows = 0
+    for task in tasks:
+        logging.info('uploading %s to worksheet "%s" of spreadsheet %s', task.path, task.worksheet_name,
+                     spreadsheet_id)
+        with open(task.path, 'rt', newline='') as csv_file:
+            # a field missing from the file fails the upload instead of leaving the column empty
+            rows = ({column: row[field] for column, field in columns} for row in csv.DictReader(csv_file))
+            if delta:
+                row_delta = gservices.sync_worksheet(svc_sheet, spreadsheet_id, task.worksheet_name, rows, header,
+                                                     sheets=sheets)
+                count_rows += len(row_delta.inserted) + len(row_delta.updated) + len(row_delta.deleted)
+
+            else:
+                count_rows += gservices.upload_worksheet(svc_sheet, spreadsheet_id, task.worksheet_name, rows,
+                                                         header, sheets=sheets)
+
+    removed = list()
+    if kept_worksheets is not None:
+        removed = gservices.clean_worksheets(svc_sheet, spreadsheet_id, kept_worksheets, sheets)
+
+    return UploadResult(spreadsheet_id, len(tasks), count_rows, removed, time.monotonic() - start)
+
+
+def upload_spreadsheets(svc_sheet, tasks: Iterable[UploadTask], columns: Sequence[Tuple[str, str]],
+                        workers: int = 1, delta: bool = False,
+                        kept_worksheets: Optional[Dict[str, Set[str]]] = None) -> List[UploadResult]:
+    """
+
+    :param svc_sheet: gspread client, shared by the workers
+    :param tasks: in any order, the worksheets of each spreadsheet being uploaded in the order given
+    :param columns: see upload_spreadsheet()
+    :param workers: number of spreadsheets uploaded concurrently
+    :param delta: whether only the changed rows are sent (see gservices.sync_worksheet())
+    :param kept_worksheets: spreadsheet id -> worksheets kept when cleaning up, spreadsheets not listed are not
+    cleaned up and those without any task are only cleaned up
+    :return: results in the order of the first task of each spreadsheet, then of kept_worksheets
+    """
+    if kept_worksheets is None:
+        kept_worksheets = dict()
+
+    tasks_by_spreadsheet = OrderedDict()
+    for task in tasks:
+        tasks_by_spreadsheet.setdefault(task.spreadsheet_id, list()).append(task)
+
+    for spreadsheet_id in kept_worksheets:
+        tasks_by_spreadsheet.setdefault(spreadsheet_id, list())
+
+    def upload(spreadsheet_id: str) -> UploadResult:
+        result = upload_spreadsheet(svc_sheet, spreadsheet_id, tasks_by_spreadsheet[spreadsheet_id], columns, delta,
+                                    kept_worksheets.get(spreadsheet_id))
+        logging.info('spreadsheet %s: %d worksheets, %d rows sent in %.1fs', spreadsheet_id, result.worksheets,
+                     result.rows, result.elapsed)
+        return result
+
+    if workers <= 1:
+        return list(map(upload, tasks_by_spreadsheet))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='spreadsheet') as executor:
+        return list(executor.map(upload, tasks_by_spreadsheet))
@@ -0,0 +1,161 @@
+"""
+Destinations of the buckets (product type, currency) of a crawl, see pipeline.Pipeline.
+
+A sink is any object with a write(product_type, currency, instruments) method, called once per bucket and thus
+usable as the results processor of ibdataloader.process_instruments(), and optionally a close() method called once
+the crawl is over. parquetsink.ParquetSink and s3sink.S3Sink are some of them.
+"""
+import abc
+import csv
+import logging
+import os
+from typing import Dict, Iterable, Set, TextIO
+
+import gservices
+from bulkcsv import BulkCsvWriter
+from ibdataloader import Instrument, ProductType
+
+_FILENAME_SEPARATOR = '_'
+
+# worksheet column -> instrument field
+SHEET_COLUMNS = (('conid', 'con_id'), ('symbol', 'symbol'), ('ib_symbol', 'ib_symbol'), ('label', 'label'))
+
+
+class Sink(abc.ABC):
+
+    @abc.abstractmethod
+    def write(self, product_type: ProductType, currency: str, instruments: Iterable[Instrument]) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def bucket_filename(prefix: str, product_type: ProductType, currency: str, extension: str = '.csv') -> str:
+    return prefix + _FILENAME_SEPARATOR + currency.lower() + _FILENAME_SEPARATOR + product_type.value + extension
+
+
+def write_csv(csv_file: TextIO, instruments: Iterable[Instrument]) -> int:
+    """
+    Writes the header, then one row per instrument.
+
+    :return: number of instruments written
+    """
+    writer = csv.writer(csv_file)
+    writer.writerow(Instrument.fields)
+    count_instruments = 0
+    for instrument in instruments:
+        writer.writerow(instrument.as_tuple())
+        count_instruments += 1
+
+    return count_instruments
+
+
+class CsvSink(Sink):
+    """
+    One CSV file per bucket, named as those of load-ib.py, published once complete (see bulkcsv).
+    """
+
+    extension = '.csv'
+
+    def __init__(self, output_dir: str, prefix: str):
+        self._output_dir = os.path.abspath(output_dir)
+        self._prefix = prefix
+        os.makedirs(self._output_dir, exist_ok=True)
+
+    def _writer(self, path: str) -> BulkCsvWriter:
+        return BulkCsvWriter(path, Instrument.fields)
+
+    def write(self, product_type: ProductType, currency: str, instruments: Iterable[Instrument]) -> None:
+        filename = bucket_filename(self._prefix, product_type, currency, self.extension)
+        with self._writer(os.path.join(self._output_dir, filename)) as writer:
+            writer.write_records(instruments)
+
+        logging.info('saved file: %s (%d instruments)', writer.path, writer.count_rows)
+
+
+class GzipCsvSink(CsvSink):
+    """
+    Same as CsvSink, each file being gzip-compressed.
+    """
+
+    extension = '.csv.gz'
+
+    def __init__(self, output_dir: str, prefix: str, compresslevel: int = 6):
+        super().__init__(output_dir, prefix)
+        self._compresslevel = compresslevel
+
+    def _writer(self, path: str) -> BulkCsvWriter:
+        return BulkCsvWriter(path, Instrument.fields, compress=True, compresslevel=self._compresslevel)
+
+
+class SheetsSink(Sink):
+    """
+    Uploads each bucket as the worksheet named after its currency, in the spreadsheet of its product type.
+    """
+
+    def __init__(self, svc_sheet, spreadsheet_ids: Dict[str, str], delta: bool = False, clean: bool = False):
+        """
+
+        :param svc_sheet: gspread client
+        :param spreadsheet_ids: product type code -> spreadsheet id, other product types are not uploaded
+        :param delta: whether only the changed rows are sent (see gservices.sync_worksheet())
+        :param clean: whether the worksheets of the spreadsheets that were not uploaded are removed when closing,
+        provided that every bucket was uploaded
+        """
+        self._svc_sheet = svc_sheet
+        self._spreadsheet_ids = spreadsheet_ids
+        self._delta = delta
+        self._clean = clean
+        self._sheets = dict()
+        self._uploaded_worksheets: Dict[str, Set[str]] = dict()
+        self._complete = True
+
+    def _cached_sheets(self, spreadsheet_id: str):
+        if spreadsheet_id not in self._sheets:
+            self._sheets[spreadsheet_id] = gservices.sheet_properties(self._svc_sheet, spreadsheet_id)
+
+        return self._sheets[spreadsheet_id]
+
+    def write(self, product_type: ProductType, currency: str, instruments: Iterable[Instrument]) -> None:
+        spreadsheet_id = self._spreadsheet_ids.get(product_type.value)
+        if spreadsheet_id is None:
+            logging.info("no spreadsheet for product type '%s': not saving to Google sheet", product_type.value)
+            return
+
+        worksheet_name = currency.lower()
+        header = [column for column, _ in SHEET_COLUMNS]
+        rows = ({column: getattr(instrument, field) for column, field in SHEET_COLUMNS} for instrument in instruments)
+        try:
+            sheets = self._cached_sheets(spreadsheet_id)
+            if self._delta:
+                delta = gservices.sync_worksheet(self._svc_sheet, spreadsheet_id, worksheet_name, rows, header,
+                                                 sheets=sheets)
+                logging.info('worksheet "%s" of spreadsheet %s: %d rows inserted, %d updated, %d deleted',
+                             worksheet_name, spreadsheet_id, len(delta.inserted), len(delta.updated),
+                             len(delta.deleted))
+
+            else:
+                count_rows = gservices.upload_worksheet(self._svc_sheet, spreadsheet_id, worksheet_name, rows,
+                                                        header, sheets=sheets)
+                logging.info('uploaded %d rows to worksheet "%s" of spreadsheet %s', count_rows, worksheet_name,
+                             spreadsheet_id)
+
+        except BaseException:
+            # the worksheet of this bucket is kept as it was, it must not be cleaned up either
+            self._complete = False
+            raise
+
+        self._uploaded_worksheets.setdefault(spreadsheet_id, set()).add(worksheet_name)
+
+    def close(self) -> None:
+        if not self._clean:
+            return
+
+        if not self._complete:
+            logging.warning('some buckets were not uploaded: worksheets not cleaned up')
+            return
+
+        for spreadsheet_id, worksheet_names in self._uploaded_worksheets.items():
+            gservices.clean_worksheets(self._svc_sheet, spreadsheet_id, worksheet_names,
+                                       self._cached_sheets(spreadsheet_id))
@@ -0,0 +1,227 @@
+"""
+Differences between two snapshots of the instrument files written by load-ib.py.
+
+Both versions of a bucket file are sorted by con_id, spilling to disk beyond the memory budget, and compared
+through a single sorted merge. Neither snapshot is ever held in memory as a whole.
+"""
+import csv
+import logging
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from spillsort import ExternalGrouper
+
+_FILENAME_SEPARATOR = '_'
+_KEY_FIELD = 'con_id'
+_DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+CHANGE_ADDED = 'added'
+CHANGE_REMOVED = 'removed'
+CHANGE_CHANGED = 'changed'
+
+SUMMARY_FIELDS = ('product_type', 'currency', 'previous', 'current', CHANGE_ADDED, CHANGE_REMOVED, CHANGE_CHANGED)
+
+
+def list_snapshot_files(directory: str, prefix: str) -> Dict[Tuple[str, str], str]:
+    """
+
+    :param directory:
+    :param prefix: prefix of the instrument files
+    :return: dict of (product type code, currency) -> file path
+    """
+    snapshot_files = dict()
+    if not os.path.isdir(directory):
+        return snapshot_files
+
+    for filename in os.listdir(directory):
+        if not filename.startswith(prefix + _FILENAME_SEPARATOR) or not filename.endswith('.csv'):
+            continue
+
+        category = filename[len(prefix) + 1:-4].split(_FILENAME_SEPARATOR)
+        if len(category) != 2:
+            continue
+
+        currency, product_type_code = category
+        snapshot_files[(product_type_code, currency)] = os.path.join(directory, filename)
+
+    return snapshot_files
+
+
+def read_fieldnames(path: Optional[str]) -> List[str]:
+    if path is None:
+        return list()
+
+    with open(path, 'rt', newline='') as csv_file:
+        return next(csv.reader(csv_file), list())
+
+
+def read_rows(path: Optional[str], fields: List[str]) -> Iterator[Tuple[str, ...]]:
+    """
+
+    :param path: instrument file, no rows if None
+    :param fields: fields to be extracted, missing ones being set to an empty string
+    :return: rows as tuples of values in the order of fields
+    """
+    if path is None:
+        return
+
+    with open(path, 'rt', newline='') as csv_file:
+        for row in csv.DictReader(csv_file):
+            yield tuple(row.get(field) or '' for field in fields)
+
+
+def sorted_by_key(rows: Iterable[Tuple[str, ...]], memory_budget: int,
+                  temp_dir: str = None) -> Iterator[Tuple[str, ...]]:
+    """
+    Sorts rows on their first value, keeping only the first row of each key.
+
+    :param rows:
+    :param memory_budget: see ExternalGrouper
+    :param temp_dir: see ExternalGrouper
+    :return:
+    """
+    with ExternalGrouper(lambda row: row[0], memory_budget, temp_dir) as grouper:
+        for row in rows:
+            grouper.add(None, row)
+
+        previous_key = None
+        for row in grouper.sorted_group(None):
+            if row[0] == previous_key:
+                logging.debug('ignoring duplicate %s: %s', _KEY_FIELD, row)
+                continue
+
+            previous_key = row[0]
+            yield row
+
+
+def merge_changes(previous_rows: Iterator[Tuple[str, ...]],
+                  current_rows: Iterator[Tuple[str, ...]]) -> Iterator[Tuple[str, Tuple[str, ...], Tuple[str, ...]]]:
+    """
+    Sorted merge of two streams of rows, both sorted on their first value (the key) without duplicate keys.
+
+    :param previous_rows:
+    :param current_rows:
+    :return: (change, previous row, current row) for each added, removed or changed key, rows being None when missing
+    """
+    previous_row = next(previous_rows, None)
+    current_row = next(current_rows, None)
+    while previous_row is not None or current_row is not None:
+        if current_row is None or (previous_row is not None and previous_row[0] < current_row[0]):
+            yield CHANGE_REMOVED, previous_row, None
+            previous_row = next(previous_rows, None)
+
+        elif previous_row is None or current_row[0] < previous_row[0]:
+            yield CHANGE_ADDED, None, current_row
+            current_row = next(current_rows, None)
+
+        else:
+            if previous_row != current_row:
+                yield CHANGE_CHANGED, previous_row, current_row
+
+            previous_row = next(previous_rows, None)
+            current_row = next(current_rows, None)
+
+
+class _Counting(object):
+
+    def __init__(self, rows: Iterable):
+        self._rows = iter(rows)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self._rows)
+        self.count += 1
+        return row
+
+
+def diff_bucket(previous_path: Optional[str], current_path: Optional[str], delta_path: str,
+                memory_budget: int = _DEFAULT_MEMORY_BUDGET, temp_dir: str = None) -> Dict[str, int]:
+    """
+    Writes the delta file of a bucket, with columns: change, fields of the instrument file, changed_fields.
+    Added and changed instruments come with their current values, removed ones with their previous values.
+
+    :param previous_path: instrument file of the previous snapshot, None if the bucket is new
+    :param current_path: instrument file of the current snapshot, None if the bucket disappeared
+    :param delta_path: output file
+    :param memory_budget: bytes of rows kept in memory by each of the sorts
+    :param temp_dir: parent directory of spilled rows
+    :return: number of previous and current instruments, of added, removed and changed ones
+    """
+    fields = read_fieldnames(current_path) or read_fieldnames(previous_path)
+    if _KEY_FIELD not in fields:
+        raise ValueError('missing field "{}" in {}'.format(_KEY_FIELD, current_path or previous_path))
+
+    # key first
+    fields = [_KEY_FIELD] + [field for field in fields if field != _KEY_FIELD]
+    previous_rows = _Counting(read_rows(previous_path, fields))
+    current_rows = _Counting(read_rows(current_path, fields))
+    counts = {CHANGE_ADDED: 0, CHANGE_REMOVED: 0, CHANGE_CHANGED: 0}
+    with open(delta_path, 'wt', newline='') as delta_file:
+        writer = csv.writer(delta_file)
+        writer.writerow(['change'] + fields + ['changed_fields'])
+        changes = merge_changes(sorted_by_key(previous_rows, memory_budget, temp_dir),
+                                sorted_by_key(current_rows, memory_budget, temp_dir))
+        for change, previous_row, current_row in changes:
+            counts[change] += 1
+            if change == CHANGE_CHANGED:
+                changed_fields = [field for field, previous_value, current_value
+                                  in zip(fields, previous_row, current_row) if previous_value != current_value]
+                writer.writerow((change,) + current_row + (';'.join(changed_fields),))
+
+            else:
+                writer.writerow((change,) + (current_row or previous_row) + ('',))
+
+    counts['previous'] = previous_rows.count
+    counts['current'] = current_rows.count
+    return counts
+
+
+def delta_filename(prefix: str, product_type_code: str, currency: str) -> str:
+    return _FILENAME_SEPARATOR.join((prefix, 'delta', currency, product_type_code)) + '.csv'
+
+
+def summary_filename(prefix: str) -> str:
+    return prefix + _FILENAME_SEPARATOR + 'delta-summary.csv'
+
+
+def diff_snapshots(previous_dir: str, current_dir: str, output_dir: str, prefix: str = 'ib-instr',
+                   product_type_codes: Iterable[str] = None, memory_budget: int = _DEFAULT_MEMORY_BUDGET) -> List[Dict]:
+    """
+    Writes one delta file for each bucket found in either snapshot, along with a summary file.
+
+    :param previous_dir: directory of the previous instrument files
+    :param current_dir: directory of the current instrument files
+    :param output_dir: directory of the delta files
+    :param prefix: prefix of the instrument files
+    :param product_type_codes: only compares these product types, all if None
+    :param memory_budget: see diff_bucket
+    :return: summary rows
+    """
+    previous_files = list_snapshot_files(previous_dir, prefix)
+    current_files = list_snapshot_files(current_dir, prefix)
+    buckets = sorted(set(previous_files) | set(current_files))
+    if product_type_codes is not None:
+        product_type_codes = set(product_type_codes)
+        buckets = [bucket for bucket in buckets if bucket[0] in product_type_codes]
+
+    os.makedirs(output_dir, exist_ok=True)
+    summary = list()
+    for product_type_code, currency in buckets:
+        delta_path = os.path.join(output_dir, delta_filename(prefix, product_type_code, currency))
+        counts = diff_bucket(previous_files.get((product_type_code, currency)),
+                             current_files.get((product_type_code, currency)), delta_path, memory_budget)
+        logging.info('%s %s: %d added, %d removed, %d changed', product_type_code, currency,
+                     counts[CHANGE_ADDED], counts[CHANGE_REMOVED], counts[CHANGE_CHANGED])
+        summary.append(dict(counts, product_type=product_type_code, currency=currency))
+
+    summary_path = os.path.join(output_dir, summary_filename(prefix))
+    with open(summary_path, 'wt', newline='') as summary_file:
+        writer = csv.DictWriter(summary_file, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(summary)
+
+    logging.info('saved delta summary: %s', summary_path)
+    return summary
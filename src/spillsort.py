@@ -0,0 +1,197 @@
+"""
+Grouping and sorting of rows within a memory budget.
+
+Rows are kept in memory until their estimated size exceeds the budget: all the groups are then sorted and
+spilled to a temporary run file. Each group is eventually read back through a k-way merge of its sorted runs, in
+several passes when there are too many runs to keep all of them open at once.
+"""
+import heapq
+import logging
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+from collections import defaultdict
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Tuple
+
+_BATCH_ROWS = 1024
+_MAX_MERGE_RUNS = 64
+
+
+def estimate_row_size(row: Tuple) -> int:
+    """
+
+    :param row: tuple of strings (or None)
+    :return: approximate number of bytes used in memory by the row
+    """
+    return sys.getsizeof(row) + sum(sys.getsizeof(field) for field in row if field is not None)
+
+
+def _read_segment(run_path: str, offset: int, count_batches: int) -> Iterator[Tuple]:
+    with open(run_path, 'rb') as run_file:
+        run_file.seek(offset)
+        for _ in range(count_batches):
+            for row in pickle.load(run_file):
+                yield row
+
+
+def _write_segment(run_path: str, rows: Iterator[Tuple]) -> Tuple[str, int, int]:
+    count_batches = 0
+    with open(run_path, 'wb') as run_file:
+        batch = list()
+        for row in rows:
+            batch.append(row)
+            if len(batch) == _BATCH_ROWS:
+                pickle.dump(batch, run_file, protocol=pickle.HIGHEST_PROTOCOL)
+                count_batches += 1
+                batch = list()
+
+        if batch:
+            pickle.dump(batch, run_file, protocol=pickle.HIGHEST_PROTOCOL)
+            count_batches += 1
+
+    return run_path, 0, count_batches
+
+
+class ExternalGrouper(object):
+    """
+    Groups rows by key, each group being read back sorted.
+    """
+
+    def __init__(self, sort_key: Callable[[Tuple], Any], memory_budget: int, temp_dir: str = None,
+                 max_merge_runs: int = _MAX_MERGE_RUNS):
+        """
+
+        :param sort_key: function extracting the sort key from a row, ties keep the insertion order
+        :param memory_budget: number of bytes that in-memory rows may use before being spilled to disk
+        :param temp_dir: parent directory of the spilled runs, system default if None
+        :param max_merge_runs: maximum number of runs read at once (open files) when merging a group
+        """
+        if max_merge_runs < 2:
+            raise ValueError('at least 2 runs must be merged at once')
+
+        self._sort_key = sort_key
+        self._max_merge_runs = max_merge_runs
+        self._memory_budget = memory_budget
+        self._temp_dir = temp_dir
+        self._spill_path = None
+        self._rows_by_group: Dict[Hashable, List[Tuple]] = defaultdict(list)
+        self._segments_by_group: Dict[Hashable, List[Tuple[str, int, int]]] = defaultdict(list)
+        self._group_keys: Dict[Hashable, None] = dict()
+        self._memory_used = 0
+        self._count_runs = 0
+        self._count_merges = 0
+
+    @property
+    def count_runs(self) -> int:
+        return self._count_runs
+
+    def group_keys(self) -> List[Hashable]:
+        """
+
+        :return: group keys, in order of first appearance
+        """
+        return list(self._group_keys)
+
+    def add(self, group_key: Hashable, row: Tuple) -> None:
+        self._group_keys.setdefault(group_key)
+        self._rows_by_group[group_key].append(row)
+        self._memory_used += estimate_row_size(row)
+        if self._memory_used > self._memory_budget:
+            self.spill()
+
+    def spill(self) -> None:
+        """
+        Writes all the in-memory rows to a new run file, sorted within each group.
+
+        :return:
+        """
+        if not self._rows_by_group:
+            return
+
+        if self._spill_path is None:
+            self._spill_path = tempfile.mkdtemp(prefix='ib-spill-', dir=self._temp_dir)
+
+        run_path = os.path.join(self._spill_path, 'run-{:05d}'.format(self._count_runs))
+        logging.debug('spilling %d bytes to %s', self._memory_used, run_path)
+        with open(run_path, 'wb') as run_file:
+            for group_key, rows in self._rows_by_group.items():
+                rows.sort(key=self._sort_key)
+                offset = run_file.tell()
+                count_batches = 0
+                for start in range(0, len(rows), _BATCH_ROWS):
+                    pickle.dump(rows[start:start + _BATCH_ROWS], run_file, protocol=pickle.HIGHEST_PROTOCOL)
+                    count_batches += 1
+
+                self._segments_by_group[group_key].append((run_path, offset, count_batches))
+
+        self._rows_by_group.clear()
+        self._memory_used = 0
+        self._count_runs += 1
+
+    def sorted_group(self, group_key: Hashable) -> Iterator[Tuple]:
+        """
+        Merges the spilled runs and the in-memory rows of a group.
+
+        :param group_key:
+        :return: rows of the group, sorted
+        """
+        in_memory_rows = self._rows_by_group.pop(group_key, list())
+        self._memory_used -= sum(estimate_row_size(row) for row in in_memory_rows)
+        in_memory_rows.sort(key=self._sort_key)
+        segments = self._segments_by_group.pop(group_key, list())
+        if not segments:
+            return iter(in_memory_rows)
+
+        # the in-memory rows take up one of the merged inputs
+        while len(segments) + 1 > self._max_merge_runs:
+            segments = self._merge_pass(segments)
+
+        # earlier runs come first on equal keys, which keeps the sort stable
+        runs = [_read_segment(*segment) for segment in segments]
+        return heapq.merge(*runs, iter(in_memory_rows), key=self._sort_key)
+
+    def _merge_pass(self, segments: List[Tuple[str, int, int]]) -> List[Tuple[str, int, int]]:
+        """
+        Merges consecutive segments, max_merge_runs at a time, into new run files.
+        """
+        merged_segments = list()
+        for start in range(0, len(segments), self._max_merge_runs):
+            merged = segments[start:start + self._max_merge_runs]
+            if len(merged) == 1:
+                merged_segments.extend(merged)
+                continue
+
+            run_path = os.path.join(self._spill_path, 'merge-{:05d}'.format(self._count_merges))
+            self._count_merges += 1
+            rows = heapq.merge(*[_read_segment(*segment) for segment in merged], key=self._sort_key)
+            merged_segments.append(_write_segment(run_path, rows))
+            for merged_path, _, _ in merged:
+                # intermediate runs belong to a single group
+                if os.path.basename(merged_path).startswith('merge-'):
+                    os.remove(merged_path)
+
+        logging.debug('merged %d runs into %d', len(segments), len(merged_segments))
+        return merged_segments
+
+    def close(self) -> None:
+        """
+        Removes the spilled runs.
+
+        :return:
+        """
+        if self._spill_path is not None:
+            shutil.rmtree(self._spill_path, ignore_errors=True)
+            self._spill_path = None
+
+        self._rows_by_group.clear()
+        self._segments_by_group.clear()
+        self._group_keys.clear()
+        self._memory_used = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,182 @@
+"""
+Fuzzy search of instruments by label or symbol, tolerating partial and misspelled names.
+
+Labels and symbols are normalized (accents removed, upper case, punctuation as word separator) and split into
+trigrams of the words padded with a space on each side. The index file maps each trigram to the sorted list of
+the instruments containing it. The index file is a sectionfile, with the sections:
+ - con ids of the instruments (int64) and their number of distinct trigrams (uint32)
+ - trigrams, sorted (uint64, 21 bits per character)
+ - offsets of the posting list of each trigram (uint64)
+ - posting lists: instrument numbers (uint32)
+"""
+import heapq
+import math
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from ibdataloader import Instrument, ProductType
+from sectionfile import SectionFile, write_sections
+
+_MAGIC = b'IBTRI002'
+_DEFAULT_MIN_OVERLAP = .3
+# trigrams contained in more instruments than that are not used for finding candidates
+_COMMON_TRIGRAM_FRACTION = .02
+_MIN_COMMON_TRIGRAM_SIZE = 1000
+
+
+def normalize(text: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', text.upper())
+    characters = (character if character.isalnum() else ' '
+                  for character in decomposed if not unicodedata.combining(character))
+    return ' '.join(''.join(characters).split())
+
+
+def trigrams(text: str) -> Set[int]:
+    """
+
+    :param text:
+    :return: distinct trigrams of the normalized words, each packed into an integer
+    """
+    keys = set()
+    for word in normalize(text).split(' '):
+        if not word:
+            continue
+
+        codes = [ord(' ')] + [ord(character) for character in word] + [ord(' ')]
+        for position in range(len(codes) - 2):
+            keys.add((codes[position] << 42) | (codes[position + 1] << 21) | codes[position + 2])
+
+    return keys
+
+
+class TrigramIndexBuilder(object):
+    """
+    Gathers instruments, possibly while they are passed on to the writers of a crawl (see passing_through()),
+    and writes the index file once the crawl is over. Instruments listed on several exchanges are indexed once.
+    """
+
+    def __init__(self):
+        self._con_ids = array('q')
+        self._sizes = array('I')
+        self._postings: Dict[int, array] = dict()
+        self._known_con_ids = set()
+
+    def add(self, instrument: Instrument) -> None:
+        """
+
+        :param instrument: con_id has to be numeric
+        :return:
+        """
+        con_id = int(instrument.con_id)
+        if con_id in self._known_con_ids:
+            return
+
+        self._known_con_ids.add(con_id)
+        text = ' '.join(value for value in (instrument.label, instrument.symbol, instrument.ib_symbol) if value)
+        keys = trigrams(text)
+        document = len(self._con_ids)
+        self._con_ids.append(con_id)
+        self._sizes.append(len(keys))
+        for key in keys:
+            postings = self._postings.get(key)
+            if postings is None:
+                postings = array('I')
+                self._postings[key] = postings
+
+            postings.append(document)
+
+    def passing_through(self, product_type: ProductType, currency: str,
+                        instruments: Iterable[Instrument]) -> Iterator[Instrument]:
+        for instrument in instruments:
+            self.add(instrument)
+            yield instrument
+
+    def __len__(self) -> int:
+        return len(self._con_ids)
+
+    def write(self, path: str) -> None:
+        keys = array('Q', sorted(self._postings))
+        posting_offsets = array('Q', [0])
+        postings = array('I')
+        for key in keys:
+            postings.extend(self._postings[key])
+            posting_offsets.append(len(postings))
+
+        sections = [self._con_ids.tobytes(), self._sizes.tobytes(), keys.tobytes(), posting_offsets.tobytes(),
+                    postings.tobytes()]
+        write_sections(path, _MAGIC, (len(self._con_ids), len(keys), len(postings)), sections)
+
+
+class TrigramIndex(SectionFile):
+    """
+    Read-only access to an index written by TrigramIndexBuilder.
+    """
+
+    def __init__(self, path: str):
+        """
+
+        :param path:
+        :raises ValueError: when the file is not an index readable on this platform
+        """
+        super().__init__(path, _MAGIC, 3, 5, 'a trigram index')
+        self._count_documents, self._count_keys, count_postings = self._header_values
+        self._con_ids = self._section(0, self._count_documents, 'q')
+        self._sizes = self._section(1, self._count_documents, 'I')
+        self._keys = self._section(2, self._count_keys, 'Q')
+        self._posting_offsets = self._section(3, self._count_keys + 1, 'Q')
+        self._postings = self._section(4, count_postings, 'I')
+
+    def __len__(self) -> int:
+        return self._count_documents
+
+    def _posting_list(self, key: int) -> memoryview:
+        position = bisect_left(self._keys, key)
+        if position == self._count_keys or self._keys[position] != key:
+            return self._postings[0:0]
+
+        return self._postings[self._posting_offsets[position]:self._posting_offsets[position + 1]]
+
+    def search(self, text: str, k: int = 10, min_overlap: float = _DEFAULT_MIN_OVERLAP) -> List[Tuple[str, float]]:
+        """
+        Instruments are ranked by the Jaccard similarity of their trigrams with the trigrams of the query, only
+        the instruments containing at least min_overlap of the query trigrams being considered.
+
+        Candidates are the instruments found in the posting lists of the selective trigrams of the query, those
+        contained in less than a small fraction of the instruments: instruments only sharing common trigrams
+        such as those of "INC" with the query are left out, unless the query has no selective trigram at all.
+        The common trigrams are then only counted for the candidates.
+
+        :param text: part of a label or symbol, possibly misspelled
+        :param k: maximum number of results
+        :param min_overlap: fraction of the query trigrams an instrument must contain
+        :return: (con id, similarity) best first
+        """
+        query_keys = trigrams(text)
+        count_query_keys = len(query_keys)
+        if count_query_keys == 0:
+            return list()
+
+        min_common = max(1, math.ceil(count_query_keys * min_overlap))
+        max_selective_size = max(_MIN_COMMON_TRIGRAM_SIZE, int(self._count_documents * _COMMON_TRIGRAM_FRACTION))
+        posting_lists = [self._posting_list(key) for key in query_keys]
+        selective_lists = [posting_list for posting_list in posting_lists if len(posting_list) <= max_selective_size]
+        common_lists = [posting_list for posting_list in posting_lists if len(posting_list) > max_selective_size]
+        if not selective_lists:
+            selective_lists, common_lists = common_lists, list()
+
+        counts = Counter()
+        for posting_list in selective_lists:
+            counts.update(posting_list)
+
+        if common_lists:
+            min_selective_common = min_common - len(common_lists)
+            candidates = set(document for document, common in counts.items() if common >= min_selective_common)
+            for posting_list in common_lists:
+                counts.update(candidates.intersection(posting_list))
+
+        matches = ((common / (count_query_keys + self._sizes[document] - common), -self._con_ids[document])
+                   for document, common in counts.items() if common >= min_common)
+        return [(str(-negative_con_id), similarity) for similarity, negative_con_id in heapq.nlargest(k, matches)]
@@ -0,0 +1,233 @@
+"""
+In-memory stand-in for the Google Sheets and Drive APIs, as a session of a gspread client: only the calls made by
+gservices are supported. Used for testing and for benchmarking uploads offline, with a simulated network latency.
+Responses can be made to fail with given HTTP statuses, e.g. 429 for exceeding the quota.
+"""
+import json
+import re
+import threading
+import time
+from typing import Dict, List
+from urllib.parse import unquote
+
+import gspread
+from gspread.utils import a1_range_to_grid_range
+
+_SPREADSHEET_URL = re.compile(r'https://sheets\.googleapis\.com/v4/spreadsheets/([^/:]+)(:batchUpdate|/values/(.+))?$')
+_DRIVE_URL = re.compile(r'https://www\.googleapis\.com/drive/v3/files/([^/]+)$')
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code: int, payload):
+        self.status_code = status_code
+        self._payload = payload
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return json.dumps(self._payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeSpreadsheet(object):
+
+    def __init__(self, spreadsheet_id: str, titles: List[str]):
+        self.spreadsheet_id = spreadsheet_id
+        self.sheets = list()
+        self.values: Dict[int, Dict] = dict()
+        self._next_sheet_id = 0
+        for title in titles:
+            self.add_sheet({'title': title, 'gridProperties': {'rowCount': 1000, 'columnCount': 26}})
+
+    def add_sheet(self, properties: Dict) -> Dict:
+        properties = dict(properties, sheetType='GRID')
+        properties.setdefault('sheetId', self._next_sheet_id)
+        if properties['sheetId'] in self.values:
+            raise ValueError('sheet id already in use: {}'.format(properties['sheetId']))
+
+        self._next_sheet_id = max(self._next_sheet_id, properties['sheetId']) + 1
+        self.sheets.insert(properties.get('index', len(self.sheets)), properties)
+        self.values[properties['sheetId']] = dict()
+        self._reindex()
+        return properties
+
+    def _reindex(self) -> None:
+        for index, properties in enumerate(self.sheets):
+            properties['index'] = index
+
+    def sheet_by_title(self, title: str) -> Dict:
+        return next(properties for properties in self.sheets if properties['title'] == title)
+
+    def rows(self, title: str) -> List[List[str]]:
+        """
+
+        :param title:
+        :return: values of the worksheet, up to the last non-empty row and column
+        """
+        cells = self.values[self.sheet_by_title(title)['sheetId']]
+        count_rows = max((row + 1 for row, _ in cells), default=0)
+        count_cols = max((col + 1 for _, col in cells), default=0)
+        return [[cells.get((row, col), '') for col in range(count_cols)] for row in range(count_rows)]
+
+    def batch_update(self, requests: List[Dict]) -> List[Dict]:
+        replies = list()
+        for request in requests:
+            (kind, body), = request.items()
+            reply = dict()
+            if kind == 'addSheet':
+                reply = {'addSheet': {'properties': self.add_sheet(body['properties'])}}
+
+            elif kind == 'deleteSheet':
+                self.sheets = [properties for properties in self.sheets if properties['sheetId'] != body['sheetId']]
+                del self.values[body['sheetId']]
+                self._reindex()
+
+            elif kind == 'updateSheetProperties':
+                properties = next(properties for properties in self.sheets
+                                  if properties['sheetId'] == body['properties']['sheetId'])
+                current_index = properties['index']
+                properties.update(body['properties'])
+                if properties['index'] != current_index:
+                    # index of the destination before the move
+                    self.sheets.remove(properties)
+                    self.sheets.insert(properties['index'] - (properties['index'] > current_index), properties)
+                    self._reindex()
+
+            elif kind == 'updateCells':
+                self._set_rows(body['start']['sheetId'], body['start']['rowIndex'], body['start']['columnIndex'],
+                               body['rows'])
+
+            elif kind == 'appendCells':
+                cells = self.values[body['sheetId']]
+                self._set_rows(body['sheetId'], max((row + 1 for row, _ in cells), default=0), 0, body['rows'])
+
+            elif kind == 'deleteDimension':
+                self._delete_rows(body['range']['sheetId'], body['range']['startIndex'], body['range']['endIndex'])
+
+            elif kind not in ('autoResizeDimensions', 'updateDimensionProperties'):
+                raise NotImplementedError(kind)
+
+            replies.append(reply)
+
+        return replies
+
+    def _set_rows(self, sheet_id: int, start_row: int, start_col: int, rows: List[Dict]) -> None:
+        cells = self.values[sheet_id]
+        for row, row_data in enumerate(rows):
+            for col, cell_data in enumerate(row_data['values']):
+                value = cell_data.get('userEnteredValue', {}).get('stringValue')
+                if value is not None:
+                    cells[(start_row + row, start_col + col)] = value
+
+    def _delete_rows(self, sheet_id: int, start_index: int, end_index: int) -> None:
+        cells = self.values[sheet_id]
+        self.values[sheet_id] = {(row if row < start_index else row - (end_index - start_index), col): value
+                                 for (row, col), value in cells.items() if not start_index <= row < end_index}
+
+    def _range(self, range_name: str):
+        title, _, cells_range = range_name.partition('!')
+        grid_range = a1_range_to_grid_range(cells_range)
+        return title.strip("'").replace("''", "'"), grid_range
+
+    def values_get(self, range_name: str) -> Dict:
+        if '!' not in range_name:
+            values = self.rows(range_name.strip("'").replace("''", "'"))
+            return {'range': range_name, 'majorDimension': 'ROWS', 'values': values}
+
+        title, grid_range = self._range(range_name)
+        cells = self.values[self.sheet_by_title(title)['sheetId']]
+        values = [[cells.get((row, col), '')
+                   for col in range(grid_range['startColumnIndex'], grid_range['endColumnIndex'])]
+                  for row in range(grid_range['startRowIndex'], grid_range['endRowIndex'])]
+        return {'range': range_name, 'majorDimension': 'ROWS', 'values': values}
+
+    def values_update(self, range_name: str, values: List[List[str]]) -> Dict:
+        title, grid_range = self._range(range_name)
+        cells = self.values[self.sheet_by_title(title)['sheetId']]
+        for row, row_values in enumerate(values):
+            for col, value in enumerate(row_values):
+                cells[(grid_range['startRowIndex'] + row, grid_range['startColumnIndex'] + col)] = value
+
+        return {'updatedRange': range_name}
+
+
+class FakeSheetsSession(object):
+    """
+    Session handling the HTTP requests of a gspread client.
+    """
+
+    def __init__(self, latency: float = 0.):
+        """
+
+        :param latency: seconds each request takes, concurrent requests being served in parallel
+        """
+        self.spreadsheets: Dict[str, FakeSpreadsheet] = dict()
+        self.latency = latency
+        self.requests = list()
+        self.batches = list()
+        self.failures = list()
+        self._lock = threading.Lock()
+
+    def create(self, spreadsheet_id: str, titles: List[str]) -> FakeSpreadsheet:
+        self.spreadsheets[spreadsheet_id] = FakeSpreadsheet(spreadsheet_id, titles)
+        return self.spreadsheets[spreadsheet_id]
+
+    def fail_next(self, *statuses: int) -> None:
+        """
+        The next requests are answered with the given statuses, in order.
+        """
+        self.failures.extend(statuses)
+
+    def _respond(self, method: str, url: str, json_body) -> FakeResponse:
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.requests.append((method, url))
+            if self.failures:
+                status = self.failures.pop(0)
+                return FakeResponse(status, {'error': {'code': status, 'message': 'failing on purpose'}})
+
+            drive_match = _DRIVE_URL.match(url)
+            if drive_match:
+                return FakeResponse(200, {'id': drive_match.group(1), 'name': drive_match.group(1)})
+
+            sheets_match = _SPREADSHEET_URL.match(url)
+            spreadsheet = self.spreadsheets.get(sheets_match.group(1)) if sheets_match else None
+            if spreadsheet is None:
+                return FakeResponse(404, {'error': {'code': 404, 'message': 'not found: {}'.format(url)}})
+
+            if sheets_match.group(2) == ':batchUpdate':
+                self.batches.append(json_body['requests'])
+                return FakeResponse(200, {'spreadsheetId': spreadsheet.spreadsheet_id,
+                                          'replies': spreadsheet.batch_update(json_body['requests'])})
+
+            if sheets_match.group(3) is not None and method == 'get':
+                return FakeResponse(200, spreadsheet.values_get(unquote(sheets_match.group(3))))
+
+            if sheets_match.group(3) is not None and method == 'put':
+                return FakeResponse(200, spreadsheet.values_update(unquote(sheets_match.group(3)),
+                                                                   json_body['values']))
+
+            sheets = [{'properties': dict(properties)} for properties in spreadsheet.sheets]
+            return FakeResponse(200, {'spreadsheetId': spreadsheet.spreadsheet_id,
+                                      'properties': {'title': spreadsheet.spreadsheet_id}, 'sheets': sheets})
+
+    def get(self, url, json=None, **kwargs):
+        return self._respond('get', url, json)
+
+    def post(self, url, json=None, **kwargs):
+        return self._respond('post', url, json)
+
+    def put(self, url, json=None, **kwargs):
+        return self._respond('put', url, json)
+
+
+def fake_client(session: FakeSheetsSession) -> gspread.Client:
+    return gspread.Client(None, session=session)
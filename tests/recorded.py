@@ -0,0 +1,126 @@
+"""
+Recorded IB listing pages, served in place of live HTTP requests.
+"""
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def load_recorded_pages():
+    """
+
+    :return: dict of url -> html text
+    """
+    with open(os.path.join(_DATA_PATH, 'pages.json'), 'rt') as pages_file:
+        filenames = json.load(pages_file)
+
+    pages = dict()
+    for url, filename in filenames.items():
+        with open(os.path.join(_DATA_PATH, filename), 'rt', encoding='utf-8') as page_file:
+            pages[url] = page_file.read()
+
+    return pages
+
+
+def recorded_load_url(pages):
+    """
+
+    :param pages: dict of url -> html text
+    :return: replacement for ibdataloader.load_url
+    """
+    def load_url(url, rejection_marker=None):
+        if url not in pages:
+            raise RuntimeError('no recorded page for url {}'.format(url))
+
+        return pages[url]
+
+    return load_url
+
+
+class RecordedPagesServer(object):
+    """
+    Local stand-in for the IB website, serving recorded pages over HTTP.
+    """
+
+    def __init__(self, pages, url_base='https://www.interactivebrokers.com', validators=False):
+        """
+
+        :param pages: dict of url -> html text
+        :param url_base: prefix of the recorded urls, replaced by the local server address
+        :param validators: sends ETag and Last-Modified headers and answers conditional requests
+        """
+        self._url_base = url_base
+        self._pages = dict()
+        self._validators = validators
+        self._server = None
+        self._thread = None
+        self.requests = list()
+        self.statuses = list()
+        self.update_pages(pages)
+
+    def update_pages(self, pages):
+        """
+        Replaces the content of the served pages.
+
+        :param pages: dict of url -> html text
+        :return:
+        """
+        for url, html_text in pages.items():
+            if url.startswith(self._url_base):
+                self._pages[url[len(self._url_base):]] = html_text
+
+    @property
+    def url_base(self) -> str:
+        host, port = self._server.server_address
+        return 'http://{}:{}'.format(host, port)
+
+    def _make_handler(self):
+        server = self
+
+        class RecordedPagesHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers)))
+                if self.path not in server._pages:
+                    self.send_error(404)
+                    return
+
+                content = server._pages[self.path].encode('utf-8')
+                etag = '"{}"'.format(hashlib.md5(content).hexdigest())
+                if server._validators and self.headers.get('If-None-Match') == etag:
+                    server.statuses.append((self.path, 304))
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                server.statuses.append((self.path, 200))
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                if server._validators:
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', 'Mon, 05 Oct 2026 08:00:00 GMT')
+
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        return RecordedPagesHandler
+
+    def __enter__(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
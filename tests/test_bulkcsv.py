@@ -0,0 +1,101 @@
+import csv
+import gzip
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from bulkcsv import BulkCsvWriter
+from ibdataloader import Instrument, ProductType
+
+_ROWS = [
+    ('1', 'APPLE INC', 'AAPL', 'AAPL', 'USD', ProductType.STOCK),
+    ('2', 'BERKSHIRE HATHAWAY, INC', 'BRK B', 'BRK.B', 'USD', ProductType.STOCK),
+    ('3', 'THE "BEST" FUND', 'BEST', None, 'EUR', ProductType.ETF),
+    ('4', 'MULTI\nLINE', 'ML', 'ML', 'GBP', ProductType.STOCK),
+    (5, '', '', 'E', 'CHF', ProductType.ETF),
+    ('6', 'SHORT ROW'),
+]
+
+
+class TestBulkCsvWriter(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._temp_dir.name, 'ib-instr_usd_stk.csv')
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_same_as_csv_module(self):
+        rows = _ROWS * 3000
+        with BulkCsvWriter(self._path, Instrument.fields) as writer:
+            writer.write_rows(rows)
+            writer.write_rows(rows[:2])
+
+        self.assertEqual(len(rows) + 2, writer.count_rows)
+        expected = io.StringIO(newline='')
+        csv.writer(expected).writerows([Instrument.fields] + rows + rows[:2])
+        with open(self._path, 'rt', newline='') as csv_file:
+            self.assertEqual(expected.getvalue(), csv_file.read())
+
+        self.assertEqual(['ib-instr_usd_stk.csv'], os.listdir(self._temp_dir.name))
+
+    def test_records(self):
+        instrument = Instrument('42', 'SOME FUND', 'ARCA')
+        instrument.symbol = 'SF'
+        instrument.currency = 'USD'
+        instrument.product_type = ProductType.ETF
+        with BulkCsvWriter(self._path, ('symbol', 'con_id'), compress=True) as writer:
+            writer.write_records([instrument, instrument])
+
+        with gzip.open(self._path, 'rt', newline='') as csv_file:
+            self.assertEqual([['symbol', 'con_id'], ['SF', '42'], ['SF', '42']], list(csv.reader(csv_file)))
+
+    def test_atomic(self):
+        with open(self._path, 'wt') as previous_file:
+            previous_file.write('previous')
+
+        with BulkCsvWriter(self._path, Instrument.fields) as writer:
+            writer.write_rows(_ROWS[:2] * 1000)
+            # the target is only replaced once complete
+            with open(self._path, 'rt') as csv_file:
+                self.assertEqual('previous', csv_file.read())
+
+            self.assertEqual(2, len(os.listdir(self._temp_dir.name)))
+
+        def failing_rows():
+            yield from _ROWS[:2]
+            raise RuntimeError('connection lost')
+
+        with open(self._path, 'rt') as csv_file:
+            content = csv_file.read()
+
+        with self.assertRaises(RuntimeError):
+            with BulkCsvWriter(self._path, Instrument.fields) as writer:
+                writer.write_rows(failing_rows())
+
+        with open(self._path, 'rt') as csv_file:
+            self.assertEqual(content, csv_file.read())
+
+        self.assertEqual(['ib-instr_usd_stk.csv'], os.listdir(self._temp_dir.name))
+
+    def test_failed_publish(self):
+        with open(self._path, 'wt') as previous_file:
+            previous_file.write('previous')
+
+        for compress in (False, True):
+            with mock.patch('os.fsync', side_effect=OSError('disk full')):
+                with self.assertRaises(OSError):
+                    with BulkCsvWriter(self._path, Instrument.fields, compress=compress) as writer:
+                        writer.write_rows(_ROWS[:2] * 1000)
+
+            with open(self._path, 'rt') as csv_file:
+                self.assertEqual('previous', csv_file.read())
+
+            self.assertEqual(['ib-instr_usd_stk.csv'], os.listdir(self._temp_dir.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
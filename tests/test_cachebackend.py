@@ -0,0 +1,151 @@
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from cachebackend import FileTreeBackend, SQLiteBackend
+
+
+class BackendTests(object):
+
+    random_accesses = 10000
+
+    def create_backend(self, path):
+        raise NotImplementedError()
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._backend = self.create_backend(os.path.join(self._temp_dir.name, 'cache'))
+
+    def tearDown(self):
+        self._backend.close()
+        self._temp_dir.cleanup()
+
+    def test_entries(self):
+        self.assertIsNone(self._backend.get('https://www.interactivebrokers.com/en/index.php?f=products&p=stk'))
+        self._backend.put('https://www.interactivebrokers.com/en/index.php?f=products&p=stk', b'<html>stk</html>')
+        self._backend.put('https://www.interactivebrokers.com/en/index.php?f=products&p=etf', b'<html>etf</html>')
+        self._backend.put('https://www.interactivebrokers.com/en/index.php?f=products&p=stk', b'<html>STK</html>')
+        self.assertEqual(b'<html>STK</html>',
+                         self._backend.get('https://www.interactivebrokers.com/en/index.php?f=products&p=stk'))
+        self._backend.delete('https://www.interactivebrokers.com/en/index.php?f=products&p=stk')
+        self._backend.delete('https://www.interactivebrokers.com/en/index.php?f=products&p=stk')
+        self.assertIsNone(self._backend.get('https://www.interactivebrokers.com/en/index.php?f=products&p=stk'))
+        self.assertEqual(b'<html>etf</html>',
+                         self._backend.get('https://www.interactivebrokers.com/en/index.php?f=products&p=etf'))
+
+    def test_entries_info(self):
+        self._backend.put('abc', b'x' * 10)
+        self._backend.put('def', b'x' * 20)
+        entries = sorted(self._backend.entries())
+        self.assertEqual([('abc', 10), ('def', 20)], [(entry.key, entry.size) for entry in entries])
+        for entry in entries:
+            self.assertLess(datetime.today() - entry.stored, timedelta(days=1))
+
+    def test_expire(self):
+        self._backend.put('abc', b'abc')
+        self._backend.put('def', b'def')
+        self.assertEqual(0, self._backend.expire(datetime.today() - timedelta(days=3)))
+        self.assertEqual(2, self._backend.expire(datetime.today() + timedelta(days=10)))
+        self.assertIsNone(self._backend.get('abc'))
+        self.assertIsNone(self._backend.get('def'))
+
+    def test_delete_many(self):
+        self.assertEqual(0, self._backend.delete_many(['abc']))
+        self._backend.put('abc', b'abc')
+        self._backend.put('def', b'def')
+        self._backend.put('ghi', b'ghi')
+        self.assertEqual(2, self._backend.delete_many(['abc', 'ghi', 'abc', 'xyz']))
+        self.assertEqual(['def'], self._backend.keys())
+        self.assertEqual(b'def', self._backend.get('def'))
+
+    def test_random_access_multithreaded(self):
+        def open_test_random(key):
+            content = self._backend.get(str(key))
+            if content is None:
+                content = 'content for key {}: {}'.format(key, random.randint(1, 100000)).encode('utf-8')
+                self._backend.put(str(key), content)
+
+            return content
+
+        keys = [random.randint(0, self.random_accesses // 5) for _ in range(self.random_accesses)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=30) as executor:
+            results = list(executor.map(open_test_random, keys))
+
+        logging.info('%s: %d random accesses in %.2fs', type(self._backend).__name__, len(keys),
+                     time.perf_counter() - start)
+        for key, content in zip(keys, results):
+            self.assertTrue(content.startswith('content for key {}: '.format(key).encode('utf-8')))
+
+        for key in set(keys):
+            self.assertIsNotNone(self._backend.get(str(key)))
+
+
+class TestFileTreeBackend(BackendTests, unittest.TestCase):
+
+    # one file per entry plus an index file rewritten under a global lock: much slower
+    random_accesses = 1000
+
+    def create_backend(self, path):
+        return FileTreeBackend(path)
+
+
+class TestSQLiteBackend(BackendTests, unittest.TestCase):
+
+    def create_backend(self, path):
+        return SQLiteBackend(path + '.db')
+
+    def test_total_bytes(self):
+        self._backend.put('abc', b'x' * 10)
+        self._backend.put('def', b'x' * 20)
+        self._backend.put('abc', b'x' * 5)
+        self.assertEqual(25, self._backend.total_bytes)
+        self._backend.delete('def')
+        self.assertEqual(5, self._backend.total_bytes)
+        self._backend.close()
+        self._backend = SQLiteBackend(self._backend.path)
+        self.assertEqual(5, self._backend.total_bytes)
+
+    def test_total_bytes_concurrent_puts(self):
+        def put_same_keys(size):
+            for count in range(50):
+                self._backend.put('key{}'.format(count % 5), b'x' * (size + count))
+
+        threads = [threading.Thread(target=put_same_keys, args=(size,)) for size in (10, 20, 30, 40)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        stored_bytes = sum(entry.size for entry in self._backend.entries())
+        self.assertEqual(stored_bytes, self._backend.total_bytes)
+
+    def test_lru_eviction(self):
+        backend = SQLiteBackend(os.path.join(self._temp_dir.name, 'lru.db'), max_bytes=300, access_resolution=0.)
+        try:
+            for key in range(3):
+                backend.put(str(key), b'x' * 100)
+                time.sleep(0.01)
+
+            backend.get('0')
+            time.sleep(0.01)
+            backend.put('3', b'x' * 100)
+            self.assertIsNone(backend.get('1'))
+            self.assertEqual([b'x' * 100] * 3, [backend.get(key) for key in ('0', '2', '3')])
+            self.assertEqual(300, backend.total_bytes)
+            backend.put('4', b'x' * 250)
+            self.assertEqual(['4'], [key for key in ('0', '2', '3', '4') if backend.get(key) is not None])
+
+        finally:
+            backend.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import cachecodec
+import pagecache
+from cachebackend import BACKEND_FILES, BACKEND_SQLITE
+from pagecache import CachedPage
+
+_DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def load_samples():
+    samples = list()
+    for filename in sorted(os.listdir(_DATA_DIR)):
+        if filename.endswith('.html'):
+            with open(os.path.join(_DATA_DIR, filename), 'rb') as sample_file:
+                samples.append(sample_file.read())
+
+    return samples
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_roundtrip(self):
+        samples = load_samples()
+        for method in cachecodec.available_methods():
+            codec = cachecodec.Codec(method)
+            for sample in samples:
+                compressed = codec.compress(sample)
+                self.assertTrue(cachecodec.is_compressed(compressed))
+                self.assertLess(len(compressed), len(sample))
+                self.assertEqual(sample, codec.decompress(compressed))
+
+    def test_uncompressed(self):
+        codec = cachecodec.Codec()
+        self.assertFalse(cachecodec.is_compressed(b'<html></html>'))
+        self.assertEqual(b'<html></html>', codec.decompress(b'<html></html>'))
+
+    def test_dictionary(self):
+        samples = load_samples()
+        for method in cachecodec.available_methods():
+            # zstd training needs many samples
+            dictionary = cachecodec.train_dictionary(samples * 20, size=16 * 1024)
+            codec = cachecodec.Codec(method, dictionary)
+            compressed = codec.compress(samples[0])
+            self.assertEqual(samples[0], codec.decompress(compressed))
+            self.assertRaises(ValueError, cachecodec.Codec(method).decompress, compressed)
+            reader = cachecodec.Codec(method)
+            reader.add_dictionary(dictionary)
+            self.assertEqual(samples[0], reader.decompress(compressed))
+
+    def test_corrupted(self):
+        for method in cachecodec.available_methods():
+            codec = cachecodec.Codec(method)
+            compressed = codec.compress(b'<html>' * 100)
+            self.assertRaises(ValueError, codec.decompress, compressed[:-10] + b'x' * 10)
+
+    def test_unavailable_method(self):
+        self.assertRaises(ValueError, cachecodec.Codec, 'lzma')
+
+
+class TestCompressedPageCache(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        pagecache.set_backend(None)
+        pagecache.set_compression(None)
+        self._temp_dir.cleanup()
+
+    def _check_migration(self, backend_name):
+        cache_dir = os.path.join(self._temp_dir.name, backend_name)
+        os.makedirs(cache_dir)
+        pagecache.open_cache(cache_dir, backend_name, expiry_days=20)
+        samples = load_samples()
+        checked = datetime(2026, 10, 5, 8)
+        for count, sample in enumerate(samples):
+            content = sample.decode('utf-8')
+            page = CachedPage(content, pagecache.content_hash(content), None, None, checked)
+            pagecache.get_backend().put('https://www.example.com/?f=2222&page={}'.format(count),
+                                        pagecache._encode_entry(page))
+
+        pagecache.set_compression(cachecodec.default_method())
+        count_entries, size_before, size_after = pagecache.rewrite_entries()
+        self.assertEqual(len(samples), count_entries)
+        self.assertLess(size_after, size_before)
+
+        dictionary = cachecodec.train_dictionary(pagecache.sample_entries(100) * 20, size=16 * 1024)
+        pagecache.save_dictionary(cache_dir, dictionary)
+        pagecache.set_compression(cachecodec.default_method(), dictionary)
+        self.assertEqual(len(samples), pagecache.rewrite_entries()[0])
+
+        pagecache.set_backend(None)
+        pagecache.open_cache(cache_dir, backend_name, expiry_days=20)
+        for count, sample in enumerate(samples):
+            page = pagecache.get_page('https://www.example.com/?f=2222&page={}'.format(count))
+            self.assertEqual(sample.decode('utf-8'), page.content)
+            self.assertEqual(checked, page.checked)
+
+        # rewrite interrupted after the first entry: the new dictionary is saved by its id but not current yet
+        new_dictionary = cachecodec.train_dictionary(pagecache.sample_entries(100) * 20, size=8 * 1024)
+        pagecache.save_dictionary(cache_dir, new_dictionary, current=False)
+        pagecache.set_compression(cachecodec.default_method(), new_dictionary,
+                                  read_dictionaries=pagecache.load_dictionaries(cache_dir))
+        page = CachedPage(samples[0].decode('utf-8'), pagecache.content_hash(samples[0].decode('utf-8')), None, None,
+                          checked)
+        pagecache.get_backend().put('https://www.example.com/?f=2222&page=0', pagecache._encode_entry(page))
+        pagecache.set_backend(None)
+        pagecache.open_cache(cache_dir, backend_name, expiry_days=20)
+        self.assertEqual(dictionary, pagecache.load_dictionary(cache_dir))
+        for count, sample in enumerate(samples):
+            page = pagecache.get_page('https://www.example.com/?f=2222&page={}'.format(count))
+            self.assertEqual(sample.decode('utf-8'), page.content)
+
+        pagecache.remove_dictionaries(cache_dir, keep=[dictionary])
+        self.assertEqual([dictionary], pagecache.load_dictionaries(cache_dir))
+        os.remove(pagecache.dictionary_path(cache_dir, cachecodec.dictionary_id(dictionary)))
+        os.remove(pagecache.dictionary_path(cache_dir))
+        pagecache.set_backend(None)
+        pagecache.open_cache(cache_dir, backend_name, expiry_days=20)
+        self.assertIsNone(pagecache.get_page('https://www.example.com/?f=2222&page=0'))
+
+    def test_migration_files(self):
+        self._check_migration(BACKEND_FILES)
+
+    def test_migration_sqlite(self):
+        self._check_migration(BACKEND_SQLITE)
+
+
+if __name__ == '__main__':
+    unittest.main()
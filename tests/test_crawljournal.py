@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+
+import ibdataloader
+from crawljournal import CrawlJournal
+from ibdataloader import ProductType
+from recorded import load_recorded_pages, recorded_load_url
+
+_NASDAQ_PAGE_2 = ('https://www.interactivebrokers.com/en/index.php?f=2222&exch=nasdaq&showcategories=STK'
+                  '&p=&cc=&limit=100&page=2')
+
+
+class TestCrawlJournal(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._journal_path = os.path.join(self._temp_dir.name, 'journal.db')
+        self._load_url = ibdataloader.load_url
+
+    def tearDown(self):
+        ibdataloader.load_url = self._load_url
+        ibdataloader.set_journal(None)
+        self._temp_dir.cleanup()
+
+    def test_units(self):
+        exchange_page = ([('265598', 'APPLE INC', 'AAPL', 'AAPL', 'USD')], '/en/page2', 1,
+                         {1: '/en/page1', 2: '/en/page2'})
+        with CrawlJournal(self._journal_path) as journal:
+            self.assertIsNone(journal.exchanges('stk'))
+            self.assertIsNone(journal.exchange_page('/en/page1'))
+            journal.record_exchanges('stk', [('NYSE', '/en/nyse'), ('LSE', '/en/lse')])
+            journal.record_exchange_page('NYSE', '/en/page1', exchange_page)
+
+        with CrawlJournal(self._journal_path, resume=True) as journal:
+            self.assertEqual((1, 1), journal.count_units())
+            self.assertEqual([('NYSE', '/en/nyse'), ('LSE', '/en/lse')], journal.exchanges('stk'))
+            self.assertEqual(exchange_page, journal.exchange_page('/en/page1'))
+
+        with CrawlJournal(self._journal_path) as journal:
+            self.assertEqual((0, 0), journal.count_units())
+
+    def _process_instruments(self, pages, resume, requested_urls=None):
+        load_url = recorded_load_url(pages)
+
+        def recording_load_url(url, rejection_marker=None):
+            if requested_urls is not None:
+                requested_urls.append(url)
+
+            return load_url(url, rejection_marker)
+
+        ibdataloader.load_url = recording_load_url
+        results = dict()
+        with CrawlJournal(self._journal_path, resume=resume) as journal:
+            ibdataloader.set_journal(journal)
+            try:
+                ibdataloader.process_instruments([ProductType.STOCK, ProductType.ETF],
+                                                 lambda p, c, i: results.update({(p, c): [x.as_dict() for x in i]}))
+
+            finally:
+                ibdataloader.set_journal(None)
+
+        return results
+
+    def test_resume(self):
+        pages = load_recorded_pages()
+        expected = self._process_instruments(pages, resume=False)
+        failing_pages = dict(pages)
+        del failing_pages[_NASDAQ_PAGE_2]
+        self.assertRaises(RuntimeError, self._process_instruments, failing_pages, False)
+
+        requested_urls = list()
+        self.assertEqual(expected, self._process_instruments(pages, resume=True, requested_urls=requested_urls))
+        # exchanges sorted by name: ARCA (etf), LSE then NASDAQ and NYSE (stk), stopping on the missing page
+        self.assertEqual([_NASDAQ_PAGE_2] + [url for url in pages if 'exch=nyse' in url], requested_urls)
+
+        requested_urls = list()
+        self.assertEqual(expected, self._process_instruments(pages, resume=True, requested_urls=requested_urls))
+        self.assertEqual([], requested_urls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import csv
+import os
+import tempfile
+import unittest
+
+import gservices
+from fakesheets import FakeSheetsSession, fake_client
+from ibdataloader import Instrument, ProductType
+from sinks import SHEET_COLUMNS, CsvSink, bucket_filename
+
+_HEADER = ('conid', 'symbol', 'ib_symbol', 'label')
+
+
+def _rows(count):
+    return ({'conid': str(100000 + number), 'symbol': 'S{}'.format(number), 'ib_symbol': 'S {}'.format(number),
+             'label': 'INSTRUMENT {}'.format(number)} for number in range(count))
+
+
+class TestUploadWorksheet(unittest.TestCase):
+
+    def setUp(self):
+        self._session = FakeSheetsSession()
+        self._spreadsheet = self._session.create('stk', ['usd', 'eur'])
+        self._client = fake_client(self._session)
+
+    def _titles(self):
+        return [properties['title'] for properties in self._spreadsheet.sheets]
+
+    def test_single_batch(self):
+        self.assertEqual(3, gservices.upload_worksheet(self._client, 'stk', 'chf', _rows(3), _HEADER))
+        self.assertEqual(['usd', 'eur', 'chf'], self._titles())
+        self.assertEqual([list(_HEADER), ['100000', 'S0', 'S 0', 'INSTRUMENT 0'],
+                          ['100001', 'S1', 'S 1', 'INSTRUMENT 1'], ['100002', 'S2', 'S 2', 'INSTRUMENT 2']],
+                         self._spreadsheet.rows('chf'))
+        # fetching the worksheet properties, then a single batchUpdate
+        self.assertEqual(2, len(self._session.requests))
+        self.assertIn('autoResizeDimensions', self._session.batches[0][-1])
+
+    def test_replaces_worksheet_in_chunks(self):
+        gservices.upload_worksheet(self._client, 'stk', 'usd', _rows(3), _HEADER)
+        self._session.batches.clear()
+        self.assertEqual(25, gservices.upload_worksheet(self._client, 'stk', 'usd', _rows(25), _HEADER,
+                                                        resize_columns=False, chunk_cells=40))
+        self.assertEqual(['usd', 'eur'], self._titles())
+        rows = self._spreadsheet.rows('usd')
+        self.assertEqual(26, len(rows))
+        self.assertEqual(['100024', 'S24', 'S 24', 'INSTRUMENT 24'], rows[-1])
+        # 10 rows per chunk: the old worksheet is only deleted by the last of the 3 batches
+        self.assertEqual(3, len(self._session.batches))
+        self.assertEqual([['addSheet', 'updateCells', 'appendCells'], ['appendCells'],
+                          ['appendCells', 'deleteSheet', 'updateSheetProperties']],
+                         [[next(iter(request)) for request in batch] for batch in self._session.batches])
+
+    def test_stale_staging_worksheet(self):
+        self._session.create('etf', ['new_usd'])
+        gservices.upload_worksheet(self._client, 'etf', 'usd', _rows(1))
+        self.assertEqual(['usd'], [properties['title'] for properties in self._session.spreadsheets['etf'].sheets])
+        self.assertEqual(list(_HEADER), self._session.spreadsheets['etf'].rows('usd')[0])
+
+    def test_any_header(self):
+        rows = [{'conid': '265598', 'symbol': 'AAPL', 'exchange': 'NASDAQ', 'currency': 'USD', 'label': None}]
+        gservices.upload_worksheet(self._client, 'stk', 'usd', rows, ('conid', 'exchange', 'label', 'currency'))
+        self.assertEqual([['conid', 'exchange', 'label', 'currency'], ['265598', 'NASDAQ', '', 'USD']],
+                         self._spreadsheet.rows('usd'))
+
+    def test_cached_sheets(self):
+        sheets = gservices.sheet_properties(self._client, 'stk')
+        self._session.requests.clear()
+        for worksheet_name in ('eur', 'chf', 'usd', 'eur'):
+            gservices.upload_worksheet(self._client, 'stk', worksheet_name, _rows(25), _HEADER, chunk_cells=40,
+                                       sheets=sheets)
+
+        self.assertEqual(['chf'], gservices.clean_worksheets(self._client, 'stk', {'usd', 'eur'}, sheets))
+        self.assertEqual(4 * 3 + 1, len(self._session.requests))
+        self.assertEqual([(properties['sheetId'], properties['title'], properties['index'])
+                          for properties in gservices.sheet_properties(self._client, 'stk')],
+                         [(properties['sheetId'], properties['title'], properties['index']) for properties in sheets])
+        self.assertEqual(['usd', 'eur'], self._titles())
+
+    def test_apply_sheet_requests(self):
+        sheets = [{'sheetId': sheet_id, 'title': title, 'index': index}
+                  for index, (sheet_id, title) in enumerate([(1, 'a'), (2, 'b'), (3, 'c')])]
+        gservices.apply_sheet_requests(sheets, [
+            {'updateSheetProperties': {'properties': {'sheetId': 1, 'index': 2}, 'fields': 'index'}},
+            {'addSheet': {'properties': {'sheetId': 4, 'title': 'd', 'index': 1}}},
+            {'deleteSheet': {'sheetId': 3}},
+            {'updateSheetProperties': {'properties': {'sheetId': 2, 'title': 'e'}, 'fields': 'title'}}])
+        self.assertEqual([(2, 'e', 0), (4, 'd', 1), (1, 'a', 2)],
+                         [(properties['sheetId'], properties['title'], properties['index']) for properties in sheets])
+
+    def test_clean_keeps_one_worksheet(self):
+        self.assertEqual(['usd'], gservices.clean_worksheets(self._client, 'stk', set()))
+        self.assertEqual(['eur'], self._titles())
+
+    def test_no_row(self):
+        self.assertEqual(0, gservices.upload_worksheet(self._client, 'stk', 'usd', iter([]), _HEADER))
+        self.assertEqual([], self._session.requests)
+
+    def test_missing_key(self):
+        rows = [{'con_id': '1', 'symbol': 'A', 'ib_symbol': 'A', 'label': 'ALPHA'}]
+        self.assertRaises(KeyError, gservices.upload_worksheet, self._client, 'stk', 'usd', rows, _HEADER)
+        self.assertEqual([], self._session.requests)
+
+
+class TestSyncWorksheet(unittest.TestCase):
+
+    def setUp(self):
+        self._session = FakeSheetsSession()
+        self._spreadsheet = self._session.create('stk', ['usd'])
+        self._client = fake_client(self._session)
+
+    def test_diff_rows(self):
+        current_values = [list(_HEADER), ['1', 'A', 'A', 'ALPHA'], ['2', 'B', 'B'], ['3', 'C', 'C', 'GAMMA'],
+                          ['3', 'C', 'C', 'GAMMA'], ['4', 'D', 'D', 'DELTA']]
+        rows = [{'conid': '4', 'symbol': 'D', 'ib_symbol': 'D', 'label': 'DELTA'},
+                {'conid': '2', 'symbol': 'B', 'ib_symbol': 'B', 'label': None},
+                {'conid': '3', 'symbol': 'C', 'ib_symbol': 'C', 'label': 'GAMMA INC'},
+                {'conid': '5', 'symbol': 'E', 'ib_symbol': 'E', 'label': 'EPSILON'}]
+        self.assertEqual(gservices.RowDelta(updated=[(3, ['3', 'C', 'C', 'GAMMA INC'])],
+                                            inserted=[['5', 'E', 'E', 'EPSILON']], deleted=[1, 4]),
+                         gservices.diff_rows(current_values, _HEADER, rows))
+
+    def test_diff_rows_without_key(self):
+        current_values = [list(_HEADER), ['1', 'A', 'A', 'ALPHA']]
+        rows = [{'symbol': 'A', 'ib_symbol': 'A', 'label': 'ALPHA'}]
+        self.assertRaises(KeyError, gservices.diff_rows, current_values, _HEADER, rows)
+        for con_id in ('', None):
+            rows = [{'conid': con_id, 'symbol': 'A', 'ib_symbol': 'A', 'label': 'ALPHA'}]
+            self.assertRaises(ValueError, gservices.diff_rows, current_values, _HEADER, rows)
+
+    def test_diff_rows_load_ib_file(self):
+        instruments = list()
+        for con_id, symbol in (('1', 'A'), ('2', 'B')):
+            instrument = Instrument(con_id, symbol + ' INC', 'NYSE')
+            instrument.symbol = symbol
+            instrument.ib_symbol = symbol
+            instrument.currency = 'USD'
+            instrument.product_type = ProductType.STOCK
+            instruments.append(instrument)
+
+        current_values = [list(_HEADER), ['1', 'A', 'A', 'A INC'], ['3', 'C', 'C', 'C INC']]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            CsvSink(temp_dir, 'ib-instr').write(ProductType.STOCK, 'USD', instruments)
+            path = os.path.join(temp_dir, bucket_filename('ib-instr', ProductType.STOCK, 'USD'))
+            with open(path, 'rt', newline='') as csv_file:
+                rows = list(csv.DictReader(csv_file))
+
+        # the file has a con_id column, mapped to the conid column of the worksheet
+        self.assertRaises(KeyError, gservices.diff_rows, current_values, _HEADER, rows)
+        sheet_rows = [{column: row[field] for column, field in SHEET_COLUMNS} for row in rows]
+        self.assertEqual(gservices.RowDelta(updated=[], inserted=[['2', 'B', 'B', 'B INC']], deleted=[2]),
+                         gservices.diff_rows(current_values, _HEADER, sheet_rows))
+
+    def test_sends_changes_only(self):
+        rows = list(_rows(100))
+        gservices.upload_worksheet(self._client, 'stk', 'usd', rows, _HEADER)
+        self._session.requests.clear()
+        self._session.batches.clear()
+        rows[10]['label'] = 'RENAMED 10'
+        rows[11]['label'] = 'RENAMED 11'
+        del rows[50:53]
+        rows.append({'conid': '999999', 'symbol': 'NEW', 'ib_symbol': 'NEW', 'label': 'NEW INSTRUMENT'})
+        delta = gservices.sync_worksheet(self._client, 'stk', 'usd', iter(rows), _HEADER)
+        self.assertEqual(([11, 12], 1, [51, 52, 53]), ([row_index for row_index, _ in delta.updated],
+                                                       len(delta.inserted), delta.deleted))
+        # worksheet properties, worksheet values, a single batchUpdate
+        self.assertEqual(3, len(self._session.requests))
+        self.assertEqual([['updateCells', 'appendCells', 'deleteDimension']],
+                         [[next(iter(request)) for request in batch] for batch in self._session.batches])
+        self.assertEqual([list(_HEADER)] + [[row[field] for field in _HEADER] for row in rows],
+                         self._spreadsheet.rows('usd'))
+
+    def test_unchanged(self):
+        gservices.upload_worksheet(self._client, 'stk', 'usd', _rows(10), _HEADER)
+        self._session.requests.clear()
+        self.assertEqual(gservices.RowDelta([], [], []), gservices.sync_worksheet(self._client, 'stk', 'usd',
+                                                                                  _rows(10), _HEADER))
+        self.assertEqual(2, len(self._session.requests))
+
+    def test_chunked(self):
+        gservices.upload_worksheet(self._client, 'stk', 'usd', _rows(10), _HEADER)
+        self._session.batches.clear()
+        rows = list(_rows(30))
+        for row in rows:
+            row['label'] += ' INC'
+
+        delta = gservices.sync_worksheet(self._client, 'stk', 'usd', rows, _HEADER, chunk_cells=40)
+        self.assertEqual((10, 20, 0), (len(delta.updated), len(delta.inserted), len(delta.deleted)))
+        self.assertEqual(3, len(self._session.batches))
+        self.assertEqual([list(_HEADER)] + [[row[field] for field in _HEADER] for row in rows],
+                         self._spreadsheet.rows('usd'))
+
+    def test_fallback_to_upload(self):
+        delta = gservices.sync_worksheet(self._client, 'stk', 'chf', _rows(2), _HEADER)
+        self.assertEqual(2, len(delta.inserted))
+        self.assertEqual(3, len(self._spreadsheet.rows('chf')))
+        header = ('conid', 'symbol', 'label')
+        delta = gservices.sync_worksheet(self._client, 'stk', 'chf', _rows(1), header)
+        self.assertEqual((1, [1, 2]), (len(delta.inserted), delta.deleted))
+        self.assertEqual([list(header), ['100000', 'S0', 'INSTRUMENT 0']], self._spreadsheet.rows('chf'))
+
+
+if __name__ == '__main__':
+    unittest.main()
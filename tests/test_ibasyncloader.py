@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+
+import ibasyncloader
+import ibdataloader
+import pagecache
+from ibdataloader import ProductType
+from recorded import load_recorded_pages, recorded_load_url, RecordedPagesServer
+
+
+class TestAsyncLoader(unittest.TestCase):
+
+    def setUp(self):
+        self._url_base = ibdataloader._URL_BASE
+        self._rate_limiter = ibdataloader.get_rate_limiter()
+        ibdataloader.set_rate_limit(1000., burst=100)
+
+    def tearDown(self):
+        ibdataloader._URL_BASE = self._url_base
+        ibdataloader._rate_limiter = self._rate_limiter
+
+    def test_same_output_as_blocking_loader(self):
+        pages = load_recorded_pages()
+        product_types = [ProductType.STOCK, ProductType.ETF]
+        load_url = ibdataloader.load_url
+        ibdataloader.load_url = recorded_load_url(pages)
+        try:
+            expected = dict()
+            ibdataloader.process_instruments(product_types, lambda p, c, i: expected.update({(p, c): list(i)}))
+
+        finally:
+            ibdataloader.load_url = load_url
+
+        with RecordedPagesServer(pages) as server:
+            ibdataloader._URL_BASE = server.url_base
+            results = dict()
+            ibasyncloader.process_instruments(product_types, lambda p, c, i: results.update({(p, c): list(i)}),
+                                              concurrency=4)
+
+        self.assertEqual(list(expected.keys()), list(results.keys()))
+        for key in expected:
+            self.assertEqual([instrument.as_dict() for instrument in expected[key]],
+                             [instrument.as_dict() for instrument in results[key]])
+
+        self.assertEqual(len(pages), len(set(path for path, headers in server.requests)))
+
+    def test_streaming(self):
+        with RecordedPagesServer(load_recorded_pages()) as server:
+            ibdataloader._URL_BASE = server.url_base
+            results = list()
+            ibasyncloader.process_instruments([ProductType.STOCK, ProductType.ETF],
+                                              lambda p, c, i: results.append((p, c, len(list(i)))), memory_budget=500)
+
+        self.assertEqual([(ProductType.ETF, 'USD', 2), (ProductType.STOCK, 'GBP', 2), (ProductType.STOCK, 'EUR', 1),
+                          (ProductType.STOCK, 'USD', 10)], results)
+
+    def test_rejection_marker(self):
+        pages = {'https://www.interactivebrokers.com/en/index.php?f=products&p=stk': 'To continue please enter code'}
+        with RecordedPagesServer(pages) as server:
+            ibdataloader._URL_BASE = server.url_base
+
+            async def first_instrument():
+                async for instrument in ibasyncloader.list_instruments([ProductType.STOCK]):
+                    return instrument
+
+            pagecache.reset_stats()
+            self.assertRaises(RuntimeError, asyncio.run, first_instrument())
+            self.assertEqual(1, pagecache.stats().get('rejected'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+import unittest
+
+import ibdataloader
+from ibdataloader import AsDict, Instrument, InstrumentBatch, ProductType
+from recorded import load_recorded_pages, recorded_load_url
+
+
+def _instrument(con_id, label, currency='USD', exchange='NYSE'):
+    instrument = Instrument(con_id=con_id, label=label, exchange=exchange)
+    instrument.symbol = label.split(' ')[0]
+    instrument.ib_symbol = instrument.symbol
+    instrument.currency = currency
+    instrument.product_type = ProductType.STOCK
+    return instrument
+
+
+class TestInstrument(unittest.TestCase):
+
+    def test_as_dict(self):
+        instrument = _instrument('265598', 'APPLE INC')
+        self.assertEqual({'con_id': '265598', 'label': 'APPLE INC', 'symbol': 'APPLE', 'ib_symbol': 'APPLE',
+                          'currency': 'USD', 'product_type': ProductType.STOCK}, instrument.as_dict())
+        self.assertEqual(['con_id', 'label', 'symbol', 'ib_symbol', 'currency', 'product_type'],
+                         list(instrument.as_dict().keys()))
+        self.assertEqual(tuple(instrument.as_dict().values()), instrument.as_tuple())
+        self.assertEqual('NYSE', instrument.exchange)
+        self.assertFalse(hasattr(instrument, '__dict__'))
+
+    def test_as_dict_subclass_fields(self):
+        class Quote(AsDict):
+            def __init__(self):
+                self._bid = 1.
+
+            @property
+            def bid(self):
+                return self._bid
+
+            @property
+            def ask(self):
+                return self._bid + 1.
+
+            def mid(self):
+                return self._bid + .5
+
+        self.assertEqual({'bid': 1., 'ask': 2.}, Quote().as_dict())
+
+
+class TestInstrumentBatch(unittest.TestCase):
+
+    def test_round_trip(self):
+        instruments = [_instrument('1', 'BETA CORP'), _instrument('2', 'ALPHA AG', currency='EUR', exchange='IBIS'),
+                       _instrument('3', 'alpha inc')]
+        batch = InstrumentBatch(instruments)
+        self.assertEqual(3, len(batch))
+        self.assertEqual([instrument.as_dict() for instrument in instruments], [item.as_dict() for item in batch])
+        self.assertEqual('IBIS', batch[1].exchange)
+        self.assertEqual([instrument.as_tuple() for instrument in instruments], list(batch.rows()))
+
+    def test_sort_by_label(self):
+        instruments = [_instrument(str(count), label)
+                       for count, label in enumerate(['beta', 'Alpha', 'BETA', 'gamma', 'ALPHA'])]
+        batch = InstrumentBatch(instruments)
+        batch.sort_by_label()
+        self.assertEqual([instrument.con_id for instrument in sorted(instruments, key=lambda k: k.label.upper())],
+                         [instrument.con_id for instrument in batch])
+
+
+class TestListInstruments(unittest.TestCase):
+
+    def setUp(self):
+        self._load_url = ibdataloader.load_url
+        ibdataloader.load_url = recorded_load_url(load_recorded_pages())
+
+    def tearDown(self):
+        ibdataloader.load_url = self._load_url
+
+    def test_sequential(self):
+        instruments = list(ibdataloader.list_instruments([ProductType.STOCK, ProductType.ETF]))
+        self.assertEqual(15, len(instruments))
+        self.assertEqual(['756733', '320227571', '7530'], [instrument.con_id for instrument in instruments[:3]])
+        self.assertEqual(ProductType.ETF, instruments[0].product_type)
+        self.assertEqual(ProductType.STOCK, instruments[-1].product_type)
+        apple = [instrument for instrument in instruments if instrument.con_id == '265598'][0]
+        self.assertEqual({'con_id': '265598', 'label': 'APPLE INC', 'symbol': 'AAPL', 'ib_symbol': 'AAPL',
+                          'currency': 'USD', 'product_type': ProductType.STOCK}, apple.as_dict())
+
+    def test_prefetch(self):
+        self.assertEqual(15, ibdataloader.prefetch([ProductType.STOCK, ProductType.ETF], workers=2, page_workers=2))
+
+    def test_url_product_type(self):
+        self.assertEqual(ProductType.STOCK, ibdataloader.url_product_type(
+            'https://www.interactivebrokers.com/en/index.php?f=products&p=stk'))
+        self.assertEqual(ProductType.ETF, ibdataloader.url_product_type(
+            'https://www.interactivebrokers.com/en/index.php?f=2222&exch=arca&showcategories=ETF'))
+        self.assertEqual(ProductType.STOCK, ibdataloader.url_product_type(
+            'https://www.interactivebrokers.com/en/index.php?f=2222&exch=nyse&showcategories=STK&p=&cc=&limit=100'
+            '&page=2'))
+        self.assertIsNone(ibdataloader.url_product_type(
+            'https://www.interactivebrokers.com/en/index.php?f=1562&p=europe'))
+
+    def test_concurrent_same_output(self):
+        product_types = [ProductType.STOCK, ProductType.ETF]
+        sequential = [instrument.as_dict() for instrument in ibdataloader.list_instruments(product_types)]
+        concurrent = [instrument.as_dict() for instrument in ibdataloader.list_instruments(product_types, workers=4)]
+        self.assertEqual(sequential, concurrent)
+
+    def test_parser_processes_same_output(self):
+        product_types = [ProductType.STOCK, ProductType.ETF]
+        sequential = [instrument.as_dict() for instrument in ibdataloader.list_instruments(product_types)]
+        ibdataloader.set_parser_processes(2)
+        try:
+            pooled = [instrument.as_dict()
+                      for instrument in ibdataloader.list_instruments(product_types, workers=2, page_workers=2)]
+
+        finally:
+            ibdataloader.set_parser_processes(0)
+
+        self.assertEqual(sequential, pooled)
+
+    def test_process_instruments(self):
+        results = dict()
+
+        def collect(product_type, currency, instruments):
+            results[(product_type, currency)] = [instrument.con_id for instrument in instruments]
+
+        ibdataloader.process_instruments([ProductType.STOCK, ProductType.ETF], collect, workers=3)
+        self.assertEqual({(ProductType.ETF, 'USD'), (ProductType.STOCK, 'USD'), (ProductType.STOCK, 'GBP'),
+                          (ProductType.STOCK, 'EUR')}, set(results.keys()))
+        self.assertEqual(['4065', '208813719', '265598', '37018770', '13905', '270662', '5049', '8894', '272093',
+                          '4815747'], results[(ProductType.STOCK, 'USD')])
+
+    def test_streaming_same_output(self):
+        product_types = [ProductType.STOCK, ProductType.ETF]
+        expected = list()
+        ibdataloader.process_instruments(product_types, lambda p, c, i: expected.append(
+            (p, c, [instrument.as_dict() for instrument in i])))
+        results = list()
+        ibdataloader.process_instruments(product_types, lambda p, c, i: results.append(
+            (p, c, [instrument.as_dict() for instrument in i])), memory_budget=1000)
+        self.assertEqual(expected, results)
+
+    def test_streaming_emits_product_types_when_complete(self):
+        events = list()
+        load_exchanges_for_product_type = ibdataloader.load_exchanges_for_product_type
+
+        def load_exchanges(product_type):
+            events.append(('loading', product_type))
+            return load_exchanges_for_product_type(product_type)
+
+        ibdataloader.load_exchanges_for_product_type = load_exchanges
+        try:
+            ibdataloader.process_instruments([ProductType.STOCK, ProductType.ETF],
+                                             lambda p, c, i: events.append(('saving', p)), memory_budget=10 ** 6)
+
+        finally:
+            ibdataloader.load_exchanges_for_product_type = load_exchanges_for_product_type
+
+        self.assertEqual([('loading', ProductType.ETF), ('saving', ProductType.ETF), ('loading', ProductType.STOCK),
+                          ('saving', ProductType.STOCK), ('saving', ProductType.STOCK), ('saving', ProductType.STOCK)],
+                         events)
+
+
+class TestPagination(unittest.TestCase):
+
+    _NYSE_URL = 'https://www.interactivebrokers.com/en/index.php?f=2222&exch=nyse&showcategories=STK'
+
+    def setUp(self):
+        self._load_url = ibdataloader.load_url
+        self._pages = load_recorded_pages()
+        self._loaded_urls = list()
+        load_recorded_url = recorded_load_url(self._pages)
+
+        def load_url(url, rejection_marker=None):
+            self._loaded_urls.append(url)
+            return load_recorded_url(url, rejection_marker)
+
+        ibdataloader.load_url = load_url
+
+    def tearDown(self):
+        ibdataloader.load_url = self._load_url
+
+    def test_parse_page_urls(self):
+        html_text = self._pages[self._NYSE_URL]
+        _, next_page_url, current_page, page_urls = ibdataloader.parse_exchange_page('NYSE', html_text)
+        self.assertEqual(self._NYSE_URL + '&p=&cc=&limit=100&page=2', next_page_url)
+        self.assertEqual(1, current_page)
+        self.assertEqual([1, 2, 3], sorted(page_urls.keys()))
+        self.assertEqual(self._NYSE_URL + '&p=&cc=&limit=100&page=3', page_urls[3])
+        no_pages = ibdataloader.parse_exchange_page('NYSE', '<html><body><p>no pages</p></body></html>')
+        self.assertEqual(([], None, None, dict()), no_pages)
+
+    def test_infer_following_page_urls(self):
+        page_urls = {page: self._NYSE_URL + '&page={}'.format(page) for page in (1, 2, 3, 4, 5, 12)}
+        following_page_urls = ibdataloader.infer_following_page_urls(3, page_urls, self._NYSE_URL + '&page=4')
+        self.assertEqual([self._NYSE_URL + '&page={}'.format(page) for page in range(4, 13)], following_page_urls)
+        self.assertEqual([], ibdataloader.infer_following_page_urls(3, page_urls, self._NYSE_URL + '&start=300'))
+        self.assertEqual([], ibdataloader.infer_following_page_urls(12, page_urls, None))
+        page_urls[6] = self._NYSE_URL + '&limit=50&page=6'
+        self.assertEqual([], ibdataloader.infer_following_page_urls(3, page_urls, self._NYSE_URL + '&page=4'))
+
+    def test_parallel_pages_in_order(self):
+        sequential = [instrument.con_id for instrument in ibdataloader.load_for_exchange('NYSE', self._NYSE_URL)]
+        parallel = [instrument.con_id for instrument in ibdataloader.load_for_exchange('NYSE', self._NYSE_URL,
+                                                                                         page_workers=3)]
+        self.assertEqual(['265598', '37018770', '4065', '13905', '5049', '8894', '270662'], sequential)
+        self.assertEqual(sequential, parallel)
+        self.assertEqual(3, len(set(self._loaded_urls)))
+
+    def test_sibling_walking_fallback(self):
+        url = 'https://www.interactivebrokers.com/en/index.php?f=2222&exch=tse'
+        row = ('<tr><td>{0}</td><td><a href="javascript:NewWindow(\'https://contract.ibkr.info/index.php?'
+               'action=Details&amp;conid={1}\',\'Details\');">{0} CORP</a></td><td>{0}</td><td>JPY</td></tr>')
+        pagination = ('<ul class="pagination"><li{}><a href="/en/index.php?f=2222&amp;exch=tse">1</a></li>'
+                      '<li{}><a href="/en/index.php?f=2222&amp;exch=tse&amp;start=100">2</a></li></ul>')
+        self._pages[url] = '<table>' + row.format('SONY', 101) + '</table>' + pagination.format(' class="active"', '')
+        self._pages[url + '&start=100'] = ('<table>' + row.format('TDK', 102) + '</table>' +
+                                           pagination.format('', ' class="active"'))
+        instruments = ibdataloader.load_for_exchange('TSE', url, page_workers=2)
+        self.assertEqual(['101', '102'], [instrument.con_id for instrument in instruments])
+        self.assertEqual([url, url + '&start=100'], self._loaded_urls)
+
+
+if __name__ == '__main__':
+    unittest.main()
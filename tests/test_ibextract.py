@@ -0,0 +1,117 @@
+import logging
+import unittest
+
+import ibextract
+from ibextract import SoupExtractor, LxmlExtractor, ParityExtractor, create_extractor
+from recorded import load_recorded_pages
+
+
+class TestExtractorsParity(unittest.TestCase):
+    """
+    Diffs the lxml extractor against the BeautifulSoup extractor on all the recorded pages.
+    """
+
+    def setUp(self):
+        self._pages = load_recorded_pages()
+        self._reference = SoupExtractor()
+        self._candidate = LxmlExtractor()
+
+    def test_region_links(self):
+        for url, html_text in self._pages.items():
+            for product_type_code in ('stk', 'etf'):
+                self.assertEqual(self._reference.region_links(html_text, product_type_code),
+                                 self._candidate.region_links(html_text, product_type_code), url)
+
+        self.assertEqual([('North America', '/en/index.php?f=1562&p=north_america'),
+                          ('Europe', '/en/index.php?f=1562&p=europe')],
+                         self._candidate.region_links(self._pages[self._url('?f=products&p=stk')], 'stk'))
+
+    def test_exchange_links(self):
+        for url, html_text in self._pages.items():
+            self.assertEqual(self._reference.exchange_links(html_text), self._candidate.exchange_links(html_text), url)
+
+        self.assertEqual([('NYSE', 'index.php?f=2222&exch=nyse&showcategories=STK'),
+                          ('NASDAQ', 'index.php?f=2222&exch=nasdaq&showcategories=STK')],
+                         self._candidate.exchange_links(self._pages[self._url('?f=1562&p=north_america')]))
+
+    def test_exchange_page(self):
+        for url, html_text in self._pages.items():
+            self.assertEqual(self._reference.exchange_page(html_text), self._candidate.exchange_page(html_text), url)
+
+        rows, next_page_href, current_page, page_hrefs = self._candidate.exchange_page(
+            self._pages[self._url('?f=2222&exch=nyse&showcategories=STK')])
+        self.assertEqual(('37018770', 'AT&T INC', 'T', 'T', 'USD'), rows[1])
+        self.assertEqual('/en/index.php?f=2222&exch=nyse&showcategories=STK&p=&cc=&limit=100&page=2', next_page_href)
+        self.assertEqual(1, current_page)
+        self.assertEqual([1, 2, 3], sorted(page_hrefs))
+
+    def test_edge_cases(self):
+        html_texts = [
+            '',
+            '<ul class="pagination pagination-sm"><li><a href="?page=1">1</a></li><!-- spacer -->'
+            '<li class="active"><a href="?page=2">2</a></li></ul>',
+            '<table><tr><td> </td><td><a href="javascript:NewWindow(\'https://contract.ibkr.info/index.php?conid=1\')">'
+            '<b>BOLD</b></a></td><td></td><td>USD</td></tr></table>',
+            '<div id="stk"><a href="/en/a"><span>Nested</span></a><a href="/en/b">Mixed <i>text</i></a></div>',
+        ]
+        for html_text in html_texts:
+            self.assertEqual(self._reference.exchange_page(html_text), self._candidate.exchange_page(html_text))
+            self.assertEqual(self._reference.region_links(html_text, 'stk'),
+                             self._candidate.region_links(html_text, 'stk'))
+
+    def test_parity_extractor(self):
+        parity = create_extractor('parity')
+        for html_text in self._pages.values():
+            parity.exchange_page(html_text)
+
+        self.assertEqual(0, parity.mismatches)
+
+        class BrokenExtractor(LxmlExtractor):
+            name = 'broken'
+
+            def exchange_links(self, html_text):
+                return super().exchange_links(html_text)[1:]
+
+        parity = ParityExtractor(candidate=BrokenExtractor())
+        html_text = self._pages[self._url('?f=1562&p=north_america')]
+        self.assertEqual(self._reference.exchange_links(html_text), parity.exchange_links(html_text))
+        self.assertEqual(1, parity.mismatches)
+
+        class FailingExtractor(LxmlExtractor):
+            name = 'failing'
+
+            def exchange_links(self, html_text):
+                raise ValueError('unexpected markup')
+
+        parity = ParityExtractor(candidate=FailingExtractor())
+        self.assertEqual(self._reference.exchange_links(html_text), parity.exchange_links(html_text))
+        self.assertEqual(1, parity.mismatches)
+
+    def test_worker_mismatches(self):
+        class BrokenExtractor(LxmlExtractor):
+            name = 'broken'
+
+            def exchange_page(self, html_text):
+                rows, next_page_href, current_page, page_hrefs = super().exchange_page(html_text)
+                return rows[1:], next_page_href, current_page, page_hrefs
+
+        html_text = self._pages[self._url('?f=2222&exch=nyse&showcategories=STK')]
+        ibextract.init_worker_extractor('parity')
+        self.assertEqual((self._reference.exchange_page(html_text), 0), ibextract.extract_exchange_page(html_text))
+        ibextract._worker_extractor = ParityExtractor(candidate=BrokenExtractor())
+        for _ in range(2):
+            self.assertEqual((self._reference.exchange_page(html_text), 1),
+                             ibextract.extract_exchange_page(html_text))
+
+        ibextract.init_worker_extractor('lxml')
+        self.assertEqual((self._reference.exchange_page(html_text), 0), ibextract.extract_exchange_page(html_text))
+        ibextract._worker_extractor = None
+
+    @staticmethod
+    def _url(query):
+        return 'https://www.interactivebrokers.com/en/index.php' + query
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+import ibdataloader
+from ibdataloader import Instrument, ProductType
+from instrumentindex import IndexBuilder, InstrumentIndex, InstrumentRecord
+from recorded import load_recorded_pages, recorded_load_url
+
+
+def _instrument(con_id, symbol, exchange, currency='USD'):
+    instrument = Instrument(con_id=con_id, label=symbol + ' INC', exchange=exchange)
+    instrument.symbol = symbol
+    instrument.ib_symbol = symbol.replace('.', ' ')
+    instrument.currency = currency
+    instrument.product_type = ProductType.STOCK
+    return instrument
+
+
+class TestInstrumentIndex(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._index_path = os.path.join(self._temp_dir.name, 'ib-instr.idx')
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_lookups(self):
+        builder = IndexBuilder()
+        for instrument in (_instrument('265598', 'AAPL', 'NASDAQ'), _instrument('9408', 'BRK.B', 'NYSE'),
+                           _instrument('265598', 'AAPL', 'ARCA'), _instrument('38709539', 'AAPL', 'MEXI', 'MXN'),
+                           _instrument('4065', 'ÄNGEL', 'IBIS', 'EUR')):
+            builder.add(instrument)
+
+        builder.write(self._index_path)
+        with InstrumentIndex(self._index_path) as index:
+            self.assertEqual(5, len(index))
+            self.assertEqual([InstrumentRecord('265598', 'AAPL INC', 'AAPL', 'AAPL', 'ARCA', 'USD', 'stk'),
+                              InstrumentRecord('265598', 'AAPL INC', 'AAPL', 'AAPL', 'NASDAQ', 'USD', 'stk')],
+                             index.by_con_id('265598'))
+            self.assertEqual([], index.by_con_id('1'))
+            self.assertEqual(['265598', '265598', '38709539'],
+                             [record.con_id for record in index.by_symbol('AAPL')])
+            self.assertEqual(['38709539'], [record.con_id for record in index.by_symbol('AAPL', currency='MXN')])
+            self.assertEqual(['NASDAQ'], [record.exchange for record in index.by_symbol('AAPL', exchange='NASDAQ')])
+            self.assertEqual(['9408'], [record.con_id for record in index.by_ib_symbol('BRK B')])
+            self.assertEqual([], index.by_ib_symbol('BRK.B'))
+            self.assertEqual([], index.by_symbol('AAP'))
+            self.assertEqual('ÄNGEL', index.by_con_id('4065')[0].symbol)
+
+    def test_crawl(self):
+        load_url = ibdataloader.load_url
+        ibdataloader.load_url = recorded_load_url(load_recorded_pages())
+        builder = IndexBuilder()
+        instruments = list()
+        try:
+            ibdataloader.process_instruments([ProductType.STOCK, ProductType.ETF], lambda p, c, i: instruments.extend(
+                builder.passing_through(p, c, i)))
+
+        finally:
+            ibdataloader.load_url = load_url
+
+        builder.write(self._index_path)
+        with InstrumentIndex(self._index_path) as index:
+            self.assertEqual(len(instruments), len(index))
+            for instrument in instruments:
+                records = index.by_con_id(instrument.con_id)
+                self.assertIn((instrument.label, instrument.symbol, instrument.exchange, instrument.currency,
+                               instrument.product_type.value),
+                              [(record.label, record.symbol, record.exchange, record.currency, record.product_type)
+                               for record in records])
+                self.assertIn(instrument.con_id, [record.con_id for record in index.by_ib_symbol(instrument.ib_symbol)])
+
+    def test_empty(self):
+        IndexBuilder().write(self._index_path)
+        with InstrumentIndex(self._index_path) as index:
+            self.assertEqual(0, len(index))
+            self.assertEqual([], index.by_con_id('265598'))
+            self.assertEqual([], index.by_symbol('AAPL'))
+
+    def test_not_an_index(self):
+        with open(self._index_path, 'wb') as index_file:
+            index_file.write(b'con_id,label\n' * 10)
+
+        self.assertRaises(ValueError, InstrumentIndex, self._index_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
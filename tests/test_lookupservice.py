@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+import aiohttp
+
+from ibdataloader import Instrument, ProductType
+from instrumentindex import IndexBuilder
+from lookupservice import LRUCache, LookupService
+from trigramindex import TrigramIndexBuilder
+
+
+def _write_indexes(index_path, search_index_path, instruments):
+    builder = IndexBuilder()
+    search_builder = TrigramIndexBuilder()
+    for con_id, label, symbol, exchange, currency in instruments:
+        instrument = Instrument(con_id=con_id, label=label, exchange=exchange)
+        instrument.symbol = symbol
+        instrument.ib_symbol = symbol
+        instrument.currency = currency
+        instrument.product_type = ProductType.STOCK
+        builder.add(instrument)
+        search_builder.add(instrument)
+
+    builder.write(index_path)
+    search_builder.write(search_index_path)
+
+
+class TestLookupService(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._index_path = os.path.join(self._temp_dir.name, 'ib-instr.idx')
+        self._search_index_path = os.path.join(self._temp_dir.name, 'ib-instr.tri')
+        _write_indexes(self._index_path, self._search_index_path, [
+            ('265598', 'APPLE INC', 'AAPL', 'NASDAQ', 'USD'), ('272093', 'MICROSOFT CORP', 'MSFT', 'NASDAQ', 'USD'),
+            ('38709539', 'APPLE INC', 'AAPL', 'MEXI', 'MXN')])
+        self._service = LookupService(self._index_path, self._search_index_path, cache_size=2)
+
+    def tearDown(self):
+        self._service.close()
+        self._temp_dir.cleanup()
+
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual((1, None, 3), (cache.get('a'), cache.get('b'), cache.get('c')))
+        self.assertEqual((3, 1), (cache.hits, cache.misses))
+
+    def test_handle(self):
+        status, records = self._service.handle('GET', '/conid/265598', b'')
+        self.assertEqual(200, status)
+        self.assertEqual([{'con_id': '265598', 'label': 'APPLE INC', 'symbol': 'AAPL', 'ib_symbol': 'AAPL',
+                           'exchange': 'NASDAQ', 'currency': 'USD', 'product_type': 'stk'}], records)
+        self.assertEqual(['265598', '38709539'],
+                         [record['con_id'] for record in self._service.handle('GET', '/symbol/AAPL', b'')[1]])
+        self.assertEqual(['38709539'], [record['con_id'] for record in self._service.handle(
+            'GET', '/ib_symbol/AAPL?currency=MXN', b'')[1]])
+        self.assertEqual((200, []), self._service.handle('GET', '/conid/1', b''))
+        self.assertEqual(400, self._service.handle('GET', '/conid/abc', b'')[0])
+        self.assertEqual(404, self._service.handle('GET', '/unknown', b'')[0])
+        self.assertEqual(405, self._service.handle('DELETE', '/conid/265598', b'')[0])
+        self.assertEqual('272093', self._service.handle('GET', '/search?q=microsfot', b'')[1][0]['con_id'])
+
+    def test_batch(self):
+        status, results = self._service.handle('POST', '/batch', json.dumps(
+            {'con_ids': ['265598', '1'], 'symbols': ['MSFT']}).encode('utf-8'))
+        self.assertEqual(200, status)
+        self.assertEqual(1, len(results['con_ids']['265598']))
+        self.assertEqual([], results['con_ids']['1'])
+        self.assertEqual('272093', results['symbols']['MSFT'][0]['con_id'])
+        self.assertEqual(400, self._service.handle('POST', '/batch', b'[1, 2]')[0])
+        self.assertEqual(400, self._service.handle('POST', '/batch', b'{"con_ids": ["x"]}')[0])
+
+    def test_reload(self):
+        self.assertEqual(1, len(self._service.by_con_id('265598')))
+        self.assertFalse(self._service.reload())
+        _write_indexes(self._index_path, self._search_index_path, [('265598', 'APPLE INC', 'AAPL', 'ARCA', 'USD'),
+                                                                   ('265598', 'APPLE INC', 'AAPL', 'NASDAQ', 'USD')])
+        self.assertTrue(self._service.reload())
+        self.assertEqual(2, len(self._service.by_con_id('265598')))
+        self.assertEqual(2, self._service.status()['reloads'])
+
+    def test_http(self):
+        async def requests():
+            started = asyncio.get_running_loop().create_future()
+            server = asyncio.create_task(self._service.serve('127.0.0.1', 0, reload_interval=.05, started=started))
+            port = await started
+            url_base = 'http://127.0.0.1:{}'.format(port)
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(url_base + '/conid/265598') as response:
+                        first = (response.status, await response.json())
+
+                    _write_indexes(self._index_path, self._search_index_path, [
+                        ('265598', 'APPLE INC', 'AAPL', 'ARCA', 'USD')])
+                    await asyncio.sleep(.3)
+                    async with session.get(url_base + '/conid/265598') as response:
+                        second = (response.status, await response.json())
+
+                    async with session.post(url_base + '/batch', json={'con_ids': ['265598']}) as response:
+                        batch = (response.status, await response.json())
+
+                    async with session.get(url_base + '/nothing') as response:
+                        missing = response.status
+
+            finally:
+                server.cancel()
+
+            return first, second, batch, missing
+
+        first, second, batch, missing = asyncio.run(requests())
+        self.assertEqual((200, 'NASDAQ'), (first[0], first[1][0]['exchange']))
+        self.assertEqual((200, 'ARCA'), (second[0], second[1][0]['exchange']))
+        self.assertEqual((200, 'ARCA'), (batch[0], batch[1]['con_ids']['265598'][0]['exchange']))
+        self.assertEqual(404, missing)
+
+    def test_bad_requests(self):
+        async def raw_requests():
+            started = asyncio.get_running_loop().create_future()
+            server = asyncio.create_task(self._service.serve('127.0.0.1', 0, started=started))
+            port = await started
+            statuses = list()
+            try:
+                for request in (b'GARBAGE\r\n\r\n', b'GET /status HTTP/1.1\r\nno colon\r\n\r\n',
+                                b'POST /batch HTTP/1.1\r\nContent-Length: many\r\n\r\n',
+                                b'POST /batch HTTP/1.1\r\nContent-Length: 5000000000\r\n\r\n'):
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                    writer.write(request)
+                    await writer.drain()
+                    # answered, then closed
+                    response = await reader.read()
+                    statuses.append(int(response.split(b' ')[1]))
+                    writer.close()
+
+            finally:
+                server.cancel()
+
+            return statuses
+
+        self.assertEqual([400, 400, 400, 413], asyncio.run(raw_requests()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import aiohttp
+from webscrapetools import keyvalue
+
+import ibasyncloader
+import ibdataloader
+import pagecache
+from cachebackend import SQLiteBackend
+from recorded import RecordedPagesServer
+
+_PAGE_URL = 'https://www.interactivebrokers.com/en/index.php?f=exchanges'
+
+
+class TestPageCache(unittest.TestCase):
+
+    def setUp(self):
+        self._cache_path = tempfile.mkdtemp(prefix='ib-pagecache-test-')
+        self._rate_limiter = ibdataloader.get_rate_limiter()
+        ibdataloader.set_rate_limit(1000., burst=100)
+        pagecache.reset_stats()
+
+    def tearDown(self):
+        pagecache.set_cache_path(None)
+        pagecache.reset_stats()
+        ibdataloader._rate_limiter = self._rate_limiter
+        shutil.rmtree(self._cache_path, ignore_errors=True)
+
+    def _load_twice(self, server):
+        url = server.url_base + '/en/index.php?f=exchanges'
+        return ibdataloader.load_url(url), ibdataloader.load_url(url)
+
+    def test_fresh_entry(self):
+        pagecache.set_cache_path(self._cache_path, expiry_days=20)
+        with RecordedPagesServer({_PAGE_URL: '<html>v1</html>'}, validators=True) as server:
+            self.assertEqual(('<html>v1</html>', '<html>v1</html>'), self._load_twice(server))
+
+        self.assertEqual(1, len(server.requests))
+        self.assertEqual({'miss': 1, 'hit': 1}, pagecache.stats())
+
+    def test_not_modified(self):
+        pagecache.set_cache_path(self._cache_path, expiry_days=0)
+        with RecordedPagesServer({_PAGE_URL: '<html>v1</html>'}, validators=True) as server:
+            self.assertEqual(('<html>v1</html>', '<html>v1</html>'), self._load_twice(server))
+
+        self.assertEqual([200, 304], [status for path, status in server.statuses])
+        first_headers, second_headers = [headers for path, headers in server.requests]
+        self.assertNotIn('If-None-Match', first_headers)
+        self.assertEqual('Mon, 05 Oct 2026 08:00:00 GMT', second_headers['If-Modified-Since'])
+        self.assertEqual({'miss': 1, 'not_modified': 1}, pagecache.stats())
+        page = pagecache.get_page(server.url_base + '/en/index.php?f=exchanges')
+        self.assertEqual('<html>v1</html>', page.content)
+        self.assertEqual(second_headers['If-None-Match'], page.etag)
+
+    def test_sqlite_backend(self):
+        pagecache.set_backend(SQLiteBackend(os.path.join(self._cache_path, 'pages.db')), expiry_days=0)
+        with RecordedPagesServer({_PAGE_URL: '<html>v1</html>'}, validators=True) as server:
+            self.assertEqual(('<html>v1</html>', '<html>v1</html>'), self._load_twice(server))
+            ibdataloader.notify_url_error(server.url_base + '/en/index.php?f=exchanges')
+            self.assertEqual('<html>v1</html>', ibdataloader.load_url(server.url_base + '/en/index.php?f=exchanges'))
+
+        self.assertEqual([200, 304, 200], [status for path, status in server.statuses])
+        self.assertEqual({'miss': 2, 'not_modified': 1}, pagecache.stats())
+
+    def test_content_hash(self):
+        pagecache.set_cache_path(self._cache_path, expiry_days=0)
+        with RecordedPagesServer({_PAGE_URL: '<html>v1</html>'}) as server:
+            self.assertEqual(('<html>v1</html>', '<html>v1</html>'), self._load_twice(server))
+            self.assertEqual({'miss': 1, 'unchanged': 1}, pagecache.stats())
+            server.update_pages({_PAGE_URL: '<html>v2</html>'})
+            self.assertEqual(('<html>v2</html>', '<html>v2</html>'), self._load_twice(server))
+
+        self.assertEqual({'miss': 1, 'unchanged': 2, 'changed': 1}, pagecache.stats())
+        self.assertEqual([200] * 4, [status for path, status in server.statuses])
+
+    def test_entry_without_validators(self):
+        pagecache.set_cache_path(self._cache_path, expiry_days=20)
+        with RecordedPagesServer({_PAGE_URL: '<html>v1</html>'}, validators=True) as server:
+            url = server.url_base + '/en/index.php?f=exchanges'
+            keyvalue.add_to_store(url, b'<html>v1</html>')
+            # stored today, still fresh
+            self.assertEqual(('<html>v1</html>', '<html>v1</html>'), self._load_twice(server))
+
+        self.assertEqual([], server.requests)
+        self.assertEqual({'hit': 2}, pagecache.stats())
+
+    def test_legacy_entry_stored_date(self):
+        backend = SQLiteBackend(os.path.join(self._cache_path, 'pages.db'))
+        pagecache.set_backend(backend, expiry_days=20)
+        with RecordedPagesServer({_PAGE_URL: '<html>v1</html>'}, validators=True) as server:
+            url = server.url_base + '/en/index.php?f=exchanges'
+            backend.put(url, b'<html>v1</html>')
+            stored = (datetime.now() - timedelta(days=30)).timestamp()
+            backend._connection().execute('UPDATE entries SET stored = ? WHERE key = ?', (stored, url))
+            backend._connection().commit()
+            self.assertEqual(datetime.fromtimestamp(stored), pagecache.get_page(url).checked)
+            # stored before the expiry period: revalidated
+            self.assertEqual(('<html>v1</html>', '<html>v1</html>'), self._load_twice(server))
+
+        self.assertEqual({'unchanged': 1, 'hit': 1}, pagecache.stats())
+
+    def test_rejected_page_not_cached(self):
+        pagecache.set_cache_path(self._cache_path, expiry_days=20)
+        with RecordedPagesServer({_PAGE_URL: 'To continue please enter code'}) as server:
+            url = server.url_base + '/en/index.php?f=exchanges'
+            self.assertRaises(RuntimeError, ibdataloader.load_url, url)
+
+        self.assertIsNone(pagecache.get_page(url))
+
+    def test_rejected_count_saved(self):
+        pagecache.set_cache_path(self._cache_path, expiry_days=20)
+        with RecordedPagesServer({_PAGE_URL: 'To continue please enter code'}) as server:
+            self.assertRaises(RuntimeError, ibdataloader.load_url, server.url_base + '/en/index.php?f=exchanges')
+
+        self.assertIsNone(pagecache.load_stats(self._cache_path))
+        pagecache.save_stats(self._cache_path)
+        saved, saved_stats = pagecache.load_stats(self._cache_path)
+        self.assertEqual({'rejected': 1}, saved_stats)
+        self.assertLess(datetime.now() - saved, timedelta(minutes=1))
+
+    def test_summary_and_prune(self):
+        backend = SQLiteBackend(os.path.join(self._cache_path, 'pages.db'))
+        pagecache.set_backend(backend, expiry_days=20)
+        now = datetime.now()
+        urls_ages = {'https://www.interactivebrokers.com/en/index.php?f=products&p=stk': 0,
+                     'https://www.interactivebrokers.com/en/index.php?f=1562&p=europe': 3,
+                     'https://www.interactivebrokers.com/en/index.php?f=2222&exch=lse&showcategories=STK': 10,
+                     'https://www.interactivebrokers.com/en/index.php?f=2222&exch=arca&showcategories=ETF': 100}
+        for url, age in urls_ages.items():
+            backend.put(url, b'<html></html>')
+            stored = (now - timedelta(days=age, hours=1)).timestamp()
+            with backend._connection() as connection:
+                connection.execute('UPDATE entries SET stored = ? WHERE key = ?', (stored, url))
+
+        summary = pagecache.summary(as_of=now)
+        self.assertEqual(4, summary.entries)
+        self.assertEqual(4 * len(b'<html></html>'), summary.size)
+        self.assertEqual([('< 1d', 1), ('1-7d', 1), ('7-30d', 1), ('30-90d', 0), ('>= 90d', 1)], summary.ages)
+
+        self.assertEqual(1, pagecache.prune(url_filter=lambda url: ibdataloader.url_product_type(url) == 'stk',
+                                            older_than=now - timedelta(days=5)))
+        self.assertEqual(1, pagecache.prune(older_than=now - timedelta(days=30)))
+        self.assertEqual(['https://www.interactivebrokers.com/en/index.php?f=1562&p=europe',
+                          'https://www.interactivebrokers.com/en/index.php?f=products&p=stk'], backend.keys())
+        self.assertRaises(ValueError, pagecache.prune)
+
+    def test_notify_url_error(self):
+        pagecache.set_cache_path(self._cache_path, expiry_days=20)
+        with RecordedPagesServer({_PAGE_URL: '<html>v1</html>'}) as server:
+            url = server.url_base + '/en/index.php?f=exchanges'
+            ibdataloader.load_url(url)
+            ibdataloader.notify_url_error(url)
+
+        self.assertIsNone(pagecache.get_page(url))
+
+    def test_async_not_modified(self):
+        pagecache.set_cache_path(self._cache_path, expiry_days=0)
+
+        async def load_twice(url):
+            async with aiohttp.ClientSession() as session:
+                loader = ibasyncloader.AsyncLoader(session)
+                return await loader.load_url(url), await loader.load_url(url)
+
+        with RecordedPagesServer({_PAGE_URL: '<html>v1</html>'}, validators=True) as server:
+            results = asyncio.run(load_twice(server.url_base + '/en/index.php?f=exchanges'))
+
+        self.assertEqual(('<html>v1</html>', '<html>v1</html>'), results)
+        self.assertEqual([200, 304], [status for path, status in server.statuses])
+        self.assertEqual({'miss': 1, 'not_modified': 1}, pagecache.stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+import pyarrow
+import pyarrow.parquet
+
+import ibdataloader
+from ibdataloader import ProductType
+from parquetsink import ParquetSink
+from recorded import load_recorded_pages, recorded_load_url
+from sinks import Sink
+
+
+class TestParquetSink(unittest.TestCase):
+
+    def setUp(self):
+        self._load_url = ibdataloader.load_url
+        ibdataloader.load_url = recorded_load_url(load_recorded_pages())
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._dataset_path = os.path.join(self._temp_dir.name, 'ib-instr.parquet')
+
+    def tearDown(self):
+        ibdataloader.load_url = self._load_url
+        self._temp_dir.cleanup()
+
+    def test_dataset(self):
+        expected = list()
+        ibdataloader.process_instruments([ProductType.STOCK, ProductType.ETF], lambda p, c, i: expected.extend(
+            (p.value, c, instrument.con_id, instrument.exchange) for instrument in i))
+        sink = ParquetSink(self._dataset_path, row_group_size=3)
+        self.assertIsInstance(sink, Sink)
+        ibdataloader.process_instruments([ProductType.STOCK, ProductType.ETF], sink.write, memory_budget=1000)
+
+        table = pyarrow.parquet.read_table(self._dataset_path)
+        self.assertEqual(pyarrow.dictionary(pyarrow.int32(), pyarrow.string()), table.schema.field('exchange').type)
+        self.assertEqual(pyarrow.dictionary(pyarrow.int32(), pyarrow.string()), table.schema.field('currency').type)
+        rows = [(row['product_type'], row['currency'], row['con_id'], row['exchange']) for row in table.to_pylist()]
+        self.assertEqual(sorted(expected), sorted(rows))
+
+        usd_stocks = os.path.join(self._dataset_path, 'product_type=stk', 'currency=USD', 'part-0.parquet')
+        self.assertEqual(4, pyarrow.parquet.ParquetFile(usd_stocks).num_row_groups)
+        gbp = pyarrow.parquet.read_table(self._dataset_path, columns=['con_id'], filters=[('currency', '=', 'GBP')])
+        self.assertEqual(sorted(con_id for _, currency, con_id, _ in expected if currency == 'GBP'),
+                         sorted(gbp.column('con_id').to_pylist()))
+
+    def test_passing_through(self):
+        sink = ParquetSink(self._dataset_path)
+        batches = list()
+
+        def results_writer(product_type, currency, instruments):
+            batches.append([instrument.con_id for instrument in sink.passing_through(product_type, currency,
+                                                                                       instruments)])
+
+        ibdataloader.process_instruments([ProductType.ETF], results_writer)
+        table = pyarrow.parquet.read_table(self._dataset_path)
+        self.assertEqual(batches, [table.column('con_id').to_pylist()])
+
+    def test_interrupted_bucket(self):
+        sink = ParquetSink(self._dataset_path)
+
+        def results_writer(product_type, currency, instruments):
+            for count, _ in enumerate(sink.passing_through(product_type, currency, instruments)):
+                if count == 1:
+                    raise RuntimeError('disk full')
+
+        self.assertRaises(RuntimeError, ibdataloader.process_instruments, [ProductType.ETF], results_writer)
+        self.assertEqual([], [filenames for _, _, filenames in os.walk(self._dataset_path) if filenames])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+from collections import Counter
+
+import ibdataloader
+import ibextract
+from ibdataloader import ProductType
+from parsecache import ParseCache
+from recorded import load_recorded_pages, recorded_load_url
+
+
+class CountingExtractor(ibextract.LxmlExtractor):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+
+    def region_links(self, html_text, product_type_code):
+        self.calls['region_links'] += 1
+        return super().region_links(html_text, product_type_code)
+
+    def exchange_links(self, html_text):
+        self.calls['exchange_links'] += 1
+        return super().exchange_links(html_text)
+
+    def exchange_page(self, html_text):
+        self.calls['exchange_page'] += 1
+        return super().exchange_page(html_text)
+
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._extractor = ibdataloader._extractor
+        self._load_url = ibdataloader.load_url
+
+    def tearDown(self):
+        ibdataloader._extractor = self._extractor
+        ibdataloader.load_url = self._load_url
+        ibdataloader.set_parse_cache(None)
+        ibdataloader.set_parser_processes(0)
+        self._temp_dir.cleanup()
+
+    def test_entries(self):
+        cache = ParseCache(self._temp_dir.name)
+        exchange_page = ([('265598', 'APPLE INC', 'AAPL', 'AAPL', 'USD')], '/en/page2', 1, {1: '/en/page1'})
+        key = cache.key('exchange_page', 'lxml-1', '<html></html>')
+        self.assertNotEqual(key, cache.key('exchange_page', 'lxml-2', '<html></html>'))
+        self.assertNotEqual(key, cache.key('exchange_page', 'lxml-1', '<html> </html>'))
+        self.assertNotEqual(cache.key('region_links', 'lxml-1', '<html></html>', 'stk'),
+                            cache.key('region_links', 'lxml-1', '<html></html>', 'etf'))
+        self.assertIsNone(cache.lookup(key))
+        cache.put(key, exchange_page)
+        self.assertEqual(exchange_page, cache.lookup(key))
+        self.assertEqual({'hit': 1, 'miss': 1}, cache.stats())
+        self.assertEqual(None, ParseCache(self._temp_dir.name).cached('region_links', 'lxml-1', lambda h, c: None,
+                                                                      '<html></html>', 'stk'))
+
+    def test_corrupted_entry(self):
+        cache = ParseCache(self._temp_dir.name)
+        key = cache.key('exchange_links', 'lxml-1', '<html></html>')
+        cache.put(key, [('NYSE', 'index.php?f=2222&exch=nyse')])
+        with open(os.path.join(self._temp_dir.name, key[:2], key), 'wb') as entry_file:
+            entry_file.write(b'garbage')
+
+        self.assertEqual([], cache.cached('exchange_links', 'lxml-1', lambda html_text: [], '<html></html>'))
+
+    def _process_instruments(self):
+        results = dict()
+        ibdataloader.process_instruments([ProductType.STOCK, ProductType.ETF],
+                                         lambda p, c, i: results.update({(p, c): [x.as_dict() for x in i]}))
+        return results
+
+    def test_warm_run_skips_parsing(self):
+        ibdataloader.load_url = recorded_load_url(load_recorded_pages())
+        expected = self._process_instruments()
+        ibdataloader._extractor = CountingExtractor()
+        ibdataloader.set_parse_cache(ParseCache(self._temp_dir.name))
+        self.assertEqual(expected, self._process_instruments())
+        self.assertEqual({'region_links': 2, 'exchange_links': 3, 'exchange_page': 7},
+                         ibdataloader._extractor.calls)
+        ibdataloader._extractor.calls.clear()
+        self.assertEqual(expected, self._process_instruments())
+        self.assertEqual({}, ibdataloader._extractor.calls)
+        self.assertEqual({'hit': 12, 'miss': 12}, ibdataloader.get_parse_cache().stats())
+
+    def test_parity_not_cached(self):
+        ibdataloader.load_url = recorded_load_url(load_recorded_pages())
+        expected = self._process_instruments()
+        candidate = CountingExtractor()
+        ibdataloader._extractor = ibextract.ParityExtractor(candidate=candidate)
+        ibdataloader.set_parse_cache(ParseCache(self._temp_dir.name))
+        for _ in range(2):
+            self.assertEqual(expected, self._process_instruments())
+
+        # compared on every run
+        self.assertEqual({'region_links': 4, 'exchange_links': 6, 'exchange_page': 14}, candidate.calls)
+        self.assertEqual({}, ibdataloader.get_parse_cache().stats())
+
+    def test_parser_processes(self):
+        ibdataloader.load_url = recorded_load_url(load_recorded_pages())
+        expected = self._process_instruments()
+        ibdataloader.set_parse_cache(ParseCache(self._temp_dir.name))
+        ibdataloader.set_parser_processes(2)
+        self.assertEqual(expected, self._process_instruments())
+        self.assertEqual(expected, self._process_instruments())
+        self.assertEqual({'hit': 12, 'miss': 12}, ibdataloader.get_parse_cache().stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import csv
+import gzip
+import os
+import tempfile
+import threading
+import unittest
+
+import ibdataloader
+from fakesheets import FakeSheetsSession, fake_client
+from ibdataloader import ProductType
+from pipeline import BucketAborted, Pipeline
+from recorded import load_recorded_pages, recorded_load_url
+from sinks import CsvSink, GzipCsvSink, Sink, SheetsSink, bucket_filename
+
+
+class RecordingSink(Sink):
+
+    def __init__(self):
+        self.buckets = list()
+        self.closed = False
+
+    def write(self, product_type, currency, instruments):
+        self.buckets.append((product_type, currency, [instrument.con_id for instrument in instruments]))
+
+    def close(self):
+        self.closed = True
+
+
+class FailingSink(Sink):
+
+    def __init__(self):
+        self.closed = False
+
+    def write(self, product_type, currency, instruments):
+        next(iter(instruments))
+        raise IOError('disk full')
+
+    def close(self):
+        self.closed = True
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self._load_url = ibdataloader.load_url
+        ibdataloader.load_url = recorded_load_url(load_recorded_pages())
+        self._temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        ibdataloader.load_url = self._load_url
+        self._temp_dir.cleanup()
+
+    def test_sinks(self):
+        expected = list()
+        ibdataloader.process_instruments([ProductType.STOCK, ProductType.ETF], lambda p, c, i: expected.append(
+            (p, c, [instrument.con_id for instrument in i])))
+
+        session = FakeSheetsSession()
+        session.create('stk-sheet', ['Sheet1'])
+        recording_sink = RecordingSink()
+        csv_sink = CsvSink(self._temp_dir.name, 'ib-instr')
+        sheets_sink = SheetsSink(fake_client(session), {'stk': 'stk-sheet'}, clean=True)
+        with Pipeline([recording_sink, csv_sink, sheets_sink], queue_size=2, chunk_size=5) as pipeline:
+            ibdataloader.process_instruments([ProductType.STOCK, ProductType.ETF], pipeline, memory_budget=1000)
+
+        self.assertTrue(recording_sink.closed)
+        self.assertEqual(sorted(expected), sorted(recording_sink.buckets))
+        for product_type, currency, con_ids in expected:
+            path = os.path.join(self._temp_dir.name, bucket_filename('ib-instr', product_type, currency))
+            with open(path, 'rt', newline='') as csv_file:
+                # every instrument of the bucket, first one included
+                self.assertEqual(con_ids, [row['con_id'] for row in csv.DictReader(csv_file)])
+
+        stock_currencies = sorted(currency.lower() for product_type, currency, _ in expected
+                                  if product_type == ProductType.STOCK)
+        spreadsheet = session.spreadsheets['stk-sheet']
+        self.assertEqual(stock_currencies, sorted(properties['title'] for properties in spreadsheet.sheets))
+        usd_rows = spreadsheet.rows('usd')
+        self.assertEqual(['conid', 'symbol', 'ib_symbol', 'label'], usd_rows[0])
+        self.assertEqual([con_ids for product_type, currency, con_ids in expected
+                          if product_type == ProductType.STOCK and currency == 'USD'][0],
+                         [row[0] for row in usd_rows[1:]])
+
+    def test_abstract_sink(self):
+        class IncompleteSink(Sink):
+
+            def close(self):
+                pass
+
+        self.assertRaises(TypeError, IncompleteSink)
+
+    def test_gzip_csv(self):
+        sink = GzipCsvSink(self._temp_dir.name, 'ib-instr')
+        instruments = list(ibdataloader.list_instruments([ProductType.ETF]))
+        sink.write(ProductType.ETF, 'USD', instruments)
+        path = os.path.join(self._temp_dir.name, bucket_filename('ib-instr', ProductType.ETF, 'USD', '.csv.gz'))
+        with gzip.open(path, 'rt', newline='') as csv_file:
+            self.assertEqual([instrument.con_id for instrument in instruments],
+                             [row['con_id'] for row in csv.DictReader(csv_file)])
+
+    def test_failing_sink(self):
+        recording_sink = RecordingSink()
+        failing_sink = FailingSink()
+        pipeline = Pipeline([failing_sink, recording_sink], queue_size=1, chunk_size=1)
+        pipeline(ProductType.STOCK, 'USD', ibdataloader.list_instruments([ProductType.STOCK]))
+        thread = threading.Thread(target=self.assertRaises, args=(RuntimeError, pipeline.close))
+        thread.start()
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(failing_sink.closed)
+        self.assertTrue(recording_sink.closed)
+        self.assertEqual(1, len(recording_sink.buckets))
+        # further buckets are refused once a sink failed
+        self.assertRaises(RuntimeError, pipeline, ProductType.ETF, 'USD', [])
+
+    def test_failed_crawl(self):
+        session = FakeSheetsSession()
+        session.create('stk-sheet', ['usd', 'eur', 'chf'])
+        recording_sink = RecordingSink()
+        sheets_sink = SheetsSink(fake_client(session), {'stk': 'stk-sheet'}, clean=True)
+        with self.assertRaises(ValueError):
+            with Pipeline([recording_sink, sheets_sink]) as pipeline:
+                pipeline(ProductType.STOCK, 'USD', ibdataloader.list_instruments([ProductType.STOCK]))
+                raise ValueError('crawl interrupted')
+
+        # only part of the currencies were uploaded: none of the other worksheets is removed
+        self.assertFalse(recording_sink.closed)
+        self.assertEqual(['usd', 'eur', 'chf'], [properties['title']
+                                                 for properties in session.spreadsheets['stk-sheet'].sheets])
+
+        # nor after an aborted bucket
+        def instruments():
+            yield from ibdataloader.list_instruments([ProductType.STOCK])
+            raise RuntimeError('connection lost')
+
+        with Pipeline([sheets_sink]) as pipeline:
+            self.assertRaises(RuntimeError, pipeline, ProductType.STOCK, 'EUR', instruments())
+
+        self.assertEqual(['usd', 'eur', 'chf'], [properties['title']
+                                                 for properties in session.spreadsheets['stk-sheet'].sheets])
+
+    def test_failed_crawl_failed_sink(self):
+        # the error of the crawl is not replaced by the one of the sink
+        with self.assertRaises(ValueError):
+            with Pipeline([FailingSink()], queue_size=1, chunk_size=1) as pipeline:
+                pipeline(ProductType.STOCK, 'USD', ibdataloader.list_instruments([ProductType.STOCK]))
+                raise ValueError('crawl interrupted')
+
+    def test_aborted_bucket(self):
+        recording_sink = RecordingSink()
+        aborted = list()
+
+        class AbortedSink(Sink):
+
+            def write(self, product_type, currency, instruments):
+                try:
+                    list(instruments)
+
+                except BucketAborted:
+                    aborted.append(currency)
+                    raise
+
+        def instruments():
+            yield from ibdataloader.list_instruments([ProductType.ETF])
+            raise RuntimeError('connection lost')
+
+        with Pipeline([AbortedSink(), recording_sink], chunk_size=2) as pipeline:
+            self.assertRaises(RuntimeError, pipeline, ProductType.ETF, 'USD', instruments())
+            pipeline(ProductType.ETF, 'EUR', [])
+
+        self.assertEqual(['USD'], aborted)
+        self.assertEqual([(ProductType.ETF, 'EUR', [])], recording_sink.buckets)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import threading
+import time
+import unittest
+
+from ratelimit import TokenBucket, HostRateLimiter
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_throttled(self):
+        bucket = TokenBucket(rate=100., capacity=2.)
+        self.assertEqual(0., bucket.reserve())
+        self.assertEqual(0., bucket.reserve())
+        self.assertAlmostEqual(0.01, bucket.reserve(), delta=0.002)
+        self.assertAlmostEqual(0.02, bucket.reserve(), delta=0.002)
+
+    def test_rate_shared_between_threads(self):
+        bucket = TokenBucket(rate=50., capacity=1.)
+        start = time.monotonic()
+        threads = [threading.Thread(target=bucket.acquire) for _ in range(11)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        # first token is immediately available, the 10 others are refilled at 50 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_invalid_rate(self):
+        self.assertRaises(ValueError, TokenBucket, 0.)
+
+
+class TestHostRateLimiter(unittest.TestCase):
+
+    def test_one_bucket_per_host(self):
+        limiter = HostRateLimiter(rate=1.)
+        bucket = limiter.bucket('https://www.interactivebrokers.com/en/index.php?f=products&p=stk')
+        self.assertIs(bucket, limiter.bucket('https://www.interactivebrokers.com/en/index.php?f=1562'))
+        self.assertIsNot(bucket, limiter.bucket('https://contract.ibkr.info/index.php'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import csv
+import gzip
+import io
+import os
+import unittest
+
+import boto3
+from moto import mock_aws
+
+from ibdataloader import Instrument, ProductType
+from pipeline import Pipeline
+from s3sink import MIN_PART_SIZE, S3Sink
+
+
+def make_instruments(count, label_size=100):
+    instruments = list()
+    for number in range(count):
+        instrument = Instrument(str(100000000 + number), 'INSTRUMENT {} '.format(number).ljust(label_size, 'X'),
+                                'NYSE')
+        instrument.symbol = 'SYM{}'.format(number)
+        instrument.ib_symbol = 'SYM.{}'.format(number)
+        instrument.currency = 'USD'
+        instrument.product_type = ProductType.STOCK
+        instruments.append(instrument)
+
+    return instruments
+
+
+class TestS3Sink(unittest.TestCase):
+
+    def setUp(self):
+        self._environ = dict(os.environ)
+        os.environ.update({'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing',
+                           'AWS_DEFAULT_REGION': 'us-east-1'})
+        self._mock = mock_aws()
+        self._mock.start()
+        self._client = boto3.client('s3', region_name='us-east-1')
+        self._client.create_bucket(Bucket='ib-data')
+
+    def tearDown(self):
+        self._mock.stop()
+        os.environ.clear()
+        os.environ.update(self._environ)
+
+    def _rows(self, key, compressed=False):
+        body = self._client.get_object(Bucket='ib-data', Key=key)['Body'].read()
+        if compressed:
+            body = gzip.decompress(body)
+
+        return list(csv.reader(io.StringIO(body.decode('utf-8'), newline='')))
+
+    def test_multipart(self):
+        instruments = make_instruments(100000)
+        sink = S3Sink('ib-data', prefix='daily/ib-instr', client=self._client, part_size=MIN_PART_SIZE, workers=3)
+        sink.write(ProductType.STOCK, 'USD', instruments)
+        sink.close()
+
+        key = 'daily/ib-instr_usd_stk.csv'
+        # over 12 MB: 3 parts
+        self.assertTrue(self._client.head_object(Bucket='ib-data', Key=key)['ETag'].endswith('-3"'))
+        rows = self._rows(key)
+        self.assertEqual(list(Instrument.fields), rows[0])
+        self.assertEqual([list(instrument.as_tuple()) for instrument in instruments], rows[1:])
+
+    def test_compressed(self):
+        instruments = make_instruments(1000)
+        sink = S3Sink('ib-data', client=self._client, workers=1, compress=True)
+        with Pipeline([sink]) as pipeline:
+            pipeline(ProductType.STOCK, 'USD', instruments)
+            pipeline(ProductType.ETF, 'EUR', [])
+
+        rows = self._rows('ib-instr_usd_stk.csv.gz', compressed=True)
+        self.assertEqual(1001, len(rows))
+        self.assertEqual(instruments[-1].con_id, rows[-1][0])
+        self.assertEqual([list(Instrument.fields)], self._rows('ib-instr_eur_etf.csv.gz', compressed=True))
+
+    def test_aborted(self):
+        def instruments():
+            yield from make_instruments(60000)
+            raise RuntimeError('connection lost')
+
+        sink = S3Sink('ib-data', client=self._client, part_size=MIN_PART_SIZE, workers=2)
+        self.assertRaises(RuntimeError, sink.write, ProductType.STOCK, 'USD', instruments())
+        sink.close()
+        self.assertEqual(0, self._client.list_objects_v2(Bucket='ib-data')['KeyCount'])
+        self.assertEqual([], self._client.list_multipart_uploads(Bucket='ib-data').get('Uploads', []))
+
+    def test_part_size(self):
+        self.assertRaises(ValueError, S3Sink, 'ib-data', client=self._client, part_size=1024 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
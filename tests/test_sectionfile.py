@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+from array import array
+
+from sectionfile import SectionFile, write_sections
+
+
+class TestSectionFile(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._temp_dir.name, 'sections.idx')
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_sections(self):
+        sections = [array('q', [-1, 2, 3]).tobytes(), b'abcde', array('I', [7, 8]).tobytes(), b'']
+        write_sections(self._path, b'TESTS001', (3, 5), sections)
+        with SectionFile(self._path, b'TESTS001', 2, 4, 'a test file') as section_file:
+            self.assertEqual([3, 5], section_file._header_values)
+            for offset in section_file._section_offsets:
+                self.assertEqual(0, offset % 8)
+
+            self.assertEqual([-1, 2, 3], section_file._section(0, 3, 'q').tolist())
+            self.assertEqual(b'abcde', section_file._section(1, 5, 'B').tobytes())
+            self.assertEqual([7, 8], section_file._section(2, 2, 'I').tolist())
+            self.assertEqual([], section_file._section(3, 0, 'Q').tolist())
+
+        self.assertEqual(['sections.idx'], os.listdir(self._temp_dir.name))
+
+    def test_other_format(self):
+        write_sections(self._path, b'TESTS001', (1,), [b'x'])
+        self.assertRaises(ValueError, SectionFile, self._path, b'TESTS002', 1, 1, 'a test file')
+        with open(self._path, 'wb') as section_file:
+            section_file.write(b'TESTS001')
+
+        self.assertRaises(ValueError, SectionFile, self._path, b'TESTS001', 1, 1, 'a test file')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import time
+import unittest
+
+from gspread.exceptions import APIError
+
+import gservices
+from fakesheets import FakeSheetsSession, fake_client
+from sheetsquota import QuotaScheduler
+
+_HEADER = ('conid', 'symbol', 'ib_symbol', 'label')
+_ROWS = [{'conid': '265598', 'symbol': 'AAPL', 'ib_symbol': 'AAPL', 'label': 'APPLE INC'},
+         {'conid': '272093', 'symbol': 'MSFT', 'ib_symbol': 'MSFT', 'label': 'MICROSOFT CORP'}]
+
+
+class TestQuotaScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self._session = FakeSheetsSession()
+        self._spreadsheet = self._session.create('stk', ['usd', 'eur'])
+        self._client = fake_client(self._session)
+
+    def test_counts_api_calls(self):
+        scheduler = QuotaScheduler(quota=1000, period=1., burst=100)
+        scheduler.install(self._client)
+        worksheet = gservices.update_spreadsheet(self._client, 'stk', 'usd', _ROWS, _HEADER)
+        gservices.auto_resize_column(worksheet, 4)
+        self.assertEqual(len(self._session.requests), scheduler.count_calls)
+        self.assertEqual(0, scheduler.count_retries)
+        self.assertEqual([list(_HEADER), ['265598', 'AAPL', 'AAPL', 'APPLE INC'],
+                          ['272093', 'MSFT', 'MSFT', 'MICROSOFT CORP']], self._spreadsheet.rows('usd'))
+        self.assertEqual(['eur', 'usd'], [properties['title'] for properties in self._spreadsheet.sheets])
+
+    def test_quota_rate(self):
+        scheduler = QuotaScheduler(quota=12, period=.5, burst=2)
+        scheduler.install(self._client)
+        start = time.monotonic()
+        for _ in range(7):
+            gservices.get_spreadsheet(self._client, 'stk')
+
+        # 2 calls per spreadsheet opened: the first 2 within the burst, the 12 others at 20 per second
+        self.assertEqual(14, scheduler.count_calls)
+        self.assertGreaterEqual(time.monotonic() - start, .55)
+
+    def test_retry_on_quota_exceeded(self):
+        scheduler = QuotaScheduler(quota=1000, period=1., burst=100, initial_backoff=.01)
+        scheduler.install(self._client)
+        self._session.fail_next(429, 429, 429)
+        worksheet = gservices.update_spreadsheet(self._client, 'stk', 'chf', _ROWS, _HEADER)
+        self.assertEqual('chf', worksheet.title)
+        self.assertEqual(3, scheduler.count_retries)
+        self.assertEqual(len(self._session.requests), scheduler.count_calls)
+        # backoff doubling from .01s, with up to 50% jitter
+        self.assertGreaterEqual(scheduler.time_waited, .07)
+        self.assertEqual(3, len(self._spreadsheet.rows('chf')))
+
+    def test_gives_up(self):
+        scheduler = QuotaScheduler(quota=1000, period=1., burst=100, max_retries=2, initial_backoff=.01)
+        scheduler.install(self._client)
+        self._session.fail_next(429, 429, 429)
+        with self.assertRaises(APIError):
+            gservices.get_spreadsheet(self._client, 'stk')
+
+        self.assertEqual(2, scheduler.count_retries)
+
+    def test_other_errors_not_retried(self):
+        scheduler = QuotaScheduler(quota=1000, period=1., burst=100, initial_backoff=.01)
+        scheduler.install(self._client)
+        self._session.fail_next(500)
+        self.assertRaises(APIError, gservices.get_spreadsheet, self._client, 'stk')
+        self.assertEqual((1, 0), (scheduler.count_calls, scheduler.count_retries))
+
+    def test_clean_spreadsheet(self):
+        scheduler = QuotaScheduler(quota=1000, period=1., burst=100)
+        scheduler.install(self._client)
+        self._session.create('etf', ['usd', 'old_usd', 'gbp'])
+        gservices.clean_spreadsheet(self._client, 'etf', {'usd'})
+        self.assertEqual(['usd'], [properties['title'] for properties in self._session.spreadsheets['etf'].sheets])
+        # opening (2 calls), listing the worksheets once, 2 deletions
+        self.assertEqual(5, scheduler.count_calls)
+
+    def test_invalid_burst(self):
+        self.assertRaises(ValueError, QuotaScheduler, quota=10, burst=10)
+        self.assertRaises(ValueError, QuotaScheduler, quota=1)
+
+    def test_default_burst_small_quota(self):
+        # the default burst is lowered below the quota
+        for quota, burst in ((2, 1), (10, 9), (11, 10), (100, 10)):
+            self.assertEqual(burst, QuotaScheduler(quota=quota, period=1.)._bucket.capacity)
+
+
+if __name__ == '__main__':
+    unittest.main()
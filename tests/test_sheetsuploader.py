@@ -0,0 +1,100 @@
+import os
+import tempfile
+import time
+import unittest
+
+from fakesheets import FakeSheetsSession, fake_client
+from ibdataloader import Instrument, ProductType
+from sheetsquota import QuotaScheduler
+from sheetsuploader import UploadTask, upload_spreadsheets
+from sinks import SHEET_COLUMNS, CsvSink, bucket_filename
+
+
+def _instruments(product_type, currency, label):
+    for number in range(20):
+        instrument = Instrument(str(number), label, 'SMART')
+        instrument.symbol = currency + str(number)
+        instrument.ib_symbol = product_type.value.upper() + str(number)
+        instrument.currency = currency
+        instrument.product_type = product_type
+        yield instrument
+
+
+class TestUploadSpreadsheets(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._session = FakeSheetsSession()
+        self._client = fake_client(self._session)
+        self._tasks = list()
+        # files as written by load-ib.py
+        sink = CsvSink(self._temp_dir.name, 'ib-instr')
+        for spreadsheet_id in ('stk', 'etf', 'fut'):
+            self._session.create(spreadsheet_id, ['usd', 'zar'])
+            for currency in ('usd', 'eur', 'chf'):
+                product_type = ProductType(spreadsheet_id)
+                path = os.path.join(self._temp_dir.name, bucket_filename('ib-instr', product_type, currency.upper()))
+                sink.write(product_type, currency.upper(), _instruments(product_type, currency.upper(), path))
+                self._tasks.append(UploadTask(spreadsheet_id, currency, path))
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _titles(self, spreadsheet_id):
+        return [properties['title'] for properties in self._session.spreadsheets[spreadsheet_id].sheets]
+
+    def test_upload(self):
+        kept_worksheets = {spreadsheet_id: {'usd', 'eur', 'chf'} for spreadsheet_id in ('stk', 'etf', 'fut', 'ind')}
+        self._session.create('ind', ['usd', 'hkd'])
+        results = upload_spreadsheets(self._client, self._tasks, SHEET_COLUMNS, workers=3, kept_worksheets=kept_worksheets)
+        self.assertEqual(['stk', 'etf', 'fut', 'ind'], [result.spreadsheet_id for result in results])
+        self.assertEqual([(3, 60, ['zar'])] * 3 + [(0, 0, ['hkd'])],
+                         [(result.worksheets, result.rows, result.removed) for result in results])
+        for spreadsheet_id in ('stk', 'etf', 'fut'):
+            self.assertEqual(['usd', 'eur', 'chf'], self._titles(spreadsheet_id))
+            rows = self._session.spreadsheets[spreadsheet_id].rows('eur')
+            self.assertEqual(21, len(rows))
+            self.assertEqual([column for column, _ in SHEET_COLUMNS], rows[0])
+            self.assertEqual(['19', 'EUR19', spreadsheet_id.upper() + '19'], rows[-1][:3])
+
+        self.assertEqual(['usd'], self._titles('ind'))
+        # per spreadsheet: worksheet properties fetched once, one batch per worksheet, one batch for cleaning up
+        self.assertEqual(3 * 5 + 2, len(self._session.requests))
+
+    def test_delta(self):
+        upload_spreadsheets(self._client, self._tasks, SHEET_COLUMNS, workers=2)
+        self._session.requests.clear()
+        results = upload_spreadsheets(self._client, self._tasks, SHEET_COLUMNS, workers=2, delta=True)
+        self.assertEqual([0, 0, 0], [result.rows for result in results])
+        # per spreadsheet: worksheet properties, then the values of each worksheet
+        self.assertEqual(3 * 4, len(self._session.requests))
+
+    def test_missing_field(self):
+        with open(self._tasks[0].path, 'wt', newline='') as csv_file:
+            csv_file.write('conid,symbol,ib_symbol,label\r\n1,A,A,ALPHA\r\n')
+
+        self.assertRaises(KeyError, upload_spreadsheets, self._client, self._tasks[:1], SHEET_COLUMNS)
+        self.assertEqual(['usd', 'zar'], self._titles('stk'))
+
+    def test_shared_quota(self):
+        self._session.latency = .02
+        start = time.monotonic()
+        upload_spreadsheets(self._client, self._tasks, SHEET_COLUMNS, workers=1)
+        sequential = time.monotonic() - start
+
+        start = time.monotonic()
+        upload_spreadsheets(self._client, self._tasks, SHEET_COLUMNS, workers=3)
+        parallel = time.monotonic() - start
+        self.assertLess(parallel, sequential * .6)
+
+        # 12 calls in total: the first 2 within the burst, then 10 more at 20 per second
+        scheduler = QuotaScheduler(quota=22, period=1., burst=2)
+        scheduler.install(self._client)
+        start = time.monotonic()
+        upload_spreadsheets(self._client, self._tasks, SHEET_COLUMNS, workers=3)
+        self.assertEqual(12, scheduler.count_calls)
+        self.assertGreaterEqual(time.monotonic() - start, .45)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import csv
+import os
+import random
+import tempfile
+import unittest
+
+import snapshotdiff
+
+_FIELDS = ['con_id', 'label', 'symbol', 'ib_symbol', 'currency', 'product_type']
+
+
+def _write_snapshot(directory, currency, product_type_code, rows):
+    path = os.path.join(directory, 'ib-instr_{}_{}.csv'.format(currency, product_type_code))
+    with open(path, 'wt', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(_FIELDS)
+        writer.writerows(rows)
+
+
+def _read_csv(path):
+    with open(path, 'rt', newline='') as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+class TestSnapshotDiff(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._previous_dir = os.path.join(self._temp_dir.name, 'previous')
+        self._current_dir = os.path.join(self._temp_dir.name, 'current')
+        os.makedirs(self._previous_dir)
+        os.makedirs(self._current_dir)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_diff_snapshots(self):
+        _write_snapshot(self._previous_dir, 'usd', 'stk', [
+            ('265598', 'APPLE INC', 'AAPL', 'AAPL', 'USD', 'stk'),
+            ('4815747', 'NVIDIA CORP', 'NVDA', 'NVDA', 'USD', 'stk'),
+            ('76792991', 'TESLA INC', 'TSLA', 'TSLA', 'USD', 'stk'),
+        ])
+        _write_snapshot(self._current_dir, 'usd', 'stk', [
+            ('265598', 'APPLE INC', 'AAPL', 'AAPL', 'USD', 'stk'),
+            ('76792991', 'TESLA INC.', 'TSLA', 'TSLA', 'USD', 'stk'),
+            ('208813719', 'ALPHABET INC-CL A', 'GOOGL', 'GOOGL', 'USD', 'stk'),
+            ('265598', 'APPLE INC', 'AAPL', 'AAPL', 'USD', 'stk'),
+        ])
+        _write_snapshot(self._previous_dir, 'eur', 'stk', [('14094', 'BASF SE', 'BAS', 'BAS', 'EUR', 'stk')])
+        _write_snapshot(self._current_dir, 'gbp', 'etf', [('37929', 'ISHARES FTSE 100', 'ISF', 'ISF', 'GBP', 'etf')])
+        output_dir = os.path.join(self._temp_dir.name, 'delta')
+        summary = snapshotdiff.diff_snapshots(self._previous_dir, self._current_dir, output_dir)
+        self.assertEqual([('etf', 'gbp', 0, 1, 1, 0, 0), ('stk', 'eur', 1, 0, 0, 1, 0), ('stk', 'usd', 3, 4, 1, 1, 1)],
+                         [tuple(row[field] for field in snapshotdiff.SUMMARY_FIELDS) for row in summary])
+        self.assertEqual([{field: str(row[field]) for field in snapshotdiff.SUMMARY_FIELDS} for row in summary],
+                         _read_csv(os.path.join(output_dir, 'ib-instr_delta-summary.csv')))
+
+        delta = _read_csv(os.path.join(output_dir, 'ib-instr_delta_usd_stk.csv'))
+        self.assertEqual([('added', '208813719', ''), ('removed', '4815747', ''), ('changed', '76792991', 'label')],
+                         [(row['change'], row['con_id'], row['changed_fields']) for row in delta])
+        self.assertEqual('TESLA INC.', delta[2]['label'])
+        self.assertEqual('NVIDIA CORP', delta[1]['label'])
+        delta = _read_csv(os.path.join(output_dir, 'ib-instr_delta_eur_stk.csv'))
+        self.assertEqual([('removed', '14094', 'BASF SE')], [(row['change'], row['con_id'], row['label'])
+                                                             for row in delta])
+
+    def test_product_type_filter(self):
+        _write_snapshot(self._previous_dir, 'eur', 'stk', [('14094', 'BASF SE', 'BAS', 'BAS', 'EUR', 'stk')])
+        _write_snapshot(self._current_dir, 'gbp', 'etf', [('37929', 'ISHARES FTSE 100', 'ISF', 'ISF', 'GBP', 'etf')])
+        summary = snapshotdiff.diff_snapshots(self._previous_dir, self._current_dir, self._temp_dir.name,
+                                              product_type_codes=['etf'])
+        self.assertEqual([('etf', 'gbp')], [(row['product_type'], row['currency']) for row in summary])
+
+    def test_spilled_merge(self):
+        con_ids = random.sample(range(1, 10 ** 7), 3000)
+        previous_rows = [(str(con_id), 'LABEL {}'.format(con_id), 'S', 'S', 'USD', 'stk') for con_id in con_ids[:2000]]
+        current_rows = [(str(con_id), 'LABEL {}'.format(con_id % 1000), 'S', 'S', 'USD', 'stk')
+                        for con_id in con_ids[1000:]]
+        _write_snapshot(self._previous_dir, 'usd', 'stk', previous_rows)
+        _write_snapshot(self._current_dir, 'usd', 'stk', current_rows)
+        delta_path = os.path.join(self._temp_dir.name, 'delta.csv')
+        counts = snapshotdiff.diff_bucket(os.path.join(self._previous_dir, 'ib-instr_usd_stk.csv'),
+                                          os.path.join(self._current_dir, 'ib-instr_usd_stk.csv'), delta_path,
+                                          memory_budget=20000, temp_dir=self._temp_dir.name)
+        expected_changed = sum(1 for con_id in con_ids[1000:2000] if con_id >= 1000)
+        self.assertEqual({'added': 1000, 'removed': 1000, 'changed': expected_changed, 'previous': 2000,
+                          'current': 2000}, counts)
+        delta = _read_csv(delta_path)
+        self.assertEqual(sorted(str(con_id) for con_id in con_ids[:1000]),
+                         [row['con_id'] for row in delta if row['change'] == 'removed'])
+        self.assertEqual(sorted(str(con_id) for con_id in con_ids[2000:]),
+                         [row['con_id'] for row in delta if row['change'] == 'added'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import random
+import tempfile
+import unittest
+
+import spillsort
+from spillsort import ExternalGrouper
+
+
+class TestExternalGrouper(unittest.TestCase):
+
+    def test_spilled_groups_sorted_and_stable(self):
+        rows = [(random.choice('EUR USD GBP'.split()), 'LABEL {:03d}'.format(random.randint(0, 200)), str(count))
+                for count in range(5000)]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with ExternalGrouper(lambda row: row[1], memory_budget=50000, temp_dir=temp_dir) as grouper:
+                for row in rows:
+                    grouper.add(row[0], row)
+
+                self.assertGreater(grouper.count_runs, 5)
+                self.assertEqual(list(dict.fromkeys(row[0] for row in rows)), grouper.group_keys())
+                for currency in grouper.group_keys():
+                    expected = sorted((row for row in rows if row[0] == currency), key=lambda row: row[1])
+                    self.assertEqual(expected, list(grouper.sorted_group(currency)))
+
+                self.assertEqual(1, len(os.listdir(temp_dir)))
+
+            self.assertEqual([], os.listdir(temp_dir))
+
+    def test_multiple_merge_passes(self):
+        rows = [(random.choice('EUR USD'.split()), 'LABEL {:03d}'.format(random.randint(0, 200)), str(count))
+                for count in range(5000)]
+        read_segment = spillsort._read_segment
+        open_segments = list()
+        max_open_segments = list()
+
+        def counted_read_segment(*segment):
+            open_segments.append(segment)
+            max_open_segments.append(len(open_segments))
+            try:
+                yield from read_segment(*segment)
+
+            finally:
+                open_segments.remove(segment)
+
+        spillsort._read_segment = counted_read_segment
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                with ExternalGrouper(lambda row: row[1], memory_budget=5000, temp_dir=temp_dir,
+                                     max_merge_runs=3) as grouper:
+                    for row in rows:
+                        grouper.add(row[0], row)
+
+                    self.assertGreater(grouper.count_runs, 20)
+                    for currency in grouper.group_keys():
+                        expected = sorted((row for row in rows if row[0] == currency), key=lambda row: row[1])
+                        self.assertEqual(expected, list(grouper.sorted_group(currency)))
+
+        finally:
+            spillsort._read_segment = read_segment
+
+        self.assertEqual(3, max(max_open_segments))
+        self.assertRaises(ValueError, ExternalGrouper, lambda row: row, memory_budget=1000, max_merge_runs=1)
+
+    def test_in_memory(self):
+        grouper = ExternalGrouper(lambda row: row[0], memory_budget=10 ** 9)
+        for row in [('b', 1), ('a', 2), ('b', 3)]:
+            grouper.add('key', row)
+
+        self.assertEqual([('a', 2), ('b', 1), ('b', 3)], list(grouper.sorted_group('key')))
+        self.assertEqual(0, grouper.count_runs)
+        grouper.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import time
+import unittest
+
+import ibdataloader
+from ibdataloader import Instrument, ProductType
+from recorded import load_recorded_pages, recorded_load_url
+from trigramindex import TrigramIndex, TrigramIndexBuilder, normalize, trigrams
+
+
+class TestTrigramIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._temp_dir = tempfile.TemporaryDirectory()
+        cls._index_path = os.path.join(cls._temp_dir.name, 'ib-instr.tri')
+        load_url = ibdataloader.load_url
+        ibdataloader.load_url = recorded_load_url(load_recorded_pages())
+        builder = TrigramIndexBuilder()
+        try:
+            ibdataloader.process_instruments([ProductType.STOCK, ProductType.ETF], lambda p, c, i: list(
+                builder.passing_through(p, c, i)))
+
+        finally:
+            ibdataloader.load_url = load_url
+
+        builder.write(cls._index_path)
+        cls._index = TrigramIndex(cls._index_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._index.close()
+        cls._temp_dir.cleanup()
+
+    def test_normalize(self):
+        self.assertEqual('BOEING CO THE', normalize('Boeing Co/The'))
+        self.assertEqual('SOCIETE GENERALE', normalize('Société  Générale'))
+        self.assertEqual(3, len(trigrams('a')) + len(trigrams('ab')))
+
+    def test_search(self):
+        self.assertEqual(15, len(self._index))
+        self.assertEqual('265598', self._index.search('APPLE INC')[0][0])
+        self.assertEqual(1., self._index.search('APPLE INC AAPL')[0][1])
+        self.assertEqual('265598', self._index.search('appel')[0][0])
+        self.assertEqual('4815747', self._index.search('nvidea')[0][0])
+        self.assertEqual('272093', self._index.search('MSFT')[0][0])
+        self.assertEqual('270662', self._index.search('brk.b')[0][0])
+        self.assertEqual([], self._index.search('zzzz'))
+        self.assertEqual([], self._index.search('  '))
+
+    def test_ranking(self):
+        results = self._index.search('CORP', k=3, min_overlap=1.)
+        self.assertEqual(3, len(results))
+        self.assertEqual(sorted(results, key=lambda result: -result[1]), results)
+        self.assertEqual({'272093', '4815747', '4065'}, {con_id for con_id, _ in results})
+        self.assertEqual(4, len(self._index.search('CORP', k=10, min_overlap=1.)))
+
+    def test_many_instruments(self):
+        builder = TrigramIndexBuilder()
+        words = ['HOLDINGS', 'GROUP', 'TRUST', 'CAPITAL', 'ENERGY', 'PHARMA', 'BANK', 'MINING', 'SYSTEMS']
+        for number in range(100000):
+            instrument = Instrument(con_id=str(number), label='{} {} {:05d}'.format(
+                words[number % len(words)], words[number // len(words) % len(words)], number), exchange='SMART')
+            instrument.symbol = 'S{}'.format(number)
+            builder.add(instrument)
+
+        path = os.path.join(self._temp_dir.name, 'many.tri')
+        builder.write(path)
+        with TrigramIndex(path) as index:
+            start = time.perf_counter()
+            results = index.search('BANK CAPITOL 12345')
+            elapsed = time.perf_counter() - start
+            self.assertEqual('12345', results[0][0])
+            self.assertLess(elapsed, 1.)
+
+
+if __name__ == '__main__':
+    unittest.main()